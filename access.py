@@ -0,0 +1,68 @@
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Tuple, Union
+
+from metrics import metrics
+
+metrics.describe("active_members", "Assinantes ativos no conjunto em memória")
+
+DateLike = Union[datetime, str]
+
+
+def _to_datetime(value: DateLike) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+class ActiveMembers:
+    """Conjunto em memória dos assinantes ativos (user_id -> expiração)
+
+    Consultado a cada pedido de entrada no grupo sem tocar no banco.
+    É carregado da tabela ``subscriptions`` na inicialização e mantido
+    atualizado pelas escritas de assinatura do ``Database``.
+    """
+
+    def __init__(self):
+        self._members: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def _export(self):
+        metrics.set_gauge("active_members", len(self._members))
+
+    def load(self, rows: Iterable[Tuple[int, DateLike]]):
+        """Substitui o conjunto pelos pares (user_id, expiration_date) informados"""
+        members = {}
+        for user_id, expiration_date in rows:
+            expiration = _to_datetime(expiration_date)
+            if expiration > members.get(user_id, datetime.min):
+                members[user_id] = expiration
+        with self._lock:
+            self._members = members
+            self._export()
+
+    def add(self, user_id: int, expiration_date: DateLike):
+        """Marca um usuário como ativo até ``expiration_date``"""
+        expiration = _to_datetime(expiration_date)
+        with self._lock:
+            if expiration > self._members.get(user_id, datetime.min):
+                self._members[user_id] = expiration
+            self._export()
+
+    def discard(self, user_id: int):
+        """Remove um usuário do conjunto"""
+        with self._lock:
+            self._members.pop(user_id, None)
+            self._export()
+
+    def is_active(self, user_id: int) -> bool:
+        """Verifica em O(1) se o usuário tem assinatura vigente"""
+        expiration = self._members.get(user_id)
+        return expiration is not None and expiration > datetime.now()
+
+
+# Instância global compartilhada pelo bot e pelo webhook
+active_members = ActiveMembers()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Backup online do banco SQLite (API de backup do SQLite, em passos).
+
+Só vale para DATABASE_BACKEND=sqlite; no PostgreSQL use pg_dump.
+
+Uso:
+  python backup.py backup
+  python backup.py list
+  python backup.py verify backups/subscriptions-20240101-030000.db.gz
+  python backup.py restore backups/subscriptions-20240101-030000.db.gz [--target subscriptions.db] [--force]
+"""
+
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from config import (
+    DATABASE_BACKEND, DATABASE_PATH, BACKUP_DIR, BACKUP_KEEP, BACKUP_INTERVAL_SECONDS,
+    BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP
+)
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("backup_runs_total", "Backups executados, por resultado")
+metrics.describe("backup_duration_seconds", "Duração do último backup")
+metrics.describe("backup_max_step_seconds", "Maior passo do último backup (tempo máximo de trava)")
+metrics.describe("backup_last_success_timestamp", "Horário (epoch) do último backup bem-sucedido")
+
+# Reinícios tolerados (o banco mudou no meio da cópia) antes de copiar de uma vez
+MAX_RESTARTS = 3
+SUFFIX = ".db.gz"
+# Nova tentativa após um backup com erro (limitada a BACKUP_INTERVAL_SECONDS)
+RETRY_SECONDS = 300
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+class BackupManager:
+    """Snapshots comprimidos e rotacionados do banco, sem parar o bot
+
+    A cópia usa ``sqlite3.Connection.backup`` com ``pages`` páginas por
+    passo; entre os passos a thread dorme ``step_sleep`` segundos e solta
+    o lock do banco, então escritores esperam no máximo um passo. O
+    relatório traz a duração total e o maior passo (a maior espera que um
+    escritor pode ter sofrido).
+    """
+
+    def __init__(self, db_path: str = DATABASE_PATH, backup_dir: str = BACKUP_DIR,
+                 keep: int = BACKUP_KEEP, pages: int = BACKUP_PAGES_PER_STEP,
+                 step_sleep: float = BACKUP_STEP_SLEEP):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self.pages = pages
+        self.step_sleep = step_sleep
+
+    def _copy(self, target: sqlite3.Connection) -> Dict[str, Any]:
+        """Copia o banco em passos e mede cada passo"""
+        source = sqlite3.connect(self.db_path)
+        stats = {"steps": 0, "restarts": 0, "max_step": 0.0, "locked_time": 0.0,
+                 "pages": 0, "single_step": False}
+        step_started = time.perf_counter()
+        last_remaining = None
+
+        def progress(status, remaining, total):
+            nonlocal step_started, last_remaining
+            step = time.perf_counter() - step_started
+            stats["steps"] += 1
+            stats["pages"] = total
+            stats["locked_time"] += step
+            stats["max_step"] = max(stats["max_step"], step)
+            if last_remaining is not None and remaining > last_remaining:
+                stats["restarts"] += 1
+                if stats["restarts"] > MAX_RESTARTS:
+                    raise _TooManyRestarts()
+            last_remaining = remaining
+            if remaining:
+                time.sleep(self.step_sleep)  # Solta o banco para os escritores
+            step_started = time.perf_counter()
+
+        try:
+            try:
+                source.backup(target, pages=self.pages, progress=progress)
+            except _TooManyRestarts:
+                # Banco mudando mais rápido que a cópia: faz em um passo só
+                stats["single_step"] = True
+                step_started = time.perf_counter()
+                source.backup(target)
+                step = time.perf_counter() - step_started
+                stats["locked_time"] += step
+                stats["max_step"] = max(stats["max_step"], step)
+        finally:
+            source.close()
+        return stats
+
+    def backup(self) -> Dict[str, Any]:
+        """Gera um snapshot comprimido e remove os mais antigos"""
+        started = time.perf_counter()
+        os.makedirs(self.backup_dir, exist_ok=True)
+        name = f"{os.path.splitext(os.path.basename(self.db_path))[0]}-{datetime.now():%Y%m%d-%H%M%S}"
+        final_path = os.path.join(self.backup_dir, name + SUFFIX)
+
+        fd, raw_path = tempfile.mkstemp(dir=self.backup_dir, suffix=".db.tmp")
+        os.close(fd)
+        try:
+            target = sqlite3.connect(raw_path)
+            try:
+                stats = self._copy(target)
+                integrity = target.execute("PRAGMA integrity_check").fetchone()[0]
+            finally:
+                target.close()
+            if integrity != "ok":
+                raise RuntimeError(f"Cópia corrompida: {integrity}")
+
+            with open(raw_path, "rb") as raw, gzip.open(final_path + ".tmp", "wb") as packed:
+                shutil.copyfileobj(raw, packed)
+            os.replace(final_path + ".tmp", final_path)
+        finally:
+            for leftover in (raw_path, final_path + ".tmp"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        removed = self.rotate()
+        stats.update({
+            "path": final_path,
+            "size": os.path.getsize(final_path),
+            "duration": time.perf_counter() - started,
+            "removed": removed
+        })
+        return stats
+
+    def list_backups(self) -> List[str]:
+        """Snapshots existentes, do mais novo para o mais antigo"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        names = [name for name in os.listdir(self.backup_dir) if name.endswith(SUFFIX)]
+        return [os.path.join(self.backup_dir, name) for name in sorted(names, reverse=True)]
+
+    def last_backup_time(self) -> Optional[float]:
+        """Horário (epoch) do snapshot mais novo, pelo nome do arquivo ou mtime"""
+        backups = self.list_backups()
+        if not backups:
+            return None
+        newest = backups[0]
+        stamp = os.path.basename(newest)[:-len(SUFFIX)].rsplit("-", 2)[-2:]
+        try:
+            return datetime.strptime("-".join(stamp), "%Y%m%d-%H%M%S").timestamp()
+        except ValueError:
+            return os.path.getmtime(newest)
+
+    def rotate(self) -> List[str]:
+        """Mantém apenas os ``keep`` snapshots mais recentes"""
+        removed = self.list_backups()[self.keep:]
+        for path in removed:
+            os.remove(path)
+        return removed
+
+    async def run(self):
+        """Executa backups periódicos em segundo plano
+
+        O intervalo conta a partir do snapshot mais novo: sem nenhum, ou com
+        o último mais velho que o intervalo, o primeiro backup sai já na
+        inicialização (reinícios frequentes não adiam os backups).
+        """
+        while True:
+            last = await asyncio.to_thread(self.last_backup_time)
+            if last is not None:
+                wait = min(last + BACKUP_INTERVAL_SECONDS - time.time(), BACKUP_INTERVAL_SECONDS)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            try:
+                report = await asyncio.to_thread(self.backup)
+                metrics.inc("backup_runs_total", result="ok")
+                metrics.set_gauge("backup_duration_seconds", report["duration"])
+                metrics.set_gauge("backup_max_step_seconds", report["max_step"])
+                metrics.set_gauge("backup_last_success_timestamp", time.time())
+                logger.info(format_report(report))
+            except Exception as e:
+                metrics.inc("backup_runs_total", result="error")
+                logger.error(f"Erro no backup do banco: {e}")
+                await asyncio.sleep(min(RETRY_SECONDS, BACKUP_INTERVAL_SECONDS))
+
+
+def _unpack(path: str) -> str:
+    """Descomprime um snapshot para um arquivo temporário"""
+    fd, raw_path = tempfile.mkstemp(suffix=".db")
+    with os.fdopen(fd, "wb") as raw, gzip.open(path, "rb") as packed:
+        shutil.copyfileobj(packed, raw)
+    return raw_path
+
+
+def verify(path: str) -> Dict[str, Any]:
+    """Confere a integridade de um snapshot e conta as linhas por tabela"""
+    raw_path = _unpack(path)
+    try:
+        conn = sqlite3.connect(raw_path)
+        integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        counts = {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+                  for table in tables}
+        conn.close()
+        return {"ok": integrity == "ok", "integrity": integrity, "tables": counts}
+    finally:
+        os.remove(raw_path)
+
+
+def restore(path: str, target: str = DATABASE_PATH, force: bool = False) -> Dict[str, Any]:
+    """Restaura um snapshot verificado sobre ``target``
+
+    A escrita no destino também usa a API de backup, que respeita os locks
+    de outras conexões; ainda assim, pare o bot e o webhook antes.
+    """
+    report = verify(path)
+    if not report["ok"]:
+        raise RuntimeError(f"Snapshot inválido: {report['integrity']}")
+    if os.path.exists(target) and not force:
+        raise FileExistsError(f"{target} já existe (use --force para sobrescrever)")
+
+    raw_path = _unpack(path)
+    try:
+        source = sqlite3.connect(raw_path)
+        destination = sqlite3.connect(target)
+        source.backup(destination)
+        destination.close()
+        source.close()
+    finally:
+        os.remove(raw_path)
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    text = (f"Backup {report['path']} ({report['size'] / 1024:.0f} KiB, {report['pages']} páginas) "
+            f"em {report['duration']:.2f}s; {report['steps']} passos, "
+            f"maior trava {report['max_step'] * 1000:.1f}ms, "
+            f"total travado {report['locked_time'] * 1000:.1f}ms")
+    if report["restarts"]:
+        text += f", {report['restarts']} reinício(s)"
+    if report["single_step"]:
+        text += " (cópia final em passo único)"
+    if report["removed"]:
+        text += f"; {len(report['removed'])} snapshot(s) antigo(s) removido(s)"
+    return text
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("backup", help="Gera um snapshot agora")
+    commands.add_parser("list", help="Lista os snapshots")
+    verify_parser = commands.add_parser("verify", help="Verifica um snapshot")
+    verify_parser.add_argument("path")
+    restore_parser = commands.add_parser("restore", help="Verifica e restaura um snapshot")
+    restore_parser.add_argument("path")
+    restore_parser.add_argument("--target", default=DATABASE_PATH)
+    restore_parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    if DATABASE_BACKEND != "sqlite":
+        print(f"Erro: backup.py copia o SQLite, mas DATABASE_BACKEND={DATABASE_BACKEND}",
+              file=sys.stderr)
+        return 1
+
+    manager = BackupManager()
+    try:
+        if args.command == "backup":
+            print(format_report(manager.backup()))
+        elif args.command == "list":
+            for path in manager.list_backups():
+                print(f"{path}  {os.path.getsize(path) / 1024:.0f} KiB")
+        elif args.command == "verify":
+            report = verify(args.path)
+            print(f"Integridade: {report['integrity']}")
+            for table, count in report["tables"].items():
+                print(f"  {table}: {count}")
+            return 0 if report["ok"] else 1
+        elif args.command == "restore":
+            report = restore(args.path, args.target, args.force)
+            print(f"Restaurado em {args.target}: " +
+                  ", ".join(f"{table}={count}" for table, count in report["tables"].items()))
+    except Exception as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark da renderização de mensagens e teclados por update:
+montagem a cada chamada (InlineKeyboardBuilder + f-strings, como era nos
+handlers) contra templates pré-compilados e teclados em cache (rendering).
+
+Uso: python bench_render.py [--number 20000] [--repeat 5]
+"""
+
+import argparse
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from config import PLANS
+from rendering import render, plans_keyboard, plan_summary_keyboard, payment_keyboard
+
+NOW = datetime.now()
+SUBSCRIPTION = {"plan_type": "monthly", "payment_date": NOW - timedelta(days=10),
+                "expiration_date": NOW + timedelta(days=20)}
+PAYMENT = {"plan_name": "Plano Mensal", "amount": 29.90, "payment_id": "123456789",
+           "pix_code": "00020126580014br.gov.bcb.pix0136" + "a" * 80}
+
+
+def build_plans_keyboard():
+    builder = InlineKeyboardBuilder()
+    for plan_id, plan_info in PLANS.items():
+        builder.add(InlineKeyboardButton(
+            text=f"{plan_info['name']} - R$ {plan_info['price']:.2f}",
+            callback_data=f"plan_{plan_id}"
+        ))
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def build_payment_keyboard(payment_id):
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="✅ Pagamento Confirmado",
+                                     callback_data=f"confirm_payment_{payment_id}"))
+    builder.add(InlineKeyboardButton(text="❌ Cancelar", callback_data="cancel_payment"))
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def before():
+    """Um /start, uma escolha de plano, um PIX e um /status, montados na hora"""
+    build_plans_keyboard()
+    plan_info = PLANS["monthly"]
+    (f"📋 Resumo do Plano Selecionado:\n\n"
+     f"📦 Plano: {plan_info['name']}\n"
+     f"💰 Valor: R$ {plan_info['price']:.2f}\n"
+     f"⏰ Duração: {plan_info['days']} dias\n\n"
+     f"Para continuar, clique em 'Gerar PIX' para receber o código de pagamento.")
+    InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="💳 Gerar PIX", callback_data="generate_pix")],
+        [InlineKeyboardButton(text="🔙 Voltar", callback_data="back_to_plans")]
+    ])
+    (f"💳 Pagamento PIX Gerado!\n\n"
+     f"📦 Plano: {PAYMENT['plan_name']}\n"
+     f"💰 Valor: R$ {PAYMENT['amount']:.2f}\n"
+     f"🆔 ID do Pagamento: {PAYMENT['payment_id']}\n\n"
+     f"📋 Código PIX (Copie e Cole):\n"
+     f"`{PAYMENT['pix_code']}`\n\n"
+     f"⚠️ IMPORTANTE:\n"
+     f"• Copie o código acima\n"
+     f"• Abra seu app bancário\n"
+     f"• Cole o código no PIX\n"
+     f"• Confirme o pagamento\n\n"
+     f"Após o pagamento, clique em 'Confirmar Pagamento' abaixo.")
+    build_payment_keyboard(PAYMENT["payment_id"])
+    (f"📊 Status da Sua Assinatura:\n\n"
+     f"✅ Status: Ativa\n"
+     f"📦 Plano: {SUBSCRIPTION['plan_type']}\n"
+     f"📅 Data de início: {SUBSCRIPTION['payment_date'].strftime('%d/%m/%Y')}\n"
+     f"📅 Data de expiração: {SUBSCRIPTION['expiration_date'].strftime('%d/%m/%Y')}\n"
+     f"⏰ Dias restantes: 20\n\n"
+     f"🔗 Link do grupo: https://t.me/+grupo")
+
+
+def after():
+    """O mesmo fluxo com templates compilados e teclados em cache"""
+    plans_keyboard(PLANS)
+    plan_info = PLANS["monthly"]
+    render("plan_summary", name=plan_info["name"], price=plan_info["price"],
+           days=plan_info["days"])
+    plan_summary_keyboard()
+    render("pix_generated", plan_name=PAYMENT["plan_name"], amount=PAYMENT["amount"],
+           payment_id=PAYMENT["payment_id"], pix_code=PAYMENT["pix_code"])
+    payment_keyboard(PAYMENT["payment_id"])
+    render("status", plan=SUBSCRIPTION["plan_type"], start=SUBSCRIPTION["payment_date"],
+           expiration=SUBSCRIPTION["expiration_date"], days_left=20,
+           link="https://t.me/+grupo")
+
+
+def best_us(func, number: int, repeat: int) -> float:
+    """Melhor tempo por chamada (µs) entre ``repeat`` rodadas"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cases = [
+        ("teclado de planos", build_plans_keyboard, lambda: plans_keyboard(PLANS)),
+        ("teclado de pagamento", lambda: build_payment_keyboard(PAYMENT["payment_id"]),
+         lambda: payment_keyboard(PAYMENT["payment_id"])),
+        ("fluxo completo (4 updates)", before, after)
+    ]
+
+    print(f"{'caso':<28} {'antes (µs)':>11} {'depois (µs)':>12} {'economia':>10}")
+    for name, old, new in cases:
+        old_us = best_us(old, args.number, args.repeat)
+        new_us = best_us(new, args.number, args.repeat)
+        print(f"{name:<28} {old_us:>11.2f} {new_us:>12.2f} {old_us - new_us:>9.2f}µs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,80 @@
 import asyncio
 import logging
-from datetime import datetime, timedelta
+from functools import lru_cache
+from datetime import datetime
+from typing import Any, Dict, Optional
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
-from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.exceptions import TelegramForbiddenError
 
-from config import BOT_TOKEN, ADMIN_ID, GROUP_INVITE_LINK, RENEWAL_WARNING_DAYS
-from database import Database
-from payments import PaymentManager
+from config import BOT_TOKEN, ADMIN_ID, GROUP_ID, GROUP_INVITE_LINK, DATABASE_PATH, DATABASE_BACKEND
+from storage import get_database
+from access import active_members
+from invite_pool import InviteLinkPool
+from renewal_scheduler import RenewalScheduler
+from broadcast import BroadcastStore, Broadcaster
+from backup import BackupManager
+from membership_audit import GroupRoster, MembershipAuditor, member_status, format_report
+from qr_images import QrPhotoCache, edit_text_or_caption, edit_message_by_id
+from events import PAYMENT_APPROVED, get_event_bus
+from rendering import (
+    render, get_locale, plans_keyboard, plan_summary_keyboard, payment_keyboard,
+    payment_retry_keyboard
+)
+from metrics import metrics
+from payments import get_payment_manager
+from throttling import ThrottlingMiddleware
+from loop_monitor import start_loop_monitor
+from logging_setup import bind, setup_logging
 
-# Configuração de logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Inicialização do bot
-bot = Bot(token=BOT_TOKEN)
+# Inicialização do dispatcher (barata; Bot e serviços são criados sob demanda)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
-# Instâncias dos módulos
-db = Database("subscriptions.db")
-payment_manager = PaymentManager()
+# Throttling por usuário/ação antes de qualquer handler
+throttling = ThrottlingMiddleware()
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+
+metrics.describe("join_requests_total", "Pedidos de entrada no grupo respondidos, por resultado")
+
+# Instâncias dos módulos, criadas no primeiro uso (importar o módulo não
+# abre conexões, não executa DDL e não carrega o SDK do Mercado Pago)
+@lru_cache(maxsize=None)
+def get_bot() -> Bot:
+    return Bot(token=BOT_TOKEN)
+
+def get_db():
+    """Backend compartilhado com o webhook (mesma instância no processo)"""
+    return get_database()
+
+@lru_cache(maxsize=None)
+def get_invite_pool() -> InviteLinkPool:
+    return InviteLinkPool(get_db().sql, get_bot())
+
+@lru_cache(maxsize=None)
+def get_broadcaster() -> Broadcaster:
+    return Broadcaster(get_bot(), get_db(), BroadcastStore(get_db().sql))
+
+@lru_cache(maxsize=None)
+def get_backup_manager() -> BackupManager:
+    return BackupManager(DATABASE_PATH)
+
+@lru_cache(maxsize=None)
+def get_roster() -> GroupRoster:
+    return GroupRoster(get_db().sql)
+
+@lru_cache(maxsize=None)
+def get_auditor() -> MembershipAuditor:
+    return MembershipAuditor(get_bot(), get_db(), get_roster())
+
+# file_id das fotos de QR Code já enviadas, por pagamento
+qr_cache = QrPhotoCache()
 
 # Estados para o FSM
 class SubscriptionStates(StatesGroup):
@@ -32,69 +82,35 @@ class SubscriptionStates(StatesGroup):
     processing_payment = State()
 
 # Função para criar teclado de planos
-def create_plans_keyboard():
-    """Cria teclado inline com os planos disponíveis"""
-    builder = InlineKeyboardBuilder()
-    
-    plans = payment_manager.get_all_plans()
-    for plan_id, plan_info in plans.items():
-        builder.add(InlineKeyboardButton(
-            text=f"{plan_info['name']} - R$ {plan_info['price']:.2f}",
-            callback_data=f"plan_{plan_id}"
-        ))
-    
-    builder.adjust(1)
-    return builder.as_markup()
-
-# Função para criar teclado de pagamento
-def create_payment_keyboard(payment_id: str):
-    """Cria teclado para o pagamento"""
-    builder = InlineKeyboardBuilder()
-    
-    builder.add(InlineKeyboardButton(
-        text="✅ Pagamento Confirmado",
-        callback_data=f"confirm_payment_{payment_id}"
-    ))
-    
-    builder.add(InlineKeyboardButton(
-        text="❌ Cancelar",
-        callback_data="cancel_payment"
-    ))
-    
-    builder.adjust(1)
-    return builder.as_markup()
+def create_plans_keyboard(locale: str):
+    """Teclado inline com os planos disponíveis (em cache por idioma e planos)"""
+    return plans_keyboard(get_payment_manager().get_all_plans(), locale)
 
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
     """Comando inicial do bot"""
     user_id = message.from_user.id
+    locale = get_locale(message.from_user.language_code)
     
     # Verifica se o usuário já tem uma assinatura ativa
-    subscription = await db.get_subscription(user_id)
+    subscription = await get_db().get_subscription(user_id)
     
     if subscription:
         # Usuário já tem assinatura ativa
         days_left = (subscription["expiration_date"] - datetime.now()).days
         
-        await message.answer(
-            f"🎉 Olá! Você já possui uma assinatura ativa!\n\n"
-            f"📅 Plano: {subscription['plan_type']}\n"
-            f"⏰ Dias restantes: {days_left}\n"
-            f"📅 Expira em: {subscription['expiration_date'].strftime('%d/%m/%Y')}\n\n"
-            f"🔗 Link do grupo: {GROUP_INVITE_LINK}\n\n"
-            f"Use /status para ver mais detalhes da sua assinatura."
-        )
+        await message.answer(render(
+            "already_active", locale,
+            plan=subscription["plan_type"],
+            days_left=days_left,
+            expiration=subscription["expiration_date"],
+            link=GROUP_INVITE_LINK
+        ))
     else:
         # Usuário não tem assinatura, mostra planos
         await message.answer(
-            "🚀 Bem-vindo ao Grupo Privado!\n\n"
-            "Para acessar nosso conteúdo exclusivo, escolha um dos planos abaixo:\n\n"
-            "💎 Acesso a conteúdo premium\n"
-            "📱 Suporte exclusivo\n"
-            "🎯 Estratégias avançadas\n"
-            "📊 Análises detalhadas\n\n"
-            "Escolha seu plano:",
-            reply_markup=create_plans_keyboard()
+            render("welcome", locale),
+            reply_markup=create_plans_keyboard(locale)
         )
 
 @dp.callback_query(F.data.startswith("plan_"))
@@ -105,21 +121,16 @@ async def process_plan_selection(callback: types.CallbackQuery, state: FSMContex
     # Armazena o plano selecionado
     await state.update_data(selected_plan=plan_id)
     
-    plan_info = payment_manager.get_plan_info(plan_id)
+    plan_info = get_payment_manager().get_plan_info(plan_id)
     if not plan_info:
         await callback.answer("Plano não encontrado!")
         return
     
+    locale = get_locale(callback.from_user.language_code)
     await callback.message.edit_text(
-        f"📋 Resumo do Plano Selecionado:\n\n"
-        f"📦 Plano: {plan_info['name']}\n"
-        f"💰 Valor: R$ {plan_info['price']:.2f}\n"
-        f"⏰ Duração: {plan_info['days']} dias\n\n"
-        f"Para continuar, clique em 'Gerar PIX' para receber o código de pagamento.",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="💳 Gerar PIX", callback_data="generate_pix")],
-            [InlineKeyboardButton(text="🔙 Voltar", callback_data="back_to_plans")]
-        ])
+        render("plan_summary", locale, name=plan_info["name"], price=plan_info["price"],
+               days=plan_info["days"]),
+        reply_markup=plan_summary_keyboard(locale)
     )
 
 @dp.callback_query(F.data == "generate_pix")
@@ -137,110 +148,195 @@ async def generate_pix_payment(callback: types.CallbackQuery, state: FSMContext)
         "last_name": callback.from_user.last_name or "Telegram"
     }
     
-    # Gera o pagamento PIX
-    payment_result = payment_manager.generate_pix_payment(
+    # Gera o pagamento PIX (em thread, para não bloquear o event loop)
+    payment_result = await asyncio.to_thread(
+        get_payment_manager().generate_pix_payment,
         callback.from_user.id, plan_id, user_info
     )
     
+    if payment_result.get("retry_later"):
+        await callback.answer(
+            "⏳ O sistema de pagamentos está instável. Tente novamente em instantes.",
+            show_alert=True
+        )
+        return
+    
+    locale = get_locale(callback.from_user.language_code)
     if not payment_result["success"]:
         await callback.message.edit_text(
-            f"❌ Erro ao gerar pagamento: {payment_result['error']}\n\n"
-            "Tente novamente ou entre em contato com o suporte."
+            render("pix_error", locale, error=payment_result["error"])
         )
         return
     
     # Salva o pagamento no banco
-    await db.add_payment(
+    await get_db().add_payment(
         user_id=callback.from_user.id,
         payment_id=payment_result["payment_id"],
         plan_type=plan_id,
         amount=payment_result["amount"],
-        pix_code=payment_result["pix_code"]
+        pix_code=payment_result["pix_code"],
+        qr_code_base64=payment_result.get("qr_code_base64"),
+        locale=locale
     )
     
     # Armazena o ID do pagamento
     await state.update_data(payment_id=payment_result["payment_id"])
     
     # Envia o código PIX
-    pix_message = (
-        f"💳 Pagamento PIX Gerado!\n\n"
-        f"📦 Plano: {payment_result['plan_name']}\n"
-        f"💰 Valor: R$ {payment_result['amount']:.2f}\n"
-        f"🆔 ID do Pagamento: {payment_result['payment_id']}\n\n"
-        f"📋 Código PIX (Copie e Cole):\n"
-        f"`{payment_result['pix_code']}`\n\n"
-        f"⚠️ IMPORTANTE:\n"
-        f"• Copie o código acima\n"
-        f"• Abra seu app bancário\n"
-        f"• Cole o código no PIX\n"
-        f"• Confirme o pagamento\n\n"
-        f"Após o pagamento, clique em 'Confirmar Pagamento' abaixo."
+    pix_message = render(
+        "pix_generated", locale,
+        plan_name=payment_result["plan_name"],
+        amount=payment_result["amount"],
+        payment_id=payment_result["payment_id"],
+        pix_code=payment_result["pix_code"]
     )
     
-    await callback.message.edit_text(
-        pix_message,
-        parse_mode="Markdown",
-        reply_markup=create_payment_keyboard(payment_result["payment_id"])
+    # Envia o QR Code como foto (imagem decodificada fora do event loop)
+    photo_message = None
+    try:
+        photo_message = await send_payment_qr(
+            callback.bot, callback.message.chat.id,
+            {"payment_id": payment_result["payment_id"],
+             "qr_code_base64": payment_result.get("qr_code_base64"),
+             "pix_code": payment_result["pix_code"]},
+            caption=pix_message,
+            parse_mode="Markdown",
+            reply_markup=payment_keyboard(payment_result["payment_id"], locale)
+        )
+    except Exception as e:
+        logger.error(f"Erro ao enviar QR Code do pagamento {payment_result['payment_id']}: {e}")
+    
+    if photo_message is not None:
+        await callback.message.delete()
+        payment_message = photo_message
+    else:
+        payment_message = await callback.message.edit_text(
+            pix_message,
+            parse_mode="Markdown",
+            reply_markup=payment_keyboard(payment_result["payment_id"], locale)
+        )
+    
+    # Mensagem que o bot edita quando o webhook aprovar o pagamento
+    await get_db().set_payment_message(
+        payment_result["payment_id"], payment_message.chat.id, payment_message.message_id
     )
 
 @dp.callback_query(F.data.startswith("confirm_payment_"))
 async def confirm_payment(callback: types.CallbackQuery, state: FSMContext):
     """Confirma o pagamento manualmente"""
     payment_id = callback.data.split("_")[2]
+    bind(payment_id=payment_id, user_id=callback.from_user.id)
     
     # Verifica o status do pagamento no Mercado Pago
-    payment_info = await db.get_payment_by_id(payment_id)
-    if not payment_info:
+    payment_info = await get_db().get_payment_by_id(payment_id)
+    if not payment_info or payment_info["user_id"] != callback.from_user.id:
         await callback.answer("Pagamento não encontrado!")
         return
     
-    # Verifica se o pagamento foi aprovado
-    mp_result = payment_manager.verify_payment(payment_info["payment_id"])
+    # Verifica se o pagamento foi aprovado (já aprovado pelo webhook: sem consultar o MP)
+    if payment_info["status"] == "approved":
+        mp_result = {"success": True, "status": "approved"}
+    else:
+        mp_result = await asyncio.to_thread(
+            get_payment_manager().verify_payment, payment_info["payment_id"]
+        )
+    
+    if mp_result.get("retry_later"):
+        await callback.answer(
+            "⏳ Não conseguimos consultar o pagamento agora. Tente novamente em instantes.",
+            show_alert=True
+        )
+        return
     
+    locale = get_locale(callback.from_user.language_code)
     if mp_result["success"] and mp_result["status"] == "approved":
-        # Pagamento aprovado, cria a assinatura
-        plan_info = payment_manager.get_plan_info(payment_info["plan_type"])
-        payment_date = datetime.now()
-        expiration_date = payment_date + timedelta(days=plan_info["days"])
+        # Pagamento aprovado: cria ou estende a assinatura (uma vez por pagamento)
+        plan_info = get_payment_manager().get_plan_info(payment_info["plan_type"])
         
-        success = await db.add_subscription(
+        expiration_date = await get_db().renew_subscription(
             user_id=callback.from_user.id,
-            username=callback.from_user.username or f"user_{callback.from_user.id}",
-            first_name=callback.from_user.first_name or "Usuário",
-            last_name=callback.from_user.last_name or "Telegram",
+            username=callback.from_user.username,
+            first_name=callback.from_user.first_name,
+            last_name=callback.from_user.last_name,
             plan_type=payment_info["plan_type"],
-            payment_date=payment_date,
-            expiration_date=expiration_date,
+            days=plan_info["days"],
             payment_id=payment_id
         )
         
-        if success:
-            await callback.message.edit_text(
-                f"🎉 Pagamento Confirmado!\n\n"
-                f"✅ Sua assinatura foi ativada com sucesso!\n"
-                f"📅 Expira em: {expiration_date.strftime('%d/%m/%Y')}\n\n"
-                f"🔗 Link do Grupo Privado:\n{GROUP_INVITE_LINK}\n\n"
-                f"Bem-vindo ao grupo! Use /status para ver detalhes da sua assinatura."
+        if expiration_date:
+            # Link de uso único já pronto no pool; o link fixo é o fallback
+            invite_link = await get_invite_pool().take(callback.from_user.id, payment_id)
+            
+            await edit_text_or_caption(
+                callback.message,
+                render("payment_confirmed", locale, expiration=expiration_date,
+                       link=invite_link or GROUP_INVITE_LINK)
             )
         else:
-            await callback.message.edit_text(
-                "❌ Erro ao ativar assinatura. Entre em contato com o suporte."
-            )
+            await edit_text_or_caption(callback.message, render("activation_error", locale))
     else:
-        await callback.message.edit_text(
-            "❌ Pagamento não confirmado!\n\n"
-            "O pagamento ainda não foi processado. Aguarde alguns minutos e tente novamente, "
-            "ou entre em contato com o suporte se já realizou o pagamento."
+        await edit_text_or_caption(
+            callback.message,
+            render("payment_not_confirmed", locale),
+            reply_markup=payment_retry_keyboard(payment_id, locale)
+        )
+
+async def send_payment_qr(bot, chat_id: int, payment: Dict[str, Any], caption: str,
+                          **kwargs) -> Optional[types.Message]:
+    """Envia o QR de um pagamento e grava o file_id no banco após o upload
+    
+    Com o file_id (ou a imagem) no registro do pagamento, o QR continua
+    disponível depois de um reinício do bot.
+    """
+    message = await qr_cache.send(
+        bot, chat_id, payment["payment_id"], caption=caption,
+        qr_code_base64=payment.get("qr_code_base64"),
+        pix_code=payment.get("pix_code"),
+        file_id=payment.get("qr_file_id"),
+        **kwargs
+    )
+    if message is not None and message.photo:
+        file_id = message.photo[-1].file_id
+        if file_id != payment.get("qr_file_id"):
+            await get_db().set_payment_qr_file_id(payment["payment_id"], file_id)
+    return message
+
+@dp.callback_query(F.data.startswith("show_qr_"))
+async def show_qr(callback: types.CallbackQuery):
+    """Reenvia o QR Code de um pagamento (file_id gravado: sem upload)"""
+    payment_id = callback.data.split("_")[2]
+    
+    payment_info = await get_db().get_payment_by_id(payment_id)
+    if not payment_info or payment_info["user_id"] != callback.from_user.id:
+        await callback.answer("Pagamento não encontrado!")
+        return
+    
+    locale = get_locale(callback.from_user.language_code)
+    pix_text = render("pix_code", locale, pix_code=payment_info["pix_code"])
+    photo_message = await send_payment_qr(
+        callback.bot, callback.message.chat.id, payment_info,
+        caption=pix_text,
+        parse_mode="Markdown",
+        reply_markup=payment_keyboard(payment_id, locale)
+    )
+    
+    if photo_message is None:
+        photo_message = await callback.message.answer(
+            pix_text,
+            parse_mode="Markdown",
+            reply_markup=payment_keyboard(payment_id, locale)
         )
+    await get_db().set_payment_message(payment_id, photo_message.chat.id, photo_message.message_id)
+    await callback.answer()
 
 @dp.callback_query(F.data == "cancel_payment")
 async def cancel_payment(callback: types.CallbackQuery, state: FSMContext):
     """Cancela o pagamento"""
     await state.clear()
     
-    await callback.message.edit_text(
-        "❌ Pagamento cancelado!\n\n"
-        "Use /start para escolher um plano novamente."
+    await edit_text_or_caption(
+        callback.message,
+        render("payment_cancelled", get_locale(callback.from_user.language_code))
     )
 
 @dp.callback_query(F.data == "back_to_plans")
@@ -248,47 +344,37 @@ async def back_to_plans(callback: types.CallbackQuery, state: FSMContext):
     """Volta para a seleção de planos"""
     await state.clear()
     
+    locale = get_locale(callback.from_user.language_code)
     await callback.message.edit_text(
-        "🚀 Escolha seu plano:\n\n"
-        "💎 Acesso a conteúdo premium\n"
-        "📱 Suporte exclusivo\n"
-        "🎯 Estratégias avançadas\n"
-        "📊 Análises detalhadas\n\n"
-        "Escolha seu plano:",
-        reply_markup=create_plans_keyboard()
+        render("choose_plan", locale),
+        reply_markup=create_plans_keyboard(locale)
     )
 
 @dp.message(Command("status"))
 async def cmd_status(message: types.Message):
     """Comando para verificar status da assinatura"""
     user_id = message.from_user.id
+    locale = get_locale(message.from_user.language_code)
     
-    subscription = await db.get_subscription(user_id)
+    subscription = await get_db().get_subscription(user_id)
     
     if not subscription:
-        await message.answer(
-            "❌ Você não possui uma assinatura ativa.\n\n"
-            "Use /start para escolher um plano."
-        )
+        await message.answer(render("no_subscription", locale))
         return
     
     days_left = (subscription["expiration_date"] - datetime.now()).days
     
     if days_left <= 0:
-        await message.answer(
-            "⚠️ Sua assinatura expirou!\n\n"
-            "Use /start para renovar sua assinatura."
-        )
+        await message.answer(render("subscription_expired", locale))
     else:
-        await message.answer(
-            f"📊 Status da Sua Assinatura:\n\n"
-            f"✅ Status: Ativa\n"
-            f"📦 Plano: {subscription['plan_type']}\n"
-            f"📅 Data de início: {subscription['payment_date'].strftime('%d/%m/%Y')}\n"
-            f"📅 Data de expiração: {subscription['expiration_date'].strftime('%d/%m/%Y')}\n"
-            f"⏰ Dias restantes: {days_left}\n\n"
-            f"🔗 Link do grupo: {GROUP_INVITE_LINK}"
-        )
+        await message.answer(render(
+            "status", locale,
+            plan=subscription["plan_type"],
+            start=subscription["payment_date"],
+            expiration=subscription["expiration_date"],
+            days_left=days_left,
+            link=GROUP_INVITE_LINK
+        ))
 
 @dp.message(Command("vendas"))
 async def cmd_sales(message: types.Message):
@@ -297,7 +383,7 @@ async def cmd_sales(message: types.Message):
         await message.answer("❌ Acesso negado!")
         return
     
-    sales_summary = await db.get_sales_summary()
+    sales_summary = await get_db().get_sales_summary()
     
     if not sales_summary:
         await message.answer("❌ Erro ao obter dados de vendas!")
@@ -317,28 +403,99 @@ async def cmd_sales(message: types.Message):
     
     await message.answer(summary_text)
 
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: types.Message):
+    """Comando para admin enviar uma mensagem a todos os assinantes ativos"""
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ Acesso negado!")
+        return
+    
+    text = (message.text or "").partition(" ")[2].strip()
+    if not text:
+        await message.answer("Uso: /broadcast <mensagem>")
+        return
+    
+    status_message = await message.answer("📣 Iniciando broadcast...")
+    broadcaster = get_broadcaster()
+    broadcast_id = await broadcaster.store.create(text, message.chat.id, status_message.message_id)
+    broadcaster.start(broadcast_id)
+
+@dp.message(Command("auditoria"))
+async def cmd_audit(message: types.Message):
+    """Comando para admin auditar membros do grupo sem assinatura ativa
+    
+    ``/auditoria`` só relata; ``/auditoria remover`` remove quem sobrar.
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ Acesso negado!")
+        return
+    
+    dry_run = (message.text or "").partition(" ")[2].strip().lower() != "remover"
+    status_message = await message.answer("🔍 Auditando membros do grupo...")
+    try:
+        report = await get_auditor().audit(dry_run=dry_run)
+    except Exception as e:
+        logger.error(f"Erro na auditoria de membros: {e}")
+        await status_message.edit_text(f"❌ Auditoria não concluída (nada foi removido): {e}")
+        return
+    
+    text = format_report(report)
+    if dry_run and report["intruders"]:
+        text += "\nUse /auditoria remover para removê-los."
+    await status_message.edit_text(text)
+
+@dp.chat_member()
+async def handle_chat_member(update: types.ChatMemberUpdated):
+    """Mantém o roster do grupo a partir das entradas e saídas"""
+    if str(update.chat.id) != str(GROUP_ID):
+        return
+    
+    member = update.new_chat_member
+    try:
+        await get_roster().update(member.user.id, member_status(member), member.user.is_bot)
+    except Exception as e:
+        logger.error(f"Erro ao atualizar roster para {member.user.id}: {e}")
+
+@dp.chat_join_request()
+async def handle_join_request(join_request: types.ChatJoinRequest):
+    """Aprova ou recusa pedidos de entrada no grupo conforme a assinatura"""
+    if str(join_request.chat.id) != str(GROUP_ID):
+        return
+    
+    user_id = join_request.from_user.id
+    
+    # Consulta O(1) em memória: rajadas de pedidos não tocam o banco
+    try:
+        if active_members.is_active(user_id):
+            await join_request.approve()
+            metrics.inc("join_requests_total", result="approved")
+        else:
+            await join_request.decline()
+            metrics.inc("join_requests_total", result="declined")
+    except Exception as e:
+        logger.error(f"Erro ao responder pedido de entrada de {user_id}: {e}")
+
 async def check_expired_subscriptions():
     """Verifica assinaturas expiradas e remove usuários do grupo"""
     while True:
         try:
-            expired_subscriptions = await db.get_expired_subscriptions()
-            
-            for subscription in expired_subscriptions:
+            # Lidas em páginas (keyset): a remoção começa na primeira página
+            async for subscription in get_db().iter_expired_subscriptions():
                 user_id = subscription["user_id"]
                 
                 # Atualiza status da assinatura
-                await db.update_subscription_status(user_id, "expired")
+                await get_db().update_subscription_status(user_id, "expired")
                 
                 # Tenta remover do grupo (se o bot for admin)
                 try:
-                    await bot.ban_chat_member(GROUP_ID, user_id)
+                    await get_bot().ban_chat_member(GROUP_ID, user_id)
                     logger.info(f"Usuário {user_id} removido do grupo por assinatura expirada")
                 except Exception as e:
                     logger.error(f"Erro ao remover usuário {user_id} do grupo: {e}")
                 
                 # Envia mensagem de aviso
                 try:
-                    await bot.send_message(
+                    await get_bot().send_message(
                         user_id,
                         "⚠️ Sua assinatura expirou!\n\n"
                         "Você foi removido do grupo privado. "
@@ -347,61 +504,85 @@ async def check_expired_subscriptions():
                 except Exception as e:
                     logger.error(f"Erro ao enviar mensagem para usuário {user_id}: {e}")
             
+            # Recarrega o conjunto de membros ativos (captura escritas de outros processos)
+            active_members.load(await get_db().get_active_members())
+            
             # Aguarda 1 hora antes da próxima verificação
             await asyncio.sleep(3600)
             
         except Exception as e:
+            # Varredura interrompida: as páginas que faltam são lidas na próxima
             logger.error(f"Erro na verificação de assinaturas expiradas: {e}")
-            await asyncio.sleep(3600)
+            await asyncio.sleep(300)
 
-async def send_renewal_warnings():
-    """Envia avisos de renovação"""
-    while True:
-        try:
-            for days in RENEWAL_WARNING_DAYS:
-                expiring_subscriptions = await db.get_subscriptions_expiring_soon(days)
-                
-                for subscription in expiring_subscriptions:
-                    user_id = subscription["user_id"]
-                    
-                    # Verifica se já enviou notificação recente
-                    notification_sent = await db.has_recent_notification(
-                        user_id, f"renewal_warning_{days}d"
-                    )
-                    
-                    if not notification_sent:
-                        try:
-                            await bot.send_message(
-                                user_id,
-                                f"⚠️ Aviso de Renovação!\n\n"
-                                f"Sua assinatura expira em {days} dia(s).\n"
-                                f"Para continuar acessando o grupo privado, "
-                                f"renove sua assinatura usando /start"
-                            )
-                            
-                            # Registra a notificação
-                            await db.add_notification(
-                                user_id, f"renewal_warning_{days}d"
-                            )
-                            
-                        except Exception as e:
-                            logger.error(f"Erro ao enviar aviso para usuário {user_id}: {e}")
-            
-            # Aguarda 12 horas antes da próxima verificação
-            await asyncio.sleep(43200)
-            
-        except Exception as e:
-            logger.error(f"Erro no envio de avisos de renovação: {e}")
-            await asyncio.sleep(43200)
+async def deliver_activation(event: dict):
+    """Entrega o acesso de um pagamento aprovado pelo webhook
+
+    Edita a mensagem do pagamento (ou envia uma nova, se ela não existir
+    mais). Idempotente: o link é o mesmo reservado para o pagamento.
+    """
+    user_id = event["user_id"]
+    payment_id = event["payment_id"]
+    expiration_date = datetime.fromisoformat(event["expiration_date"])
+    
+    # Webhook em outro processo: o conjunto deste processo ainda não sabe
+    active_members.add(user_id, expiration_date)
+    
+    invite_link = await get_invite_pool().take(user_id, payment_id)
+    # Idioma gravado no pagamento (eventos antigos não o trazem)
+    text = render("payment_confirmed", get_locale(event.get("locale")),
+                  expiration=expiration_date, link=invite_link or GROUP_INVITE_LINK)
+    
+    payment = await get_db().get_payment_by_id(payment_id)
+    if payment and payment.get("message_id"):
+        if await edit_message_by_id(get_bot(), payment["chat_id"], payment["message_id"], text):
+            return
+    try:
+        await get_bot().send_message(user_id, text)
+    except TelegramForbiddenError as e:
+        # Usuário bloqueou o bot: o acesso já vale, não há a quem avisar
+        logger.warning(f"Ativação do pagamento {payment_id} não entregue a {user_id}: {e}")
+
+async def send_renewal_warning(user_id: int, days: int) -> bool:
+    """Envia um aviso de renovação"""
+    try:
+        await get_bot().send_message(
+            user_id,
+            f"⚠️ Aviso de Renovação!\n\n"
+            f"Sua assinatura expira em {days} dia(s).\n"
+            f"Para continuar acessando o grupo privado, "
+            f"renove sua assinatura usando /start"
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao enviar aviso para usuário {user_id}: {e}")
+        return False
 
 async def main():
     """Função principal"""
+    start_loop_monitor("bot")
+    
+    # Carrega os assinantes ativos antes de receber pedidos de entrada
+    active_members.load(await get_db().get_active_members())
+    
+    # Aprovações publicadas pelo webhook (mesmo processo ou outro)
+    get_event_bus().subscribe(PAYMENT_APPROVED, deliver_activation)
+    
     # Inicia as tarefas em background
     asyncio.create_task(check_expired_subscriptions())
-    asyncio.create_task(send_renewal_warnings())
+    asyncio.create_task(RenewalScheduler(get_db(), send_renewal_warning).run())
+    asyncio.create_task(get_invite_pool().run())
+    asyncio.create_task(get_auditor().run())
+    asyncio.create_task(get_event_bus().run())
+    if DATABASE_BACKEND == "sqlite":
+        asyncio.create_task(get_backup_manager().run())
+    
+    # Retoma broadcasts interrompidos por um reinício
+    await get_broadcaster().resume_all()
     
     # Inicia o bot
-    await dp.start_polling(bot)
+    await dp.start_polling(get_bot(), allowed_updates=dp.resolve_used_update_types())
 
 if __name__ == "__main__":
+    setup_logging()
     asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest, TelegramRetryAfter
+
+from config import BROADCAST_RATE, BROADCAST_WORKERS, BROADCAST_PAGE_SIZE
+from metrics import metrics
+from ratelimit import TokenBucket
+from sql_store import SqlStore
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("broadcast_messages_total", "Mensagens de broadcast, por resultado")
+
+REPORT_INTERVAL = 5.0  # Segundos entre atualizações do relatório para o admin
+PAGE_READ_ATTEMPTS = 5  # Leituras de uma página de destinatários antes de interromper
+PAGE_READ_BACKOFF = 1.0  # Espera antes da 2ª leitura (dobra a cada falha)
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id {id},
+        text TEXT NOT NULL,
+        admin_chat_id {bigint} NOT NULL,
+        status_message_id {bigint},
+        status TEXT DEFAULT 'running',
+        last_user_id {bigint} DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        created_at {datetime} DEFAULT CURRENT_TIMESTAMP,
+        updated_at {datetime} DEFAULT CURRENT_TIMESTAMP
+    )
+    '''
+]
+
+
+class BroadcastStore:
+    """Checkpoints dos broadcasts na tabela ``broadcasts``
+
+    ``last_user_id`` marca até onde a lista de destinatários (ordenada por
+    user_id) já foi processada; um reinício continua a partir dele.
+    """
+
+    def __init__(self, sql: SqlStore):
+        self.sql = sql
+        self.ready = False
+
+    async def init_table(self):
+        """Cria a tabela de broadcasts se necessário (uma vez por instância)"""
+        if not self.ready:
+            await self.sql.create_tables(SCHEMA)
+            self.ready = True
+
+    async def create(self, text: str, admin_chat_id: int, status_message_id: int) -> int:
+        """Registra um novo broadcast e retorna seu ID"""
+        await self.init_table()
+        return await self.sql.insert('''
+            INSERT INTO broadcasts (text, admin_chat_id, status_message_id)
+            VALUES (?, ?, ?)
+        ''', text, admin_chat_id, status_message_id)
+
+    async def get(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        """Obtém um broadcast pelo ID"""
+        await self.init_table()
+        return await self.sql.fetchrow('SELECT * FROM broadcasts WHERE id = ?', broadcast_id)
+
+    async def get_running(self) -> List[Dict[str, Any]]:
+        """Obtém os broadcasts interrompidos antes de terminar"""
+        await self.init_table()
+        return await self.sql.fetch("SELECT * FROM broadcasts WHERE status = 'running'")
+
+    async def checkpoint(self, broadcast_id: int, last_user_id: int, sent: int, failed: int,
+                         status: str = 'running'):
+        """Grava o progresso de um broadcast"""
+        await self.init_table()
+        await self.sql.execute('''
+            UPDATE broadcasts
+            SET last_user_id = ?, sent = ?, failed = ?, status = ?, updated_at = ?
+            WHERE id = ?
+        ''', last_user_id, sent, failed, status, datetime.now(), broadcast_id)
+
+
+class Broadcaster:
+    """Envia um broadcast com workers concorrentes e limite global de taxa
+
+    Os destinatários são lidos do banco página a página (keyset por
+    user_id); cada página é enviada por ``BROADCAST_WORKERS`` workers e o
+    checkpoint é gravado ao fim dela. Após um reinício, no máximo a página
+    em andamento é reenviada. Um erro do banco nunca encerra o broadcast
+    como concluído: a leitura é repetida com espera crescente e, se
+    continuar falhando, o broadcast fica 'running' para ser retomado.
+    """
+
+    def __init__(self, bot, db, store: BroadcastStore):
+        self.bot = bot
+        self.db = db
+        self.store = store
+        self.limiter = TokenBucket(BROADCAST_RATE, BROADCAST_RATE)
+        self.tasks: Dict[int, asyncio.Task] = {}
+
+    def start(self, broadcast_id: int) -> asyncio.Task:
+        """Inicia (ou retoma) um broadcast em segundo plano"""
+        task = asyncio.create_task(self.run(broadcast_id))
+        self.tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(broadcast_id, None))
+        return task
+
+    async def resume_all(self):
+        """Retoma os broadcasts que estavam em andamento"""
+        for broadcast in await self.store.get_running():
+            if broadcast["id"] not in self.tasks:
+                logger.info(f"Retomando broadcast #{broadcast['id']} após user_id {broadcast['last_user_id']}")
+                self.start(broadcast["id"])
+
+    async def _acquire(self):
+        while not self.limiter.consume():
+            await asyncio.sleep(self.limiter.wait_time())
+
+    async def _send(self, user_id: int, text: str) -> bool:
+        for _ in range(3):
+            await self._acquire()
+            try:
+                await self.bot.send_message(user_id, text)
+                metrics.inc("broadcast_messages_total", result="sent")
+                return True
+            except TelegramRetryAfter as e:
+                # Flood control do Telegram: espera o tempo pedido e tenta de novo
+                await asyncio.sleep(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest):
+                break
+            except Exception as e:
+                logger.error(f"Erro no broadcast para {user_id}: {e}")
+                break
+        metrics.inc("broadcast_messages_total", result="failed")
+        return False
+
+    async def _read_page(self, after_user_id: int) -> List[int]:
+        """Lê a próxima página de destinatários, repetindo erros do banco"""
+        for attempt in range(1, PAGE_READ_ATTEMPTS + 1):
+            try:
+                return await self.db.get_active_user_ids_page(after_user_id, BROADCAST_PAGE_SIZE)
+            except Exception as e:
+                if attempt == PAGE_READ_ATTEMPTS:
+                    raise
+                delay = PAGE_READ_BACKOFF * 2 ** (attempt - 1)
+                logger.warning(f"Erro ao ler destinatários após user_id {after_user_id} "
+                               f"(tentativa {attempt}): {e}; nova leitura em {delay:.0f}s")
+                await asyncio.sleep(delay)
+
+    async def _report(self, broadcast: Dict[str, Any], counts: Dict[str, int],
+                      session_sent: int, started: float, done: bool = False,
+                      interrupted: bool = False):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        if interrupted:
+            title = "⏸ Broadcast interrompido"
+        else:
+            title = "✅ Broadcast concluído" if done else "📣 Broadcast em andamento"
+        try:
+            await self.bot.edit_message_text(
+                f"{title} #{broadcast['id']}\n\n"
+                f"📨 Enviadas: {counts['sent']}\n"
+                f"❌ Falhas: {counts['failed']}\n"
+                f"⚡ Vazão: {session_sent / elapsed:.1f} msg/s",
+                chat_id=broadcast["admin_chat_id"],
+                message_id=broadcast["status_message_id"]
+            )
+        except Exception as e:
+            logger.debug(f"Relatório do broadcast não atualizado: {e}")
+
+    async def run(self, broadcast_id: int):
+        """Executa um broadcast do ponto em que parou"""
+        broadcast = await self.store.get(broadcast_id)
+        if not broadcast:
+            return
+
+        text = broadcast["text"]
+        last_user_id = broadcast["last_user_id"]
+        counts = {"sent": broadcast["sent"], "failed": broadcast["failed"]}
+        started = time.monotonic()
+        session_start = counts["sent"]
+        last_report = 0.0
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=BROADCAST_PAGE_SIZE)
+
+        async def worker():
+            while True:
+                user_id = await queue.get()
+                try:
+                    ok = await self._send(user_id, text)
+                    counts["sent" if ok else "failed"] += 1
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(BROADCAST_WORKERS)]
+        try:
+            while True:
+                page = await self._read_page(last_user_id)
+                if not page:
+                    break
+
+                for user_id in page:
+                    await queue.put(user_id)
+                await queue.join()
+
+                last_user_id = page[-1]
+                await self.store.checkpoint(broadcast_id, last_user_id, counts["sent"],
+                                            counts["failed"])
+
+                if time.monotonic() - last_report >= REPORT_INTERVAL:
+                    last_report = time.monotonic()
+                    await self._report(broadcast, counts, counts["sent"] - session_start, started)
+
+            await self.store.checkpoint(broadcast_id, last_user_id, counts["sent"],
+                                        counts["failed"], status='done')
+            await self._report(broadcast, counts, counts["sent"] - session_start, started,
+                               done=True)
+        except Exception as e:
+            # Continua 'running' no banco: resume_all retoma do último checkpoint
+            logger.error(f"Broadcast #{broadcast_id} interrompido após user_id {last_user_id}: {e}")
+            await self._report(broadcast, counts, counts["sent"] - session_start, started,
+                               interrupted=True)
+        finally:
+            for task in workers:
+                task.cancel()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Mede o tempo de importação dos módulos principais (python -X importtime)
+e falha se passar do orçamento.
+
+Uso: python check_import_time.py [--budget-ms 3500] [--runs 5] [bot webhook ...]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+DEFAULT_MODULES = ["bot", "webhook"]
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", 3500))
+
+
+def measure(modules: List[str]) -> Tuple[float, List[Tuple[int, int, str]]]:
+    """Importa os módulos num processo novo e retorna (total em ms, entradas)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        cwd=Path(__file__).resolve().parent,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Falha ao importar {modules}:\n{result.stderr}")
+
+    entries = []
+    top_level: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        entries.append((int(self_us), int(cumulative_us), name.rstrip()))
+        if name.strip() in modules and name.startswith(" ") and not name.startswith("  "):
+            top_level[name.strip()] = int(cumulative_us)
+
+    return sum(top_level.values()) / 1000, entries
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    # O melhor de N execuções reduz o ruído de cache frio e de agendamento
+    best_ms, best_entries = min(
+        (measure(args.modules) for _ in range(args.runs)), key=lambda r: r[0]
+    )
+
+    print(f"Módulos mais lentos (self, em ms) ao importar {', '.join(args.modules)}:")
+    for self_us, cumulative_us, name in sorted(best_entries, reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:8.1f}  {cumulative_us / 1000:8.1f}  {name.strip()}")
+
+    print(f"\nTempo de importação: {best_ms:.1f} ms (orçamento: {args.budget_ms:.0f} ms)")
+    if best_ms > args.budget_ms:
+        print("ERRO: tempo de importação acima do orçamento")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
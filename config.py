@@ -7,20 +7,94 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID", 0))
 
+# Idioma padrão das mensagens (usado quando o idioma do usuário não tem tradução)
+DEFAULT_LOCALE = os.getenv("DEFAULT_LOCALE", "pt")
+
 # Configurações do Mercado Pago
 MP_ACCESS_TOKEN = os.getenv("MP_ACCESS_TOKEN")
 MP_PUBLIC_KEY = os.getenv("MP_PUBLIC_KEY")
 
+# Resiliência das chamadas ao Mercado Pago
+MP_TIMEOUTS = {  # Timeout (segundos) por endpoint
+    "payment_create": float(os.getenv("MP_CREATE_TIMEOUT", 10)),
+    "payment_get": float(os.getenv("MP_GET_TIMEOUT", 5))
+}
+MP_MAX_ATTEMPTS = int(os.getenv("MP_MAX_ATTEMPTS", 3))
+MP_RETRY_BUDGET_RATIO = float(os.getenv("MP_RETRY_BUDGET_RATIO", 0.2))
+MP_BREAKER_FAILURE_THRESHOLD = int(os.getenv("MP_BREAKER_FAILURE_THRESHOLD", 5))
+MP_BREAKER_RESET_SECONDS = float(os.getenv("MP_BREAKER_RESET_SECONDS", 30))
+
 # Configurações do Grupo
 GROUP_ID = os.getenv("GROUP_ID")
 GROUP_INVITE_LINK = os.getenv("GROUP_INVITE_LINK")
 
+# Pool de links de convite de uso único
+INVITE_POOL_SIZE = int(os.getenv("INVITE_POOL_SIZE", 20))
+INVITE_LINK_TTL_HOURS = int(os.getenv("INVITE_LINK_TTL_HOURS", 48))
+INVITE_LINK_MIN_REMAINING_HOURS = 12  # Validade mínima para um link ser entregue
+INVITE_POOL_REFILL_SECONDS = 300
+
 # Configurações do Webhook
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 WEBHOOK_PATH = "/webhook"
+MP_WEBHOOK_SECRET = os.getenv("MP_WEBHOOK_SECRET")  # Chave secreta da assinatura (x-signature)
+WEBHOOK_RATE_LIMIT = float(os.getenv("WEBHOOK_RATE_LIMIT", 20))  # Requisições/segundo por origem
+WEBHOOK_RATE_BURST = float(os.getenv("WEBHOOK_RATE_BURST", 100))
+# Proxies reversos confiáveis (IPs ou redes, separados por vírgula): atrás deles a
+# origem do limite é lida do X-Forwarded-For; vazio usa o IP da conexão
+WEBHOOK_TRUSTED_PROXIES = os.getenv("WEBHOOK_TRUSTED_PROXIES", "")
+WEBHOOK_MAX_BODY_BYTES = int(os.getenv("WEBHOOK_MAX_BODY_BYTES", 16384))
+WEBHOOK_SIGNATURE_MAX_AGE = int(os.getenv("WEBHOOK_SIGNATURE_MAX_AGE", 300))  # Idade máxima do ts assinado (segundos)
+WEBHOOK_RECORD_FILE = os.getenv("WEBHOOK_RECORD_FILE")  # Captura JSONL para replay (desligada se vazio)
+
+# Eventos do webhook para o bot (outbox no banco de DATABASE_BACKEND)
+EVENT_POLL_INTERVAL = float(os.getenv("EVENT_POLL_INTERVAL", 2.0))  # Leitura do outbox sem aviso em processo (segundos)
+EVENT_BATCH_SIZE = 100  # Eventos lidos por vez
+EVENT_MAX_ATTEMPTS = 5  # Tentativas de entrega antes de marcar o evento como falho
+EVENT_RETENTION_HOURS = 24  # Eventos entregues mantidos no outbox
+
+# Broadcast para assinantes ativos
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))  # Mensagens por segundo (limite do Telegram ~30)
+BROADCAST_WORKERS = 8
+BROADCAST_PAGE_SIZE = 200  # Destinatários por página/checkpoint
+
+# Auditoria de membros do grupo sem assinatura ativa
+AUDIT_INTERVAL_SECONDS = int(os.getenv("AUDIT_INTERVAL_SECONDS", 24 * 3600))
+AUDIT_AUTO_REMOVE = os.getenv("AUDIT_AUTO_REMOVE", "false").lower() == "true"  # Padrão: só relatório
+AUDIT_REMOVAL_RATE = 5.0  # Remoções por segundo
+AUDIT_REMOVAL_WORKERS = 4
+# Acima desta fração do roster sem assinatura, a remoção é abortada (leitura suspeita)
+AUDIT_MAX_REMOVAL_FRACTION = float(os.getenv("AUDIT_MAX_REMOVAL_FRACTION", 0.5))
+
+# Logging
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_MAX_BYTES = 10 * 1024 * 1024  # Rotação do arquivo por tamanho
+LOG_BACKUP_COUNT = 5
+LOG_QUEUE_SIZE = 10000  # Registros acima disso são descartados, nunca bloqueiam
+LOG_SAMPLE_RATES = {  # Fração mantida dos eventos de alto volume
+    "webhook_received": 0.1
+}
+
+# Monitor do event loop
+LOOP_LAG_INTERVAL = 0.1  # Intervalo de medição do atraso (segundos)
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", 0.25))  # Bloqueio a partir de (segundos)
 
 # Configurações do Banco de Dados
-DATABASE_PATH = "subscriptions.db"
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "sqlite")  # sqlite, memory ou postgres
+DATABASE_PATH = os.getenv("DATABASE_PATH", "subscriptions.db")
+DATABASE_URL = os.getenv("DATABASE_URL")  # DSN do PostgreSQL (DATABASE_BACKEND=postgres)
+DB_GROUP_COMMIT_DELAY_MS = float(os.getenv("DB_GROUP_COMMIT_DELAY_MS", 2))  # Janela de agrupamento das escritas
+DB_GROUP_COMMIT_MAX_BATCH = 256  # Máximo de escritas por transação
+DB_PAGE_SIZE = int(os.getenv("DB_PAGE_SIZE", 500))  # Linhas por página nas varreduras (keyset)
+DB_PAGE_READ_ATTEMPTS = 3  # Leituras de uma página antes de a varredura levantar o erro
+DB_PAGE_READ_BACKOFF = 1.0  # Espera antes da 2ª leitura (dobra a cada falha)
+
+# Backup online do SQLite
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL_SECONDS = int(os.getenv("BACKUP_INTERVAL_SECONDS", 6 * 3600))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 14))  # Snapshots mantidos
+BACKUP_PAGES_PER_STEP = 256  # Páginas copiadas por passo (trava o banco só durante o passo)
+BACKUP_STEP_SLEEP = 0.01  # Pausa entre passos para os escritores (segundos)
 
 # Configurações de Planos
 PLANS = {
@@ -37,4 +111,20 @@ PLANS = {
 }
 
 # Configurações de Notificações
-RENEWAL_WARNING_DAYS = [7, 3, 1]  # Dias antes do vencimento para enviar avisos 
\ No newline at end of file
+RENEWAL_WARNING_DAYS = [7, 3, 1]  # Dias antes do vencimento para enviar avisos
+RENEWAL_MAX_PER_MINUTE = int(os.getenv("RENEWAL_MAX_PER_MINUTE", 60))  # Teto de avisos por minuto
+RENEWAL_JITTER_SECONDS = 600  # Espalhamento aleatório após o horário previsto
+RENEWAL_REFRESH_SECONDS = 3600  # Intervalo de leitura do banco para agendar avisos
+
+# Limites por usuário e por ação: (fichas por segundo, rajada máxima)
+THROTTLE_RULES = {
+    "start": (0.5, 3),
+    "status": (0.5, 3),
+    "plan": (1.0, 5),
+    "generate_pix": (0.1, 2),
+    "confirm_payment": (0.2, 3),
+    "show_qr": (0.2, 3),
+    "cancel_payment": (1.0, 5),
+    "back_to_plans": (1.0, 5),
+    "default": (1.0, 5)
+}
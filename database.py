@@ -1,24 +1,56 @@
 import sqlite3
 import asyncio
+import logging
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
 import json
+from access import active_members
+from config import (
+    DB_GROUP_COMMIT_DELAY_MS, DB_GROUP_COMMIT_MAX_BATCH, DB_PAGE_SIZE, DB_PAGE_READ_ATTEMPTS,
+    DB_PAGE_READ_BACKOFF
+)
+from group_commit import GroupCommitWriter
+from sql_store import SqliteSqlStore
+from storage import PaymentOwnerMismatch, StorageBackend
 
-class Database:
+logger = logging.getLogger(__name__)
+
+class Database(StorageBackend):
+    """Backend SQLite (padrão)
+
+    Inserções de alta frequência (pagamentos, notificações e status de
+    pagamento) passam pelo ``GroupCommitWriter``: escritas concorrentes
+    dividem uma transação e um único commit.
+    """
+    
     def __init__(self, db_path: str):
         self.db_path = db_path
         self.init_database()
+        self.writer = GroupCommitWriter(self._connect, max_batch=DB_GROUP_COMMIT_MAX_BATCH,
+                                        max_delay=DB_GROUP_COMMIT_DELAY_MS / 1000)
+        # Tabelas auxiliares escrevem pelo mesmo writer: um só escritor no arquivo
+        self.sql = SqliteSqlStore(db_path, self.writer)
+    
+    async def close(self):
+        """Grava as escritas pendentes e encerra a thread de escrita"""
+        await asyncio.to_thread(self.writer.stop)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Abre uma conexão que converte colunas DATETIME"""
+        return sqlite3.connect(self.db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
     
     def init_database(self):
         """Inicializa o banco de dados com as tabelas necessárias"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
-        # Tabela de assinaturas
+        # Modelo antigo (uma linha por pagamento) é migrado na mesma transação
+        legacy = self._rename_legacy_subscriptions(cursor)
+        
+        # Tabela de assinaturas: uma linha por usuário, estendida a cada renovação
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS subscriptions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
+                user_id INTEGER PRIMARY KEY,
                 username TEXT,
                 first_name TEXT,
                 last_name TEXT,
@@ -27,6 +59,22 @@ class Database:
                 expiration_date DATETIME NOT NULL,
                 payment_id TEXT,
                 status TEXT DEFAULT 'active',
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Histórico de renovações (somente inserção); payment_id único garante
+        # que um pagamento estende a assinatura uma única vez
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS subscription_ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                payment_id TEXT UNIQUE,
+                plan_type TEXT NOT NULL,
+                days INTEGER NOT NULL,
+                previous_expiration DATETIME,
+                expiration_date DATETIME NOT NULL,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         ''')
@@ -41,11 +89,22 @@ class Database:
                 amount REAL NOT NULL,
                 status TEXT DEFAULT 'pending',
                 pix_code TEXT,
+                qr_code_base64 TEXT,
+                locale TEXT,
+                qr_file_id TEXT,
+                chat_id INTEGER,
+                message_id INTEGER,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         ''')
         
+        # Bancos criados antes da mensagem e do QR do pagamento serem guardados
+        self._add_missing_columns(cursor, "payments", {
+            "chat_id": "INTEGER", "message_id": "INTEGER",
+            "qr_code_base64": "TEXT", "qr_file_id": "TEXT", "locale": "TEXT"
+        })
+        
         # Tabela de notificações enviadas
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS notifications (
@@ -56,43 +115,144 @@ class Database:
             )
         ''')
         
+        # Índice para as buscas de expiradas e a vencer
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_subscriptions_expiration
+            ON subscriptions (status, expiration_date)
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ledger_user
+            ON subscription_ledger (user_id, created_at)
+        ''')
+        
+        if legacy:
+            self._migrate_legacy_subscriptions(cursor)
+        
         conn.commit()
         conn.close()
     
-    async def add_subscription(self, user_id: int, username: str, first_name: str, 
-                             last_name: str, plan_type: str, payment_date: datetime, 
-                             expiration_date: datetime, payment_id: str) -> bool:
-        """Adiciona uma nova assinatura"""
-        try:
-            conn = sqlite3.connect(self.db_path)
+    def _add_missing_columns(self, cursor: sqlite3.Cursor, table: str, columns: Dict[str, str]):
+        """Acrescenta a ``table`` as colunas que ainda não existem"""
+        existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        for name, column_type in columns.items():
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+    
+    def _rename_legacy_subscriptions(self, cursor: sqlite3.Cursor) -> bool:
+        """Renomeia ``subscriptions`` do modelo antigo (coluna ``id``, uma linha por pagamento)"""
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(subscriptions)")]
+        if "id" not in columns:
+            return False
+        
+        logger.info("Migrando subscriptions para uma linha por usuário")
+        cursor.execute("BEGIN")
+        cursor.execute("ALTER TABLE subscriptions RENAME TO subscriptions_old")
+        cursor.execute("DROP INDEX IF EXISTS idx_subscriptions_user")
+        return True
+    
+    def _migrate_legacy_subscriptions(self, cursor: sqlite3.Cursor):
+        """Copia o modelo antigo para o novo e descarta a tabela antiga
+        
+        Cada linha antiga vira uma entrada no histórico; a linha mantida por
+        usuário é a ativa de maior expiração (ou a mais recente).
+        """
+        cursor.execute('''
+            INSERT OR IGNORE INTO subscription_ledger
+            (user_id, payment_id, plan_type, days, expiration_date, created_at)
+            SELECT user_id, payment_id, plan_type,
+                   CAST(ROUND(julianday(expiration_date) - julianday(payment_date)) AS INTEGER),
+                   expiration_date, created_at
+            FROM subscriptions_old
+            ORDER BY id
+        ''')
+        cursor.execute('''
+            INSERT INTO subscriptions
+            (user_id, username, first_name, last_name, plan_type, payment_date,
+             expiration_date, payment_id, status, created_at, updated_at)
+            SELECT user_id, username, first_name, last_name, plan_type, payment_date,
+                   expiration_date, payment_id, status, created_at, created_at
+            FROM subscriptions_old o
+            WHERE o.id = (
+                SELECT id FROM subscriptions_old
+                WHERE user_id = o.user_id
+                ORDER BY status = 'active' DESC, expiration_date DESC, id DESC
+                LIMIT 1
+            )
+        ''')
+        cursor.execute("DROP TABLE subscriptions_old")
+    
+    async def renew_subscription(self, user_id: int, username: Optional[str],
+                                 first_name: Optional[str], last_name: Optional[str],
+                                 plan_type: str, days: int, payment_id: str) -> Optional[datetime]:
+        """Cria ou estende a assinatura do usuário (idempotente por payment_id)"""
+        def renew(conn: sqlite3.Connection) -> datetime:
             cursor = conn.cursor()
             
+            cursor.execute('''
+                SELECT user_id, expiration_date FROM subscription_ledger WHERE payment_id = ?
+            ''', (payment_id,))
+            applied = cursor.fetchone()
+            if applied:
+                if applied[0] != user_id:
+                    raise PaymentOwnerMismatch(payment_id, applied[0], user_id)
+                return applied[1]
+            
+            now = datetime.now()
+            cursor.execute('''
+                SELECT expiration_date, status FROM subscriptions WHERE user_id = ?
+            ''', (user_id,))
+            current = cursor.fetchone()
+            
+            # Renovação antecipada soma ao tempo restante; vencida recomeça agora
+            previous = current[0] if current else None
+            extending = current is not None and current[1] == 'active' and current[0] > now
+            expiration_date = (previous if extending else now) + timedelta(days=days)
+            
             cursor.execute('''
                 INSERT INTO subscriptions 
                 (user_id, username, first_name, last_name, plan_type, payment_date, 
-                 expiration_date, payment_id, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'active')
-            ''', (user_id, username, first_name, last_name, plan_type, 
-                  payment_date, expiration_date, payment_id))
+                 expiration_date, payment_id, status, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'active', ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = COALESCE(excluded.username, username),
+                    first_name = COALESCE(excluded.first_name, first_name),
+                    last_name = COALESCE(excluded.last_name, last_name),
+                    plan_type = excluded.plan_type,
+                    payment_date = CASE WHEN ? THEN payment_date ELSE excluded.payment_date END,
+                    expiration_date = excluded.expiration_date,
+                    payment_id = excluded.payment_id,
+                    status = 'active',
+                    updated_at = excluded.updated_at
+            ''', (user_id, username, first_name, last_name, plan_type, now,
+                  expiration_date, payment_id, now, extending))
             
-            conn.commit()
-            conn.close()
-            return True
+            cursor.execute('''
+                INSERT INTO subscription_ledger
+                (user_id, payment_id, plan_type, days, previous_expiration, expiration_date)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, payment_id, plan_type, days, previous, expiration_date))
+            return expiration_date
+        
+        try:
+            expiration_date = await self.writer.submit(renew)
+            active_members.add(user_id, expiration_date)
+            return expiration_date
+        except PaymentOwnerMismatch:
+            raise
         except Exception as e:
-            print(f"Erro ao adicionar assinatura: {e}")
-            return False
+            logger.error(f"Erro ao renovar assinatura: {e}")
+            return None
     
     async def get_subscription(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Obtém a assinatura ativa de um usuário"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
                 SELECT * FROM subscriptions 
                 WHERE user_id = ? AND status = 'active'
-                ORDER BY expiration_date DESC
-                LIMIT 1
             ''', (user_id,))
             
             row = cursor.fetchone()
@@ -103,32 +263,72 @@ class Database:
                 return dict(zip(columns, row))
             return None
         except Exception as e:
-            print(f"Erro ao obter assinatura: {e}")
+            logger.error(f"Erro ao obter assinatura: {e}")
             return None
     
     async def update_subscription_status(self, user_id: int, status: str) -> bool:
         """Atualiza o status de uma assinatura"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
                 UPDATE subscriptions 
-                SET status = ? 
+                SET status = ?, updated_at = ?
                 WHERE user_id = ? AND status = 'active'
-            ''', (status, user_id))
+            ''', (status, datetime.now(), user_id))
             
             conn.commit()
             conn.close()
+            if status != 'active':
+                active_members.discard(user_id)
             return True
         except Exception as e:
-            print(f"Erro ao atualizar status da assinatura: {e}")
+            logger.error(f"Erro ao atualizar status da assinatura: {e}")
             return False
     
+    async def get_active_members(self) -> List[tuple]:
+        """Obtém (user_id, expiration_date) das assinaturas vigentes
+        
+        Erros de leitura sobem para quem chama: lista vazia é só "nenhum ativo".
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT user_id, expiration_date FROM subscriptions 
+                WHERE status = 'active' AND expiration_date > ?
+            ''', (datetime.now(),))
+            
+            return cursor.fetchall()
+        finally:
+            conn.close()
+    
+    async def get_active_user_ids_page(self, after_user_id: int, limit: int) -> List[int]:
+        """Obtém uma página de user_ids ativos, em ordem, após ``after_user_id``
+        
+        Erros de leitura sobem para quem chama: lista vazia é só o fim.
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT user_id FROM subscriptions 
+                WHERE status = 'active' AND expiration_date > ? AND user_id > ?
+                ORDER BY user_id
+                LIMIT ?
+            ''', (datetime.now(), after_user_id, limit))
+            
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
     async def get_expired_subscriptions(self) -> List[Dict[str, Any]]:
         """Obtém todas as assinaturas expiradas"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -144,13 +344,13 @@ class Database:
                 return [dict(zip(columns, row)) for row in rows]
             return []
         except Exception as e:
-            print(f"Erro ao obter assinaturas expiradas: {e}")
+            logger.error(f"Erro ao obter assinaturas expiradas: {e}")
             return []
     
     async def get_subscriptions_expiring_soon(self, days: int) -> List[Dict[str, Any]]:
         """Obtém assinaturas que expiram em X dias"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             target_date = datetime.now() + timedelta(days=days)
@@ -169,52 +369,94 @@ class Database:
                 return [dict(zip(columns, row)) for row in rows]
             return []
         except Exception as e:
-            print(f"Erro ao obter assinaturas expirando em breve: {e}")
+            logger.error(f"Erro ao obter assinaturas expirando em breve: {e}")
             return []
     
+    def _subscriptions_page(self, condition: str, params: tuple, after: Optional[Tuple[datetime, int]],
+                            limit: int) -> List[Dict[str, Any]]:
+        """Uma página de assinaturas ativas após ``after`` (expiration_date, user_id)"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        # (status, expiration_date) + rowid do índice cobrem filtro, ordem e cursor
+        keyset = "AND (expiration_date, user_id) > (?, ?)" if after else ""
+        rows = conn.execute(f'''
+            SELECT * FROM subscriptions
+            WHERE status = 'active' AND {condition} {keyset}
+            ORDER BY expiration_date, user_id
+            LIMIT ?
+        ''', (*params, *(after or ()), limit)).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+    
+    async def _iter_subscriptions(self, condition: str, params: tuple,
+                                  page_size: Optional[int]) -> AsyncIterator[Dict[str, Any]]:
+        """Entrega as linhas página a página; só uma página fica em memória
+        
+        Uma página que continua falhando após as novas leituras levanta o
+        erro: a varredura nunca termina como se tivesse chegado ao fim.
+        """
+        page_size = page_size or DB_PAGE_SIZE
+        after = None
+        while True:
+            for attempt in range(1, DB_PAGE_READ_ATTEMPTS + 1):
+                try:
+                    page = await asyncio.to_thread(self._subscriptions_page, condition, params,
+                                                   after, page_size)
+                    break
+                except Exception as e:
+                    if attempt == DB_PAGE_READ_ATTEMPTS:
+                        raise
+                    logger.warning(f"Erro ao ler página de assinaturas (tentativa {attempt}): {e}")
+                    await asyncio.sleep(DB_PAGE_READ_BACKOFF * 2 ** (attempt - 1))
+            for subscription in page:
+                yield subscription
+            if len(page) < page_size:
+                return
+            after = (page[-1]["expiration_date"], page[-1]["user_id"])
+    
+    def iter_expired_subscriptions(self, page_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Percorre as assinaturas expiradas em páginas (keyset)"""
+        return self._iter_subscriptions("expiration_date < ?", (datetime.now(),), page_size)
+    
+    def iter_subscriptions_expiring_soon(self, days: int,
+                                         page_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Percorre as assinaturas que expiram em X dias, em páginas (keyset)"""
+        now = datetime.now()
+        return self._iter_subscriptions("expiration_date BETWEEN ? AND ?",
+                                        (now, now + timedelta(days=days)), page_size)
+    
     async def add_payment(self, user_id: int, payment_id: str, plan_type: str, 
-                         amount: float, pix_code: str) -> bool:
-        """Adiciona um novo pagamento"""
+                         amount: float, pix_code: str, qr_code_base64: Optional[str] = None,
+                         locale: Optional[str] = None) -> bool:
+        """Adiciona um novo pagamento (com a imagem do QR e o idioma do usuário)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+            await self.writer.submit(lambda conn: conn.execute('''
                 INSERT INTO payments 
-                (user_id, payment_id, plan_type, amount, pix_code)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, payment_id, plan_type, amount, pix_code))
-            
-            conn.commit()
-            conn.close()
+                (user_id, payment_id, plan_type, amount, pix_code, qr_code_base64, locale)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, payment_id, plan_type, amount, pix_code, qr_code_base64, locale)))
             return True
         except Exception as e:
-            print(f"Erro ao adicionar pagamento: {e}")
+            logger.error(f"Erro ao adicionar pagamento: {e}")
             return False
     
     async def update_payment_status(self, payment_id: str, status: str) -> bool:
         """Atualiza o status de um pagamento"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+            await self.writer.submit(lambda conn: conn.execute('''
                 UPDATE payments 
                 SET status = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE payment_id = ?
-            ''', (status, payment_id))
-            
-            conn.commit()
-            conn.close()
+            ''', (status, payment_id)))
             return True
         except Exception as e:
-            print(f"Erro ao atualizar status do pagamento: {e}")
+            logger.error(f"Erro ao atualizar status do pagamento: {e}")
             return False
     
     async def get_payment_by_id(self, payment_id: str) -> Optional[Dict[str, Any]]:
         """Obtém um pagamento pelo ID"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -229,13 +471,37 @@ class Database:
                 return dict(zip(columns, row))
             return None
         except Exception as e:
-            print(f"Erro ao obter pagamento: {e}")
+            logger.error(f"Erro ao obter pagamento: {e}")
             return None
     
+    async def set_payment_message(self, payment_id: str, chat_id: int, message_id: int) -> bool:
+        """Grava a mensagem do Telegram que mostra o pagamento"""
+        try:
+            await self.writer.submit(lambda conn: conn.execute('''
+                UPDATE payments
+                SET chat_id = ?, message_id = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE payment_id = ?
+            ''', (chat_id, message_id, payment_id)))
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao gravar mensagem do pagamento: {e}")
+            return False
+    
+    async def set_payment_qr_file_id(self, payment_id: str, file_id: str) -> bool:
+        """Grava o file_id da foto do QR enviada ao Telegram"""
+        try:
+            await self.writer.submit(lambda conn: conn.execute('''
+                UPDATE payments SET qr_file_id = ? WHERE payment_id = ?
+            ''', (file_id, payment_id)))
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao gravar file_id do QR: {e}")
+            return False
+    
     async def get_sales_summary(self) -> Dict[str, Any]:
         """Obtém resumo de vendas para o admin"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # Total de assinaturas ativas
@@ -264,6 +530,7 @@ class Database:
                 FROM payments 
                 WHERE status = 'approved' 
                 GROUP BY plan_type
+                ORDER BY plan_type
             ''')
             sales_by_plan = cursor.fetchall()
             
@@ -277,32 +544,26 @@ class Database:
                 'sales_by_plan': sales_by_plan
             }
         except Exception as e:
-            print(f"Erro ao obter resumo de vendas: {e}")
+            logger.error(f"Erro ao obter resumo de vendas: {e}")
             return {}
     
     async def add_notification(self, user_id: int, notification_type: str) -> bool:
         """Registra uma notificação enviada"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+            await self.writer.submit(lambda conn: conn.execute('''
                 INSERT INTO notifications (user_id, notification_type)
                 VALUES (?, ?)
-            ''', (user_id, notification_type))
-            
-            conn.commit()
-            conn.close()
+            ''', (user_id, notification_type)))
             return True
         except Exception as e:
-            print(f"Erro ao adicionar notificação: {e}")
+            logger.error(f"Erro ao adicionar notificação: {e}")
             return False
     
     async def has_recent_notification(self, user_id: int, notification_type: str, 
                                     hours: int = 24) -> bool:
         """Verifica se uma notificação foi enviada recentemente"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -316,5 +577,5 @@ class Database:
             
             return count > 0
         except Exception as e:
-            print(f"Erro ao verificar notificação recente: {e}")
+            logger.error(f"Erro ao verificar notificação recente: {e}")
             return False 
\ No newline at end of file
@@ -0,0 +1,540 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, AsyncIterator
+
+from access import active_members
+from config import DB_PAGE_SIZE, DB_PAGE_READ_ATTEMPTS, DB_PAGE_READ_BACKOFF
+from sql_store import SqlStore, numbered_placeholders
+from storage import PaymentOwnerMismatch, StorageBackend
+
+try:
+    import asyncpg
+except ImportError:  # Dependência opcional (DATABASE_BACKEND=postgres)
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        user_id BIGINT PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        plan_type TEXT NOT NULL,
+        payment_date TIMESTAMP NOT NULL,
+        expiration_date TIMESTAMP NOT NULL,
+        payment_id TEXT,
+        status TEXT DEFAULT 'active',
+        created_at TIMESTAMP DEFAULT LOCALTIMESTAMP,
+        updated_at TIMESTAMP DEFAULT LOCALTIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS subscription_ledger (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        payment_id TEXT UNIQUE,
+        plan_type TEXT NOT NULL,
+        days INTEGER NOT NULL,
+        previous_expiration TIMESTAMP,
+        expiration_date TIMESTAMP NOT NULL,
+        created_at TIMESTAMP DEFAULT LOCALTIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS payments (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        payment_id TEXT NOT NULL,
+        plan_type TEXT NOT NULL,
+        amount DOUBLE PRECISION NOT NULL,
+        status TEXT DEFAULT 'pending',
+        pix_code TEXT,
+        qr_code_base64 TEXT,
+        locale TEXT,
+        qr_file_id TEXT,
+        chat_id BIGINT,
+        message_id BIGINT,
+        created_at TIMESTAMP DEFAULT LOCALTIMESTAMP,
+        updated_at TIMESTAMP DEFAULT LOCALTIMESTAMP
+    )
+    ''',
+    # Bancos criados antes da mensagem e do QR do pagamento serem guardados
+    'ALTER TABLE payments ADD COLUMN IF NOT EXISTS chat_id BIGINT',
+    'ALTER TABLE payments ADD COLUMN IF NOT EXISTS message_id BIGINT',
+    'ALTER TABLE payments ADD COLUMN IF NOT EXISTS qr_code_base64 TEXT',
+    'ALTER TABLE payments ADD COLUMN IF NOT EXISTS qr_file_id TEXT',
+    'ALTER TABLE payments ADD COLUMN IF NOT EXISTS locale TEXT',
+    '''
+    CREATE TABLE IF NOT EXISTS notifications (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        notification_type TEXT NOT NULL,
+        sent_at TIMESTAMP DEFAULT LOCALTIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_ledger_user ON subscription_ledger (user_id, created_at)',
+    # user_id no índice: as varreduras paginadas seguem (expiration_date, user_id)
+    'DROP INDEX IF EXISTS idx_subscriptions_expiration',
+    'CREATE INDEX IF NOT EXISTS idx_subscriptions_keyset ON subscriptions (status, expiration_date, user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_payments_payment_id ON payments (payment_id)',
+    'CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications (user_id, notification_type, sent_at)'
+]
+
+# Modelo antigo (uma linha por pagamento, coluna id): renomeado antes do SCHEMA
+LEGACY_RENAME = [
+    'ALTER TABLE subscriptions RENAME TO subscriptions_old',
+    'DROP INDEX IF EXISTS idx_subscriptions_user',
+    'DROP INDEX IF EXISTS idx_subscriptions_expiration'
+]
+
+# ...e copiado para as tabelas novas depois dele
+LEGACY_MIGRATE = [
+    '''
+    INSERT INTO subscription_ledger (user_id, payment_id, plan_type, days, expiration_date, created_at)
+    SELECT user_id, payment_id, plan_type,
+           ROUND(EXTRACT(EPOCH FROM expiration_date - payment_date) / 86400)::INTEGER,
+           expiration_date, created_at
+    FROM subscriptions_old
+    ORDER BY id
+    ON CONFLICT (payment_id) DO NOTHING
+    ''',
+    '''
+    INSERT INTO subscriptions
+    (user_id, username, first_name, last_name, plan_type, payment_date,
+     expiration_date, payment_id, status, created_at, updated_at)
+    SELECT DISTINCT ON (user_id)
+           user_id, username, first_name, last_name, plan_type, payment_date,
+           expiration_date, payment_id, status, created_at, created_at
+    FROM subscriptions_old
+    ORDER BY user_id, status = 'active' DESC, expiration_date DESC, id DESC
+    ''',
+    'DROP TABLE subscriptions_old'
+]
+
+
+class PostgresDatabase(StorageBackend):
+    """Backend PostgreSQL com pool de conexões asyncpg
+
+    Permite vários processos/hosts escrevendo no mesmo banco. Um pool
+    asyncpg só serve ao event loop que o criou; como bot e webhook dividem
+    a instância rodando em loops diferentes (``main.py``), cada loop ganha
+    o seu pool, criado no primeiro uso. O esquema é criado uma vez.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10):
+        if asyncpg is None:
+            raise RuntimeError("asyncpg não instalado. Execute: pip install asyncpg")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pools: Dict[asyncio.AbstractEventLoop, Any] = {}
+        self.schema_ready = False
+        self.sql = PostgresSqlStore(self)
+
+    async def connect(self):
+        """Cria o pool do event loop atual (e o esquema, na primeira vez)"""
+        loop = asyncio.get_running_loop()
+        if loop in self.pools:
+            return
+        pool = await asyncpg.create_pool(
+            self.dsn, min_size=self.min_size, max_size=self.max_size
+        )
+        self.pools[loop] = pool
+        if self.schema_ready:
+            return
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # Processos iniciando juntos não criam o esquema em paralelo
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext('schema'))")
+                legacy = await conn.fetchval('''
+                    SELECT EXISTS (
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_schema = current_schema()
+                        AND table_name = 'subscriptions' AND column_name = 'id'
+                    )
+                ''')
+                if legacy:
+                    logger.info("Migrando subscriptions para uma linha por usuário")
+                    for statement in LEGACY_RENAME:
+                        await conn.execute(statement)
+                for statement in SCHEMA:
+                    await conn.execute(statement)
+                if legacy:
+                    for statement in LEGACY_MIGRATE:
+                        await conn.execute(statement)
+        self.schema_ready = True
+
+    async def close(self):
+        """Fecha o pool do event loop atual"""
+        pool = self.pools.pop(asyncio.get_running_loop(), None)
+        if pool is not None:
+            await pool.close()
+
+    async def _pool(self):
+        pool = self.pools.get(asyncio.get_running_loop())
+        if pool is None:
+            await self.connect()
+            pool = self.pools[asyncio.get_running_loop()]
+        return pool
+
+    async def renew_subscription(self, user_id: int, username: Optional[str],
+                                 first_name: Optional[str], last_name: Optional[str],
+                                 plan_type: str, days: int, payment_id: str) -> Optional[datetime]:
+        """Cria ou estende a assinatura do usuário (idempotente por payment_id)"""
+        try:
+            pool = await self._pool()
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    # Serializa as renovações do mesmo usuário entre processos
+                    await conn.execute('SELECT pg_advisory_xact_lock($1)', user_id)
+                    
+                    applied = await conn.fetchrow('''
+                        SELECT user_id, expiration_date FROM subscription_ledger WHERE payment_id = $1
+                    ''', payment_id)
+                    if applied:
+                        if applied['user_id'] != user_id:
+                            raise PaymentOwnerMismatch(payment_id, applied['user_id'], user_id)
+                        return applied['expiration_date']
+                    
+                    now = datetime.now()
+                    current = await conn.fetchrow('''
+                        SELECT expiration_date, status FROM subscriptions WHERE user_id = $1
+                    ''', user_id)
+                    
+                    # Renovação antecipada soma ao tempo restante; vencida recomeça agora
+                    previous = current['expiration_date'] if current else None
+                    extending = (current is not None and current['status'] == 'active'
+                                 and current['expiration_date'] > now)
+                    expiration_date = (previous if extending else now) + timedelta(days=days)
+                    
+                    await conn.execute('''
+                        INSERT INTO subscriptions AS s
+                        (user_id, username, first_name, last_name, plan_type, payment_date,
+                         expiration_date, payment_id, status, updated_at)
+                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, 'active', $6)
+                        ON CONFLICT (user_id) DO UPDATE SET
+                            username = COALESCE(EXCLUDED.username, s.username),
+                            first_name = COALESCE(EXCLUDED.first_name, s.first_name),
+                            last_name = COALESCE(EXCLUDED.last_name, s.last_name),
+                            plan_type = EXCLUDED.plan_type,
+                            payment_date = CASE WHEN $9 THEN s.payment_date ELSE EXCLUDED.payment_date END,
+                            expiration_date = EXCLUDED.expiration_date,
+                            payment_id = EXCLUDED.payment_id,
+                            status = 'active',
+                            updated_at = EXCLUDED.updated_at
+                    ''', user_id, username, first_name, last_name, plan_type, now,
+                        expiration_date, payment_id, extending)
+                    
+                    await conn.execute('''
+                        INSERT INTO subscription_ledger
+                        (user_id, payment_id, plan_type, days, previous_expiration, expiration_date)
+                        VALUES ($1, $2, $3, $4, $5, $6)
+                    ''', user_id, payment_id, plan_type, days, previous, expiration_date)
+            
+            active_members.add(user_id, expiration_date)
+            return expiration_date
+        except PaymentOwnerMismatch:
+            raise
+        except Exception as e:
+            logger.error(f"Erro ao renovar assinatura: {e}")
+            return None
+    
+    async def get_subscription(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Obtém a assinatura ativa de um usuário"""
+        try:
+            pool = await self._pool()
+            row = await pool.fetchrow('''
+                SELECT * FROM subscriptions
+                WHERE user_id = $1 AND status = 'active'
+            ''', user_id)
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Erro ao obter assinatura: {e}")
+            return None
+
+    async def update_subscription_status(self, user_id: int, status: str) -> bool:
+        """Atualiza o status de uma assinatura"""
+        try:
+            pool = await self._pool()
+            await pool.execute('''
+                UPDATE subscriptions SET status = $1, updated_at = LOCALTIMESTAMP
+                WHERE user_id = $2 AND status = 'active'
+            ''', status, user_id)
+            if status != 'active':
+                active_members.discard(user_id)
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao atualizar status da assinatura: {e}")
+            return False
+
+    async def get_active_members(self) -> List[tuple]:
+        """Obtém (user_id, expiration_date) das assinaturas vigentes (erros sobem)"""
+        pool = await self._pool()
+        rows = await pool.fetch('''
+            SELECT user_id, expiration_date FROM subscriptions
+            WHERE status = 'active' AND expiration_date > $1
+        ''', datetime.now())
+        return [tuple(row) for row in rows]
+
+    async def get_active_user_ids_page(self, after_user_id: int, limit: int) -> List[int]:
+        """Obtém uma página de user_ids ativos (erros de leitura sobem para quem chama)"""
+        pool = await self._pool()
+        rows = await pool.fetch('''
+            SELECT user_id FROM subscriptions
+            WHERE status = 'active' AND expiration_date > $1 AND user_id > $2
+            ORDER BY user_id
+            LIMIT $3
+        ''', datetime.now(), after_user_id, limit)
+        return [row[0] for row in rows]
+
+    async def get_expired_subscriptions(self) -> List[Dict[str, Any]]:
+        """Obtém todas as assinaturas expiradas"""
+        try:
+            pool = await self._pool()
+            rows = await pool.fetch('''
+                SELECT * FROM subscriptions
+                WHERE expiration_date < $1 AND status = 'active'
+            ''', datetime.now())
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Erro ao obter assinaturas expiradas: {e}")
+            return []
+
+    async def get_subscriptions_expiring_soon(self, days: int) -> List[Dict[str, Any]]:
+        """Obtém assinaturas que expiram em X dias"""
+        try:
+            pool = await self._pool()
+            now = datetime.now()
+            rows = await pool.fetch('''
+                SELECT * FROM subscriptions
+                WHERE expiration_date BETWEEN $1 AND $2
+                AND status = 'active'
+            ''', now, now + timedelta(days=days))
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Erro ao obter assinaturas expirando em breve: {e}")
+            return []
+
+    async def _iter_subscriptions(self, condition: str, params: tuple,
+                                  page_size: Optional[int]) -> AsyncIterator[Dict[str, Any]]:
+        """Entrega as linhas página a página; só uma página fica em memória
+
+        Uma página que continua falhando após as novas leituras levanta o
+        erro: a varredura nunca termina como se tivesse chegado ao fim.
+        """
+        page_size = page_size or DB_PAGE_SIZE
+        after = None
+        keyset = ""
+        while True:
+            if after:
+                keyset = f"AND (expiration_date, user_id) > (${len(params) + 1}, ${len(params) + 2})"
+            for attempt in range(1, DB_PAGE_READ_ATTEMPTS + 1):
+                try:
+                    pool = await self._pool()
+                    rows = await pool.fetch(f'''
+                        SELECT * FROM subscriptions
+                        WHERE status = 'active' AND {condition} {keyset}
+                        ORDER BY expiration_date, user_id
+                        LIMIT {int(page_size)}
+                    ''', *params, *(after or ()))
+                    break
+                except Exception as e:
+                    if attempt == DB_PAGE_READ_ATTEMPTS:
+                        raise
+                    logger.warning(f"Erro ao ler página de assinaturas (tentativa {attempt}): {e}")
+                    await asyncio.sleep(DB_PAGE_READ_BACKOFF * 2 ** (attempt - 1))
+            for row in rows:
+                yield dict(row)
+            if len(rows) < page_size:
+                return
+            after = (rows[-1]["expiration_date"], rows[-1]["user_id"])
+
+    def iter_expired_subscriptions(self, page_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Percorre as assinaturas expiradas em páginas (keyset)"""
+        return self._iter_subscriptions("expiration_date < $1", (datetime.now(),), page_size)
+
+    def iter_subscriptions_expiring_soon(self, days: int,
+                                         page_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Percorre as assinaturas que expiram em X dias, em páginas (keyset)"""
+        now = datetime.now()
+        return self._iter_subscriptions("expiration_date BETWEEN $1 AND $2",
+                                        (now, now + timedelta(days=days)), page_size)
+
+    async def add_payment(self, user_id: int, payment_id: str, plan_type: str,
+                          amount: float, pix_code: str, qr_code_base64: Optional[str] = None,
+                          locale: Optional[str] = None) -> bool:
+        """Adiciona um novo pagamento (com a imagem do QR e o idioma do usuário)"""
+        try:
+            pool = await self._pool()
+            await pool.execute('''
+                INSERT INTO payments
+                (user_id, payment_id, plan_type, amount, pix_code, qr_code_base64, locale)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ''', user_id, payment_id, plan_type, amount, pix_code, qr_code_base64, locale)
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao adicionar pagamento: {e}")
+            return False
+
+    async def update_payment_status(self, payment_id: str, status: str) -> bool:
+        """Atualiza o status de um pagamento"""
+        try:
+            pool = await self._pool()
+            await pool.execute('''
+                UPDATE payments SET status = $1, updated_at = LOCALTIMESTAMP
+                WHERE payment_id = $2
+            ''', status, payment_id)
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao atualizar status do pagamento: {e}")
+            return False
+
+    async def get_payment_by_id(self, payment_id: str) -> Optional[Dict[str, Any]]:
+        """Obtém um pagamento pelo ID"""
+        try:
+            pool = await self._pool()
+            row = await pool.fetchrow('''
+                SELECT * FROM payments WHERE payment_id = $1
+            ''', payment_id)
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Erro ao obter pagamento: {e}")
+            return None
+
+    async def set_payment_message(self, payment_id: str, chat_id: int, message_id: int) -> bool:
+        """Grava a mensagem do Telegram que mostra o pagamento"""
+        try:
+            pool = await self._pool()
+            await pool.execute('''
+                UPDATE payments SET chat_id = $1, message_id = $2, updated_at = LOCALTIMESTAMP
+                WHERE payment_id = $3
+            ''', chat_id, message_id, payment_id)
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao gravar mensagem do pagamento: {e}")
+            return False
+
+    async def set_payment_qr_file_id(self, payment_id: str, file_id: str) -> bool:
+        """Grava o file_id da foto do QR enviada ao Telegram"""
+        try:
+            pool = await self._pool()
+            await pool.execute('''
+                UPDATE payments SET qr_file_id = $1 WHERE payment_id = $2
+            ''', file_id, payment_id)
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao gravar file_id do QR: {e}")
+            return False
+
+    async def get_sales_summary(self) -> Dict[str, Any]:
+        """Obtém resumo de vendas para o admin"""
+        try:
+            pool = await self._pool()
+            async with pool.acquire() as conn:
+                counts = await conn.fetchrow('''
+                    SELECT
+                        COUNT(*) FILTER (WHERE status = 'active'),
+                        COUNT(*) FILTER (WHERE status = 'expired')
+                    FROM subscriptions
+                ''')
+                sales = await conn.fetchrow('''
+                    SELECT COUNT(*), SUM(amount) FROM payments WHERE status = 'approved'
+                ''')
+                sales_by_plan = await conn.fetch('''
+                    SELECT plan_type, COUNT(*), SUM(amount)
+                    FROM payments
+                    WHERE status = 'approved'
+                    GROUP BY plan_type
+                    ORDER BY plan_type
+                ''')
+
+            return {
+                'active_subscriptions': counts[0],
+                'expired_subscriptions': counts[1],
+                'total_sales': sales[0] or 0,
+                'total_revenue': sales[1] or 0,
+                'sales_by_plan': [tuple(row) for row in sales_by_plan]
+            }
+        except Exception as e:
+            logger.error(f"Erro ao obter resumo de vendas: {e}")
+            return {}
+
+    async def add_notification(self, user_id: int, notification_type: str) -> bool:
+        """Registra uma notificação enviada"""
+        try:
+            pool = await self._pool()
+            await pool.execute('''
+                INSERT INTO notifications (user_id, notification_type) VALUES ($1, $2)
+            ''', user_id, notification_type)
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao adicionar notificação: {e}")
+            return False
+
+    async def has_recent_notification(self, user_id: int, notification_type: str,
+                                      hours: int = 24) -> bool:
+        """Verifica se uma notificação foi enviada recentemente"""
+        try:
+            pool = await self._pool()
+            found = await pool.fetchval('''
+                SELECT EXISTS (
+                    SELECT 1 FROM notifications
+                    WHERE user_id = $1 AND notification_type = $2 AND sent_at > $3
+                )
+            ''', user_id, notification_type, datetime.now() - timedelta(hours=hours))
+            return found
+        except Exception as e:
+            logger.error(f"Erro ao verificar notificação recente: {e}")
+            return False
+
+
+class PostgresSqlStore(SqlStore):
+    """Tabelas auxiliares no mesmo banco (e pools) do ``PostgresDatabase``"""
+
+    types = {
+        "id": "BIGSERIAL PRIMARY KEY",
+        "bigint": "BIGINT",
+        "datetime": "TIMESTAMP"
+    }
+
+    def __init__(self, db: PostgresDatabase, conn=None):
+        self.db = db
+        self.conn = conn  # Conexão da transação em andamento, se houver
+
+    async def _target(self):
+        return self.conn if self.conn is not None else await self.db._pool()
+
+    async def create_tables(self, statements: List[str]):
+        pool = await self.db._pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext('schema'))")
+                for statement in statements:
+                    await conn.execute(statement.format(**self.types))
+
+    async def execute(self, query: str, *args) -> int:
+        status = await (await self._target()).execute(numbered_placeholders(query), *args)
+        count = status.rsplit(" ", 1)[-1]  # Ex.: "UPDATE 3", "INSERT 0 1"
+        return int(count) if count.isdigit() else 0
+
+    async def insert(self, query: str, *args) -> int:
+        return await (await self._target()).fetchval(
+            numbered_placeholders(query) + " RETURNING id", *args
+        )
+
+    async def fetch(self, query: str, *args) -> List[Dict[str, Any]]:
+        rows = await (await self._target()).fetch(numbered_placeholders(query), *args)
+        return [dict(row) for row in rows]
+
+    @asynccontextmanager
+    async def transaction(self, lock: str) -> AsyncIterator["PostgresSqlStore"]:
+        pool = await self.db._pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # Serializa entre processos as transações com o mesmo nome
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", lock)
+                yield PostgresSqlStore(self.db, conn)
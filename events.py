@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import EVENT_POLL_INTERVAL, EVENT_BATCH_SIZE, EVENT_MAX_ATTEMPTS, EVENT_RETENTION_HOURS
+from metrics import metrics
+from sql_store import SqlStore
+from storage import get_database
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("events_published_total", "Eventos gravados no outbox, por tipo")
+metrics.describe("events_delivered_total", "Entregas de eventos, por tipo e resultado")
+metrics.describe("event_delivery_lag_seconds", "Tempo entre publicação e entrega do último evento")
+
+# Pagamento aprovado pelo webhook: {user_id, payment_id, plan_type, expiration_date, locale}
+PAYMENT_APPROVED = "payment_approved"
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS event_outbox (
+        id {id},
+        event_type TEXT NOT NULL,
+        dedupe_key TEXT UNIQUE,
+        payload TEXT NOT NULL,
+        status TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        last_error TEXT,
+        available_at {datetime} NOT NULL,
+        created_at {datetime} NOT NULL,
+        delivered_at {datetime}
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_event_outbox_pending ON event_outbox (status, available_at)'
+]
+
+
+class EventBus:
+    """Eventos do webhook para o bot, com outbox na tabela ``event_outbox``
+
+    ``publish`` grava o evento no outbox (no banco de ``DATABASE_BACKEND``)
+    e acorda os consumidores do mesmo processo (``main.py`` roda bot e
+    webhook juntos, em loops diferentes); consumidores em outro processo
+    leem o outbox a cada ``EVENT_POLL_INTERVAL``. A entrega é "pelo menos uma vez": um handler
+    que falha é repetido com espera crescente, então handlers devem ser
+    idempotentes. ``dedupe_key`` evita gravar o mesmo evento duas vezes
+    (o Mercado Pago reenvia notificações).
+    """
+
+    def __init__(self, sql: SqlStore):
+        self.sql = sql
+        self.ready = False
+        self.handlers: Dict[str, List[Handler]] = {}
+        self._wakeups: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        self._lock = threading.Lock()
+
+    async def init_table(self):
+        """Cria a tabela do outbox se necessário (uma vez por instância)"""
+        if not self.ready:
+            await self.sql.create_tables(SCHEMA)
+            self.ready = True
+
+    def subscribe(self, event_type: str, handler: Handler):
+        """Registra um handler; só tipos com handler são consumidos neste processo"""
+        self.handlers.setdefault(event_type, []).append(handler)
+
+    async def publish(self, event_type: str, payload: Dict[str, Any],
+                      dedupe_key: Optional[str] = None) -> bool:
+        """Grava o evento no outbox; retorna False se ele já existia
+
+        Erros de gravação levantam exceção: quem publica precisa saber que o
+        evento não foi gravado (o webhook responde 5xx e o MP reenvia).
+        """
+        await self.init_table()
+        now = datetime.now()
+        inserted = await self.sql.execute('''
+            INSERT INTO event_outbox (event_type, dedupe_key, payload, available_at, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (dedupe_key) DO NOTHING
+        ''', event_type, dedupe_key, json.dumps(payload, default=str), now, now) == 1
+
+        if inserted:
+            metrics.inc("events_published_total", type=event_type)
+            self._wake()
+        return inserted
+
+    def _wake(self):
+        """Acorda os consumidores deste processo (de qualquer thread)"""
+        with self._lock:
+            wakeups = list(self._wakeups)
+        for loop, event in wakeups:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # Loop já encerrado
+                pass
+
+    async def _fetch_pending(self, event_types: List[str], limit: int) -> List[Dict[str, Any]]:
+        await self.init_table()
+        return await self.sql.fetch(f'''
+            SELECT * FROM event_outbox
+            WHERE status = 'pending' AND available_at <= ?
+              AND event_type IN ({",".join("?" * len(event_types))})
+            ORDER BY id
+            LIMIT ?
+        ''', datetime.now(), *event_types, limit)
+
+    async def _mark(self, event_id: int, status: str, attempts: int, error: Optional[str] = None,
+                    retry_in: float = 0.0):
+        now = datetime.now()
+        await self.sql.execute('''
+            UPDATE event_outbox
+            SET status = ?, attempts = ?, last_error = ?, available_at = ?, delivered_at = ?
+            WHERE id = ?
+        ''', status, attempts, error, now + timedelta(seconds=retry_in),
+            None if status == 'pending' else now, event_id)
+
+    async def _prune(self):
+        await self.init_table()
+        await self.sql.execute('''
+            DELETE FROM event_outbox WHERE status != 'pending' AND delivered_at < ?
+        ''', datetime.now() - timedelta(hours=EVENT_RETENTION_HOURS))
+
+    async def _deliver(self, event: Dict[str, Any]):
+        event_type = event["event_type"]
+        attempts = event["attempts"] + 1
+        try:
+            payload = json.loads(event["payload"])
+            for handler in self.handlers.get(event_type, []):
+                await handler(payload)
+        except Exception as e:
+            if attempts >= EVENT_MAX_ATTEMPTS:
+                logger.error(f"Evento {event['id']} ({event_type}) descartado após "
+                             f"{attempts} tentativas: {e}")
+                await self._mark(event["id"], "failed", attempts, str(e))
+                metrics.inc("events_delivered_total", type=event_type, result="failed")
+            else:
+                logger.warning(f"Erro ao entregar evento {event['id']} ({event_type}): {e}")
+                await self._mark(event["id"], "pending", attempts, str(e),
+                                 EVENT_POLL_INTERVAL * 2 ** attempts)
+                metrics.inc("events_delivered_total", type=event_type, result="retry")
+            return
+
+        await self._mark(event["id"], "delivered", attempts)
+        metrics.inc("events_delivered_total", type=event_type, result="ok")
+        lag = (datetime.now() - event["created_at"]).total_seconds()
+        metrics.set_gauge("event_delivery_lag_seconds", lag)
+
+    async def dispatch(self) -> int:
+        """Entrega um lote de eventos pendentes; retorna quantos foram lidos"""
+        if not self.handlers:
+            return 0
+        events = await self._fetch_pending(list(self.handlers), EVENT_BATCH_SIZE)
+        for event in events:
+            await self._deliver(event)
+        return len(events)
+
+    async def run(self):
+        """Consome o outbox: na hora para eventos deste processo, por polling para os de fora"""
+        wakeup = asyncio.Event()
+        with self._lock:
+            self._wakeups.append((asyncio.get_running_loop(), wakeup))
+        try:
+            while True:
+                try:
+                    if await self.dispatch() >= EVENT_BATCH_SIZE:
+                        continue
+                    await self._prune()
+                except Exception as e:
+                    logger.error(f"Erro ao consumir eventos: {e}")
+
+                try:
+                    await asyncio.wait_for(wakeup.wait(), EVENT_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+        finally:
+            with self._lock:
+                self._wakeups.remove((asyncio.get_running_loop(), wakeup))
+
+
+@lru_cache(maxsize=None)
+def get_event_bus() -> EventBus:
+    """Barramento compartilhado por bot e webhook no mesmo processo"""
+    return EventBus(get_database().sql)
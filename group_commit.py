@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("db_group_commit_writes_total", "Escritas aplicadas pelo group commit, por resultado")
+metrics.describe("db_group_commit_batches_total", "Transações (commits) do group commit")
+
+WriteFunc = Callable[[sqlite3.Connection], Any]
+
+_STOP = object()
+
+
+class _BrokenConnection(Exception):
+    pass
+
+
+class GroupCommitWriter:
+    """Agrupa escritas concorrentes em uma única transação SQLite
+
+    Cada chamada de ``submit`` entra numa fila; uma thread dedicada junta
+    o que chegar em até ``max_delay`` segundos (no máximo ``max_batch``
+    escritas) e aplica tudo em uma transação, com um único commit (fsync).
+    Cada escrita roda no seu próprio SAVEPOINT: se ela falhar, só ela é
+    desfeita e só o seu chamador recebe a exceção. O resultado só é
+    entregue depois do COMMIT, então um ``await`` concluído continua
+    significando dado gravado. Se a conexão não abrir, toda a fila recebe
+    o erro (o próximo ``submit`` tenta de novo); se um ROLLBACK falhar, a
+    conexão é reaberta. Nenhum chamador fica esperando para sempre.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection],
+                 max_batch: int = 256, max_delay: float = 0.002):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="db-group-commit",
+                                            daemon=True)
+            self._thread.start()
+
+    async def submit(self, func: WriteFunc) -> Any:
+        """Agenda ``func(conn)`` no próximo lote e aguarda o commit"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Sob o lock: ou a thread viva consome o item, ou _fail_pending o entrega com erro
+        with self._lock:
+            self._ensure_started()
+            self._queue.put((func, loop, future))
+        return await future
+
+    def stop(self, timeout: float = 5.0):
+        """Aplica o que estiver na fila e encerra a thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def _collect(self, first) -> Tuple[List[tuple], bool]:
+        batch, stop = [first], False
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _run(self):
+        while True:
+            try:
+                conn = self.connect()
+                conn.isolation_level = None  # Transações controladas manualmente
+            except Exception as e:
+                # Sem conexão não há o que aplicar: a fila inteira recebe o erro
+                # e o próximo submit tenta com uma thread nova
+                logger.error(f"Erro ao abrir o banco no group commit: {e}")
+                self._fail_pending(e)
+                return
+            try:
+                while True:
+                    first = self._queue.get()
+                    if first is _STOP:
+                        return
+                    batch, stop = self._collect(first)
+                    self._apply(conn, batch)
+                    if stop:
+                        return
+            except _BrokenConnection:
+                # ROLLBACK falhou: a conexão está num estado desconhecido, reabre
+                continue
+            finally:
+                conn.close()
+
+    def _fail_pending(self, error: Exception):
+        """Encerra a thread atual e entrega ``error`` a tudo que está na fila"""
+        with self._lock:
+            if self._thread is threading.current_thread():
+                self._thread = None
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                if item is not _STOP:
+                    self._deliver([item], [(False, error)])
+
+    def _apply(self, conn: sqlite3.Connection, batch: List[tuple]):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for func, _, _ in batch:
+                conn.execute("SAVEPOINT write")
+                try:
+                    outcomes.append((True, func(conn)))
+                    conn.execute("RELEASE write")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    conn.execute("RELEASE write")
+                    outcomes.append((False, e))
+            conn.execute("COMMIT")
+            metrics.inc("db_group_commit_batches_total")
+        except Exception as e:
+            # Falha da transação inteira (ex.: banco travado, disco cheio):
+            # nada foi gravado, todos os chamadores do lote recebem o erro
+            logger.error(f"Erro no group commit ({len(batch)} escritas): {e}")
+            outcomes = [(False, e)] * len(batch)
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            except Exception as rollback_error:
+                logger.error(f"Erro no ROLLBACK do group commit: {rollback_error}")
+                self._deliver(batch, outcomes)
+                raise _BrokenConnection() from rollback_error
+
+        self._deliver(batch, outcomes)
+
+    def _deliver(self, batch: List[tuple], outcomes: List[Tuple[bool, Any]]):
+        for (_, loop, future), (ok, value) in zip(batch, outcomes):
+            metrics.inc("db_group_commit_writes_total", result="ok" if ok else "error")
+            try:
+                loop.call_soon_threadsafe(_resolve, future, ok, value)
+            except RuntimeError:  # Event loop do chamador já encerrado
+                pass
+
+
+def _resolve(future: asyncio.Future, ok: bool, value: Any):
+    if future.done():  # Chamador cancelado
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from config import (
+    GROUP_ID, INVITE_POOL_SIZE, INVITE_LINK_TTL_HOURS, INVITE_LINK_MIN_REMAINING_HOURS,
+    INVITE_POOL_REFILL_SECONDS
+)
+from metrics import metrics
+from sql_store import SqlStore
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("invite_pool_available", "Links de convite disponíveis no pool")
+metrics.describe("invite_pool_taken_total", "Links entregues a pagamentos aprovados")
+metrics.describe("invite_pool_empty_total", "Pedidos de link com o pool vazio")
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS invite_links (
+        id {id},
+        invite_link TEXT NOT NULL UNIQUE,
+        status TEXT DEFAULT 'available',
+        user_id {bigint},
+        payment_id TEXT,
+        expires_at {datetime} NOT NULL,
+        assigned_at {datetime},
+        created_at {datetime} DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_invite_links_status ON invite_links (status, expires_at)',
+    'CREATE INDEX IF NOT EXISTS idx_invite_links_payment ON invite_links (payment_id)'
+]
+
+
+class InviteLinkPool:
+    """Pool de links de convite de uso único gerados antecipadamente
+
+    Os links são criados em segundo plano (``create_chat_invite_link`` com
+    ``member_limit=1`` e validade limitada) e guardados na tabela
+    ``invite_links``, no banco de ``DATABASE_BACKEND``. Um pagamento
+    aprovado apenas reserva um link já pronto, sem chamada à API do
+    Telegram no caminho crítico.
+    """
+
+    def __init__(self, sql: SqlStore, bot=None):
+        self.sql = sql
+        self.bot = bot
+        self.ready = False
+
+    async def init_table(self):
+        """Cria a tabela do pool se necessário (uma vez por instância)"""
+        if not self.ready:
+            await self.sql.create_tables(SCHEMA)
+            self.ready = True
+
+    async def take(self, user_id: int, payment_id: str) -> Optional[str]:
+        """Reserva um link para o pagamento (idempotente por ``payment_id``)
+
+        Retorna None se o pool estiver vazio; quem chama usa o link fixo.
+        """
+        try:
+            await self.init_table()
+            now = datetime.now()
+
+            # Transação serializada: dois aprovadores não pegam o mesmo link
+            async with self.sql.transaction("invite_links") as tx:
+                link = await tx.fetchval('''
+                    SELECT invite_link FROM invite_links
+                    WHERE payment_id = ? AND status = 'assigned' AND expires_at > ?
+                ''', payment_id, now)
+
+                if link is None:
+                    available = await tx.fetchrow('''
+                        SELECT id, invite_link FROM invite_links
+                        WHERE status = 'available' AND expires_at > ?
+                        ORDER BY expires_at
+                        LIMIT 1
+                    ''', now + timedelta(hours=INVITE_LINK_MIN_REMAINING_HOURS))
+
+                    if available is not None:
+                        await tx.execute('''
+                            UPDATE invite_links
+                            SET status = 'assigned', user_id = ?, payment_id = ?, assigned_at = ?
+                            WHERE id = ?
+                        ''', user_id, payment_id, now, available["id"])
+                        link = available["invite_link"]
+                        metrics.inc("invite_pool_taken_total")
+
+            if link is None:
+                metrics.inc("invite_pool_empty_total")
+            return link
+        except Exception as e:
+            logger.error(f"Erro ao reservar link de convite: {e}")
+            return None
+
+    async def get_assignment(self, invite_link: str) -> Optional[dict]:
+        """Obtém para qual assinante/pagamento um link foi entregue"""
+        try:
+            await self.init_table()
+            return await self.sql.fetchrow('''
+                SELECT * FROM invite_links WHERE invite_link = ?
+            ''', invite_link)
+        except Exception as e:
+            logger.error(f"Erro ao obter link de convite: {e}")
+            return None
+
+    async def count_available(self) -> int:
+        """Conta os links disponíveis com validade suficiente"""
+        await self.init_table()
+        count = await self.sql.fetchval('''
+            SELECT COUNT(*) FROM invite_links
+            WHERE status = 'available' AND expires_at > ?
+        ''', datetime.now() + timedelta(hours=INVITE_LINK_MIN_REMAINING_HOURS))
+        metrics.set_gauge("invite_pool_available", count)
+        return count
+
+    async def add(self, invite_link: str, expires_at: datetime):
+        """Guarda um link recém-criado como disponível"""
+        await self.init_table()
+        await self.sql.execute('''
+            INSERT INTO invite_links (invite_link, expires_at) VALUES (?, ?)
+        ''', invite_link, expires_at)
+
+    async def refill(self):
+        """Cria links até o pool atingir ``INVITE_POOL_SIZE``"""
+        missing = INVITE_POOL_SIZE - await self.count_available()
+
+        for _ in range(max(missing, 0)):
+            expires_at = datetime.now() + timedelta(hours=INVITE_LINK_TTL_HOURS)
+            invite = await self.bot.create_chat_invite_link(
+                GROUP_ID, expire_date=expires_at, member_limit=1
+            )
+            await self.add(invite.invite_link, expires_at)
+
+            # Espaça as chamadas para não esbarrar no limite da API
+            await asyncio.sleep(0.1)
+
+        await self.count_available()
+
+    async def revoke_expired(self):
+        """Revoga links sem validade suficiente e links entregues há tempo demais
+
+        Um link entregue vale ``INVITE_LINK_MIN_REMAINING_HOURS`` para o
+        assinante; depois disso é revogado no Telegram, usado ou não, para
+        que um link vazado não continue servindo.
+        """
+        await self.init_table()
+        now = datetime.now()
+        window = timedelta(hours=INVITE_LINK_MIN_REMAINING_HOURS)
+
+        # Disponíveis sem validade suficiente para serem entregues
+        stale = await self.sql.fetch('''
+            SELECT id, invite_link, expires_at FROM invite_links
+            WHERE status = 'available' AND expires_at <= ?
+        ''', now + window)
+
+        # Entregues cujo prazo de uso acabou
+        stale += await self.sql.fetch('''
+            SELECT id, invite_link, expires_at FROM invite_links
+            WHERE status = 'assigned' AND (assigned_at <= ? OR expires_at <= ?)
+        ''', now - window, now)
+
+        for link in stale:
+            status = 'revoked'
+            try:
+                await self.bot.revoke_chat_invite_link(GROUP_ID, link["invite_link"])
+            except Exception as e:
+                logger.error(f"Erro ao revogar link {link['invite_link']}: {e}")
+                # Ainda válido no Telegram: tenta de novo na próxima rodada
+                if link["expires_at"] > now:
+                    continue
+                status = 'expired'
+
+            await self.sql.execute('''
+                UPDATE invite_links SET status = ? WHERE id = ?
+            ''', status, link["id"])
+
+    async def run(self):
+        """Mantém o pool abastecido em segundo plano"""
+        while True:
+            try:
+                await self.revoke_expired()
+                await self.refill()
+            except Exception as e:
+                logger.error(f"Erro ao abastecer pool de convites: {e}")
+
+            await asyncio.sleep(INVITE_POOL_REFILL_SECONDS)
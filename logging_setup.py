@@ -0,0 +1,163 @@
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from config import LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES
+from metrics import metrics
+
+metrics.describe("log_records_dropped_total", "Registros de log descartados com a fila cheia")
+metrics.describe("log_records_sampled_out_total", "Registros de log omitidos pela amostragem")
+
+# Ids de correlação do contexto atual (cada tarefa asyncio tem sua cópia)
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+payment_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("payment_id", default=None)
+user_id_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("user_id", default=None)
+
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sample"}
+
+
+def bind(request_id: Optional[str] = None, payment_id: Optional[str] = None,
+         user_id: Optional[int] = None):
+    """Associa ids de correlação ao contexto atual"""
+    if request_id is not None:
+        request_id_var.set(request_id)
+    if payment_id is not None:
+        payment_id_var.set(payment_id)
+    if user_id is not None:
+        user_id_var.set(user_id)
+
+
+class CorrelationFilter(logging.Filter):
+    """Copia os ids de correlação para o registro (na thread de quem loga)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.payment_id = payment_id_var.get()
+        record.user_id = user_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Amostra eventos de alto volume marcados com ``extra={"sample": "<chave>"}``
+
+    Com taxa 0.1 apenas 1 de cada 10 registros da chave é mantido.
+    Registros de WARNING para cima nunca são amostrados.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.every = {key: max(1, round(1 / rate)) for key, rate in rates.items() if rate > 0}
+        self.counters = {key: itertools.count() for key in self.every}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if key is None or key not in self.every or record.levelno >= logging.WARNING:
+            return True
+        if next(self.counters[key]) % self.every[key] == 0:
+            return True
+        metrics.inc("log_records_sampled_out_total", key=key)
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Formata registros como uma linha JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:  # Já formatado por NonBlockingQueueHandler.prepare
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (e conta) registros quando a fila está cheia
+
+    O traceback é formatado na thread de quem loga e guardado em
+    ``exc_text``, fora da mensagem: os handlers da fila o recebem como
+    campo próprio (``exc`` no JSON).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        exc_text = record.exc_text
+        if record.exc_info:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        # Sem exc_info/exc_text, a classe base não junta o traceback à mensagem
+        record.exc_info = None
+        record.exc_text = None
+        prepared = super().prepare(record)
+        prepared.exc_text = exc_text
+        return prepared
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total")
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def stop_logging():
+    """Esvazia a fila e encerra a thread de escrita"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging(level: int = logging.INFO, log_file: Optional[str] = LOG_FILE) -> logging.handlers.QueueListener:
+    """Configura o logging do processo
+
+    Handlers da aplicação só colocam o registro numa fila; uma thread em
+    segundo plano (QueueListener) grava em arquivo JSON com rotação por
+    tamanho e no stdout. Chamadas repetidas reaproveitam o pipeline.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    outputs = []
+    if log_file:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+        file_handler.setFormatter(JsonFormatter())
+        outputs.append(file_handler)
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    ))
+    outputs.append(console_handler)
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    queue_handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *outputs, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
@@ -0,0 +1,146 @@
+import asyncio
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from config import LOOP_LAG_INTERVAL, LOOP_BLOCK_THRESHOLD
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("event_loop_lag_seconds", "Atraso do último tick do event loop")
+metrics.describe("event_loop_max_lag_seconds", "Maior atraso do event loop desde o início")
+metrics.describe("event_loop_blocked_total", "Bloqueios do event loop acima do limite")
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _is_project_frame(frame) -> bool:
+    filename = frame.f_code.co_filename
+    return filename.startswith(PROJECT_DIR) and "site-packages" not in filename
+
+
+class LoopMonitor:
+    """Mede o atraso (lag) de um event loop e captura quem o bloqueia
+
+    Uma tarefa no loop dorme ``interval`` segundos e mede quanto acordou
+    atrasada. Uma thread separada vigia o último batimento: se o loop fica
+    parado mais que ``threshold``, a pilha da thread do loop é capturada
+    enquanto o bloqueio ainda acontece, junto com o handler (corrotina do
+    projeto mais interna na pilha).
+    """
+
+    def __init__(self, name: str, interval: float = LOOP_LAG_INTERVAL,
+                 threshold: float = LOOP_BLOCK_THRESHOLD, history: int = 20):
+        self.name = name
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.blocked_count = 0
+        self.blocked_events: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._pending: Optional[Dict[str, Any]] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Inicia a medição no loop atual e a thread de vigia"""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        asyncio.get_running_loop().create_task(self._measure())
+        threading.Thread(target=self._watch, name=f"loop-monitor-{self.name}", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    async def _measure(self):
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self._heartbeat = now
+
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            metrics.set_gauge("event_loop_lag_seconds", lag, loop=self.name)
+            metrics.set_gauge("event_loop_max_lag_seconds", self.max_lag, loop=self.name)
+
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                pending["duration_ms"] = round(lag * 1000, 1)
+                # A pilha só vai para o log: /health é público
+                logger.warning(
+                    f"Event loop '{self.name}' bloqueado por {pending['duration_ms']} ms "
+                    f"em {pending['handler']}\n" + "\n".join(pending["stack"])
+                )
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled > self.threshold and self._pending is None:
+                self._capture(stalled)
+
+    def _capture(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+
+        stack = traceback.format_stack(frame)[-15:]
+        chain: List[str] = []
+        location = None
+        while frame is not None:
+            if _is_project_frame(frame):
+                if location is None:
+                    location = f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}"
+                if frame.f_code.co_flags & inspect.CO_COROUTINE:
+                    chain.append(frame.f_code.co_qualname)
+            frame = frame.f_back
+
+        event = {
+            "at": datetime.now().isoformat(),
+            "handler": chain[0] if chain else "desconhecido",
+            "chain": " > ".join(reversed(chain)),
+            "location": location,
+            "duration_ms": round(stalled * 1000, 1),
+            "stack": [line.rstrip() for line in stack]
+        }
+        self.blocked_count += 1
+        self.blocked_events.append(event)
+        self._pending = event
+        metrics.inc("event_loop_blocked_total", loop=self.name, handler=event["handler"])
+
+    def health(self) -> Dict[str, Any]:
+        """Resumo para o endpoint /health (sem a pilha, que fica só no log)"""
+        last = self.blocked_events[-1] if self.blocked_events else None
+        if last is not None:
+            last = {key: value for key, value in last.items() if key != "stack"}
+        stalled = max(0.0, time.monotonic() - self._heartbeat - self.interval)
+        return {
+            "lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalled_ms": round(stalled * 1000, 1),
+            "blocked_count": self.blocked_count,
+            "last_blocked": last,
+            "healthy": stalled < self.threshold and self.last_lag < self.threshold
+        }
+
+
+# Monitores ativos por nome de loop ("bot", "webhook")
+monitors: Dict[str, LoopMonitor] = {}
+
+
+def start_loop_monitor(name: str) -> LoopMonitor:
+    """Cria e inicia um monitor para o event loop em execução"""
+    monitor = LoopMonitor(name)
+    monitors[name] = monitor
+    monitor.start()
+    return monitor
@@ -4,17 +4,15 @@ from bot import main as bot_main
 from webhook import app as webhook_app
 import threading
 import logging
+from logging_setup import setup_logging
 
-# Configuração de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configuração de logging (fila + thread de escrita, JSON com rotação em bot.log)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 def run_webhook():
     """Executa o servidor webhook em uma thread separada"""
-    uvicorn.run(webhook_app, host="0.0.0.0", port=8000, log_level="info")
+    uvicorn.run(webhook_app, host="0.0.0.0", port=8000, log_config=None)
 
 def run_bot():
     """Executa o bot do Telegram"""
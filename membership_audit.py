@@ -0,0 +1,245 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Set
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from access import active_members
+from config import (
+    ADMIN_ID, GROUP_ID, AUDIT_REMOVAL_RATE, AUDIT_REMOVAL_WORKERS, AUDIT_INTERVAL_SECONDS,
+    AUDIT_AUTO_REMOVE, AUDIT_MAX_REMOVAL_FRACTION
+)
+from metrics import metrics
+from ratelimit import TokenBucket
+from sql_store import SqlStore
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("group_roster_members", "Membros do grupo conhecidos pelo roster")
+metrics.describe("membership_audit_intruders", "Membros sem assinatura ativa na última auditoria")
+metrics.describe("membership_audit_removals_total", "Remoções feitas pela auditoria, por resultado")
+
+# Status do Telegram que contam como "está no grupo"
+MEMBER_STATUSES = {"member", "restricted"}
+
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS group_members (
+        user_id {bigint} PRIMARY KEY,
+        status TEXT NOT NULL,
+        is_bot INTEGER DEFAULT 0,
+        updated_at {datetime} DEFAULT CURRENT_TIMESTAMP
+    )
+    '''
+]
+
+
+class GroupRoster:
+    """Membros do grupo, mantidos a partir das atualizações ``chat_member``
+
+    A Bot API não lista os membros de um grupo; o roster é a soma do que o
+    bot viu entrar e sair (tabela ``group_members``). Membros que entraram
+    antes do bot receber essas atualizações só aparecem quando mudarem de
+    status.
+    """
+
+    def __init__(self, sql: SqlStore):
+        self.sql = sql
+        self.ready = False
+
+    async def init_table(self):
+        """Cria a tabela do roster se necessário (uma vez por instância)"""
+        if not self.ready:
+            await self.sql.create_tables(SCHEMA)
+            self.ready = True
+
+    async def update(self, user_id: int, status: str, is_bot: bool = False):
+        """Grava o status atual de um usuário no grupo"""
+        await self.init_table()
+        await self.sql.execute('''
+            INSERT INTO group_members (user_id, status, is_bot, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                status = excluded.status,
+                is_bot = excluded.is_bot,
+                updated_at = excluded.updated_at
+        ''', user_id, status, int(is_bot), datetime.now())
+
+    async def get_member_ids(self) -> Set[int]:
+        """Usuários (não bots, não administradores) que estão no grupo"""
+        await self.init_table()
+        rows = await self.sql.fetch(f'''
+            SELECT user_id FROM group_members
+            WHERE is_bot = 0 AND status IN ({",".join("?" * len(MEMBER_STATUSES))})
+        ''', *MEMBER_STATUSES)
+        members = {row["user_id"] for row in rows}
+        metrics.set_gauge("group_roster_members", len(members))
+        return members
+
+
+def member_status(chat_member) -> str:
+    """Normaliza o status de um ``ChatMember`` (restrito fora do grupo conta como saída)"""
+    status = chat_member.status
+    if status == "restricted" and not getattr(chat_member, "is_member", True):
+        return "left"
+    return status
+
+
+class MembershipAuditor:
+    """Compara o roster com as assinaturas ativas e remove quem sobra
+
+    A diferença é calculada com conjuntos (roster − ativos − protegidos).
+    As remoções passam por ``AUDIT_REMOVAL_WORKERS`` workers e um limite
+    global de ``AUDIT_REMOVAL_RATE`` chamadas por segundo; a remoção é um
+    ban seguido de unban, para que a pessoa possa voltar se assinar.
+
+    Erros de leitura do banco sobem (nada é removido com dados parciais),
+    e a remoção é abortada se não houver nenhum assinante ativo ou se mais
+    de ``max_removal_fraction`` do roster ficar sem assinatura.
+    """
+
+    def __init__(self, bot, db, roster: GroupRoster, rate: float = AUDIT_REMOVAL_RATE,
+                 workers: int = AUDIT_REMOVAL_WORKERS,
+                 max_removal_fraction: float = AUDIT_MAX_REMOVAL_FRACTION):
+        self.bot = bot
+        self.db = db
+        self.roster = roster
+        self.workers = workers
+        self.max_removal_fraction = max_removal_fraction
+        self.limiter = TokenBucket(rate, max(rate, 1))
+        self._lock = asyncio.Lock()
+
+    async def _protected_ids(self) -> Set[int]:
+        protected = {ADMIN_ID}
+        try:
+            for admin in await self.bot.get_chat_administrators(GROUP_ID):
+                protected.add(admin.user.id)
+        except Exception as e:
+            logger.warning(f"Administradores do grupo não obtidos: {e}")
+        return protected
+
+    async def find_intruders(self) -> Dict[str, Any]:
+        """Calcula a diferença entre o roster e as assinaturas ativas
+
+        Falhas de leitura do roster ou das assinaturas levantam exceção.
+        """
+        roster = await self.roster.get_member_ids()
+        active = {user_id for user_id, _ in await self.db.get_active_members()}
+        protected = await self._protected_ids()
+
+        intruders = roster - active - protected
+        metrics.set_gauge("membership_audit_intruders", len(intruders))
+        return {
+            "roster": len(roster),
+            "active": len(active),
+            "active_in_group": len(roster & active),
+            "protected": len(roster & protected),
+            "intruders": sorted(intruders)
+        }
+
+    def _abort_reason(self, report: Dict[str, Any]) -> Optional[str]:
+        """Motivo para não remover ninguém (resultado suspeito), se houver"""
+        intruders = len(report["intruders"])
+        if report["active"] == 0:
+            return "nenhuma assinatura ativa no banco"
+        if intruders > self.max_removal_fraction * report["roster"]:
+            return (f"{intruders} de {report['roster']} membros sem assinatura "
+                    f"(limite {self.max_removal_fraction:.0%})")
+        return None
+
+    async def _acquire(self):
+        while not self.limiter.consume():
+            await asyncio.sleep(self.limiter.wait_time())
+
+    async def _remove(self, user_id: int) -> str:
+        if active_members.is_active(user_id):  # Assinou depois do cálculo da diferença
+            return "skipped"
+        for _ in range(3):
+            await self._acquire()
+            try:
+                await self.bot.ban_chat_member(GROUP_ID, user_id)
+                await self.bot.unban_chat_member(GROUP_ID, user_id, only_if_banned=True)
+                await self.roster.update(user_id, "left")
+                return "removed"
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                # Usuário já saiu (roster desatualizado) ou virou administrador
+                logger.info(f"Auditoria: {user_id} não removido: {e}")
+                if "administrator" not in str(e).lower():
+                    await self.roster.update(user_id, "left")
+                return "skipped"
+            except TelegramForbiddenError as e:
+                logger.error(f"Auditoria sem permissão para remover membros: {e}")
+                return "failed"
+            except Exception as e:
+                logger.error(f"Erro ao remover {user_id} na auditoria: {e}")
+                break
+        return "failed"
+
+    async def remove(self, user_ids: Iterable[int]) -> Dict[str, int]:
+        """Remove os usuários com concorrência limitada e limite de taxa"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for user_id in user_ids:
+            queue.put_nowait(user_id)
+        counts = {"removed": 0, "skipped": 0, "failed": 0}
+
+        async def worker():
+            while True:
+                try:
+                    user_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                result = await self._remove(user_id)
+                counts[result] += 1
+                metrics.inc("membership_audit_removals_total", result=result)
+
+        await asyncio.gather(*(worker() for _ in range(self.workers)))
+        return counts
+
+    async def audit(self, dry_run: bool = True) -> Dict[str, Any]:
+        """Executa uma auditoria; com ``dry_run`` apenas relata"""
+        async with self._lock:
+            report = await self.find_intruders()
+            report["dry_run"] = dry_run
+            report["aborted"] = None
+            if not dry_run and report["intruders"]:
+                report["aborted"] = self._abort_reason(report)
+                if report["aborted"]:
+                    logger.error(f"Auditoria: remoção abortada, {report['aborted']}")
+                else:
+                    report.update(await self.remove(report["intruders"]))
+            return report
+
+    async def run(self):
+        """Auditoria periódica (remove só com AUDIT_AUTO_REMOVE ativo)"""
+        while True:
+            await asyncio.sleep(AUDIT_INTERVAL_SECONDS)
+            try:
+                report = await self.audit(dry_run=not AUDIT_AUTO_REMOVE)
+                logger.info(format_report(report))
+            except Exception as e:
+                logger.error(f"Erro na auditoria de membros: {e}")
+
+
+def format_report(report: Dict[str, Any], limit: Optional[int] = 20) -> str:
+    intruders = report["intruders"]
+    text = (
+        f"🔍 Auditoria do grupo{' (simulação)' if report['dry_run'] else ''}\n\n"
+        f"👥 Membros conhecidos: {report['roster']}\n"
+        f"✅ Assinantes ativos: {report['active']} ({report['active_in_group']} no grupo)\n"
+        f"🛡 Administradores: {report['protected']}\n"
+        f"🚫 Sem assinatura: {len(intruders)}\n"
+    )
+    if intruders and limit:
+        shown = ", ".join(str(user_id) for user_id in intruders[:limit])
+        more = f" e mais {len(intruders) - limit}" if len(intruders) > limit else ""
+        text += f"\n{shown}{more}\n"
+    if report.get("aborted"):
+        text += f"\n⛔ Remoção abortada: {report['aborted']}"
+    elif not report["dry_run"] and intruders:
+        text += (f"\n🧹 Removidos: {report['removed']} | "
+                 f"Já fora: {report['skipped']} | Falhas: {report['failed']}")
+    return text
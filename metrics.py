@@ -0,0 +1,82 @@
+import threading
+from typing import Dict, Tuple, Any
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class MetricsRegistry:
+    """Registro simples de métricas em memória (contadores e gauges)
+
+    Compartilhado entre o bot e o servidor webhook, que rodam em threads
+    diferentes do mesmo processo. Exposto em formato Prometheus pelo
+    endpoint /metrics do webhook.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._help: Dict[str, str] = {}
+
+    @staticmethod
+    def _key(labels: Dict[str, Any]) -> LabelKey:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def describe(self, name: str, help_text: str):
+        """Registra a descrição de uma métrica"""
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Incrementa um contador"""
+        key = self._key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """Define o valor atual de um gauge"""
+        key = self._key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def get(self, name: str, **labels) -> float:
+        """Obtém o valor atual de um contador ou gauge"""
+        key = self._key(labels)
+        with self._lock:
+            for store in (self._counters, self._gauges):
+                if name in store and key in store[name]:
+                    return store[name][key]
+        return 0
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Retorna uma cópia de todas as séries"""
+        result = {}
+        with self._lock:
+            for store in (self._counters, self._gauges):
+                for name, series in store.items():
+                    result[name] = {
+                        ",".join(f"{k}={v}" for k, v in key): value
+                        for key, value in series.items()
+                    }
+        return result
+
+    def render_prometheus(self) -> str:
+        """Renderiza as métricas no formato texto do Prometheus"""
+        lines = []
+        with self._lock:
+            for kind, store in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted(store):
+                    if name in self._help:
+                        lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in store[name].items():
+                        if key:
+                            label_str = ",".join(f'{k}="{v}"' for k, v in key)
+                            lines.append(f"{name}{{{label_str}}} {value}")
+                        else:
+                            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Instância global usada por todos os módulos
+metrics = MetricsRegistry()
@@ -1,12 +1,81 @@
-import mercadopago
 import uuid
+import threading
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
-from config import MP_ACCESS_TOKEN, PLANS
+from functools import lru_cache
+from typing import Dict, Any, Optional, Callable, TYPE_CHECKING
+from config import (
+    MP_ACCESS_TOKEN, PLANS, MP_TIMEOUTS, MP_MAX_ATTEMPTS, MP_RETRY_BUDGET_RATIO,
+    MP_BREAKER_FAILURE_THRESHOLD, MP_BREAKER_RESET_SECONDS
+)
+from resilience import (
+    CircuitBreaker, RetryBudget, CircuitOpenError, RetryableError, call_with_resilience
+)
+
+if TYPE_CHECKING:
+    from mercadopago.config import RequestOptions
+
+# Status HTTP que indicam falha transitória do Mercado Pago
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+UNAVAILABLE_MESSAGE = "Mercado Pago indisponível no momento. Tente novamente em instantes."
 
 class PaymentManager:
     def __init__(self):
-        self.mp = mercadopago.SDK(MP_ACCESS_TOKEN)
+        self._mp = None
+        self._mp_lock = threading.Lock()
+        self.retry_budget = RetryBudget(ratio=MP_RETRY_BUDGET_RATIO)
+        self.breakers = {
+            endpoint: CircuitBreaker(
+                endpoint,
+                failure_threshold=MP_BREAKER_FAILURE_THRESHOLD,
+                reset_timeout=MP_BREAKER_RESET_SECONDS
+            )
+            for endpoint in MP_TIMEOUTS
+        }
+    
+    @property
+    def mp(self):
+        """SDK do Mercado Pago, importado e criado no primeiro uso"""
+        if self._mp is None:
+            with self._mp_lock:
+                if self._mp is None:
+                    import mercadopago
+                    self._mp = mercadopago.SDK(MP_ACCESS_TOKEN)
+        return self._mp
+    
+    @mp.setter
+    def mp(self, sdk):
+        self._mp = sdk
+    
+    def _call_mp(self, endpoint: str, func: Callable[["RequestOptions"], Dict[str, Any]],
+                 custom_headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Chama o SDK com timeout do endpoint, retentativas e circuit breaker"""
+        import requests
+        from mercadopago.config import RequestOptions
+        
+        def attempt():
+            # As retentativas do SDK são desligadas; quem decide é o orçamento
+            options = RequestOptions(
+                connection_timeout=MP_TIMEOUTS[endpoint],
+                custom_headers=custom_headers,
+                max_retries=0
+            )
+            try:
+                response = func(options)
+            except (requests.RequestException, ValueError) as e:
+                # ValueError: corpo não-JSON (página HTML de 502/503 de um proxy)
+                raise RetryableError(str(e)) from e
+            
+            if response["status"] in RETRYABLE_STATUS:
+                raise RetryableError(f"HTTP {response['status']}")
+            return response
+        
+        return call_with_resilience(
+            attempt,
+            breaker=self.breakers[endpoint],
+            budget=self.retry_budget,
+            max_attempts=MP_MAX_ATTEMPTS
+        )
     
     def generate_pix_payment(self, user_id: int, plan_type: str, 
                            user_info: Dict[str, str]) -> Dict[str, Any]:
@@ -33,25 +102,33 @@ class PaymentManager:
                 "notification_url": "https://seu-dominio.com/webhook"
             }
             
-            payment_response = self.mp.payment().create(payment_data)
+            # A chave de idempotência evita pagamentos duplicados nas retentativas
+            payment_response = self._call_mp(
+                "payment_create",
+                lambda options: self.mp.payment().create(payment_data, options),
+                custom_headers={"x-idempotency-key": payment_id}
+            )
             
             if payment_response["status"] == 201:
                 payment_info = payment_response["response"]
                 
                 # Extrai o código PIX
                 pix_code = None
+                qr_code_base64 = None
                 if "point_of_interaction" in payment_info:
                     pix_data = payment_info["point_of_interaction"]["transaction_data"]
+                    qr_code_base64 = pix_data.get("qr_code_base64")
                     if "qr_code" in pix_data:
                         pix_code = pix_data["qr_code"]
-                    elif "qr_code_base64" in pix_data:
-                        pix_code = pix_data["qr_code_base64"]
+                    elif qr_code_base64:
+                        pix_code = qr_code_base64
                 
                 return {
                     "success": True,
                     "payment_id": payment_id,
                     "mp_payment_id": payment_info["id"],
                     "pix_code": pix_code,
+                    "qr_code_base64": qr_code_base64,
                     "amount": plan["price"],
                     "plan_type": plan_type,
                     "plan_name": plan["name"],
@@ -63,6 +140,12 @@ class PaymentManager:
                     "error": "Erro ao criar pagamento no Mercado Pago"
                 }
                 
+        except (CircuitOpenError, RetryableError):
+            return {
+                "success": False,
+                "retry_later": True,
+                "error": UNAVAILABLE_MESSAGE
+            }
         except Exception as e:
             return {
                 "success": False,
@@ -72,7 +155,10 @@ class PaymentManager:
     def verify_payment(self, payment_id: str) -> Dict[str, Any]:
         """Verifica o status de um pagamento no Mercado Pago"""
         try:
-            payment_response = self.mp.payment().get(payment_id)
+            payment_response = self._call_mp(
+                "payment_get",
+                lambda options: self.mp.payment().get(payment_id, options)
+            )
             
             if payment_response["status"] == 200:
                 payment_info = payment_response["response"]
@@ -90,6 +176,12 @@ class PaymentManager:
                     "error": "Erro ao verificar pagamento"
                 }
                 
+        except (CircuitOpenError, RetryableError):
+            return {
+                "success": False,
+                "retry_later": True,
+                "error": UNAVAILABLE_MESSAGE
+            }
         except Exception as e:
             return {
                 "success": False,
@@ -111,6 +203,9 @@ class PaymentManager:
                         "external_reference": payment_info["external_reference"],
                         "amount": payment_info["transaction_amount"]
                     }
+                
+                if payment_info.get("retry_later"):
+                    return payment_info
             
             return {
                 "success": False,
@@ -129,4 +224,9 @@ class PaymentManager:
     
     def get_all_plans(self) -> Dict[str, Any]:
         """Obtém todos os planos disponíveis"""
-        return PLANS 
\ No newline at end of file
+        return PLANS
+
+@lru_cache(maxsize=None)
+def get_payment_manager() -> PaymentManager:
+    """PaymentManager compartilhado (breakers e orçamento valem para o processo todo)"""
+    return PaymentManager()
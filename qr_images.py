@@ -0,0 +1,117 @@
+import asyncio
+import base64
+import io
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message
+
+from metrics import metrics
+
+try:
+    import qrcode
+except ImportError:  # Está no requirements.txt; sem ele só falta o QR sem qr_code_base64
+    qrcode = None
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("qr_photos_total", "Envios de QR Code, por origem (cache de file_id ou upload)")
+
+# Decodificação/renderização de imagens fora do event loop
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="qr")
+
+
+def _build_png(qr_code_base64: Optional[str], pix_code: Optional[str]) -> Optional[bytes]:
+    if qr_code_base64:
+        return base64.b64decode(qr_code_base64)
+    if pix_code and qrcode is not None:
+        buffer = io.BytesIO()
+        qrcode.make(pix_code).save(buffer, format="PNG")
+        return buffer.getvalue()
+    return None
+
+
+class QrPhotoCache:
+    """Cache LRU de ``file_id`` do Telegram por pagamento
+
+    O primeiro envio do QR de um pagamento faz o upload da imagem; os
+    seguintes reutilizam o ``file_id`` devolvido, sem upload e sem CPU.
+    Quem chama pode passar o ``file_id`` gravado no banco, que sobrevive
+    a reinícios; se o Telegram recusá-lo, a imagem é enviada de novo.
+    """
+
+    def __init__(self, max_size: int = 2000):
+        self.max_size = max_size
+        self._file_ids: "OrderedDict[str, str]" = OrderedDict()
+
+    def get(self, payment_id: str) -> Optional[str]:
+        file_id = self._file_ids.get(payment_id)
+        if file_id is not None:
+            self._file_ids.move_to_end(payment_id)
+        return file_id
+
+    def put(self, payment_id: str, file_id: str):
+        self._file_ids[payment_id] = file_id
+        self._file_ids.move_to_end(payment_id)
+        while len(self._file_ids) > self.max_size:
+            self._file_ids.popitem(last=False)
+
+    async def send(self, bot, chat_id: int, payment_id: str, caption: str,
+                   qr_code_base64: Optional[str] = None, pix_code: Optional[str] = None,
+                   file_id: Optional[str] = None, **kwargs) -> Optional[Message]:
+        """Envia o QR do pagamento como foto; retorna None se não houver imagem"""
+        file_id = self.get(payment_id) or file_id
+        if file_id is not None:
+            try:
+                message = await bot.send_photo(chat_id, file_id, caption=caption, **kwargs)
+                metrics.inc("qr_photos_total", source="cache")
+                return message
+            except TelegramBadRequest as e:
+                # file_id inválido (outro bot ou expirado): refaz o upload
+                logger.warning(f"file_id do QR do pagamento {payment_id} recusado: {e}")
+                self._file_ids.pop(payment_id, None)
+
+        loop = asyncio.get_running_loop()
+        png = await loop.run_in_executor(_executor, _build_png, qr_code_base64, pix_code)
+        if png is None:
+            return None
+
+        message = await bot.send_photo(
+            chat_id, BufferedInputFile(png, filename=f"pix_{payment_id}.png"),
+            caption=caption, **kwargs
+        )
+        metrics.inc("qr_photos_total", source="upload")
+        if message.photo:
+            self.put(payment_id, message.photo[-1].file_id)
+        return message
+
+
+async def edit_text_or_caption(message: Message, text: str, **kwargs):
+    """Edita o texto de uma mensagem ou, se ela for uma foto, a legenda"""
+    if message.photo:
+        return await message.edit_caption(caption=text, **kwargs)
+    return await message.edit_text(text, **kwargs)
+
+
+async def edit_message_by_id(bot, chat_id: int, message_id: int, text: str, **kwargs) -> bool:
+    """Edita texto ou legenda de uma mensagem conhecida só pelos IDs
+
+    Retorna False se ela não puder mais ser editada (apagada ou antiga demais).
+    """
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs)
+        return True
+    except TelegramBadRequest as e:
+        error = str(e).lower()
+        if "not modified" in error:
+            return True
+        if "no text" not in error:
+            return False
+    try:
+        await bot.edit_message_caption(chat_id=chat_id, message_id=message_id, caption=text, **kwargs)
+        return True
+    except TelegramBadRequest as e:
+        return "not modified" in str(e).lower()
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class TokenBucket:
+    """Token bucket: ``rate`` fichas por segundo, até ``capacity`` acumuladas"""
+
+    __slots__ = ("rate", "capacity", "tokens", "last")
+
+    def __init__(self, rate: float, capacity: float, now: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic() if now is None else now
+
+    def consume(self, amount: float = 1.0, now: Optional[float] = None) -> bool:
+        """Consome fichas se houver saldo suficiente"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        """Segundos até haver ``amount`` fichas disponíveis"""
+        missing = amount - self.tokens
+        return 0.0 if missing <= 0 else missing / self.rate
+
+
+class KeyedRateLimiter:
+    """Um token bucket por chave, com tamanho limitado e despejo por inatividade
+
+    As chaves ficam em ordem de último acesso (LRU): as mais antigas são
+    descartadas quando passam de ``max_keys`` ou ficam ociosas por mais de
+    ``idle_ttl`` segundos. Um bucket despejado volta cheio, o que é seguro.
+    """
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000,
+                 idle_ttl: float = 600.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if len(buckets) > self.max_keys or now - bucket.last > self.idle_ttl:
+                buckets.popitem(last=False)
+            else:
+                break
+
+    def allow(self, key: Hashable, amount: float = 1.0) -> bool:
+        """Verifica (e consome) o limite da chave"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.capacity, now)
+                self._buckets[key] = bucket
+            else:
+                self._buckets.move_to_end(key)
+            allowed = bucket.consume(amount, now)
+            self._evict(now)
+            return allowed
@@ -0,0 +1,296 @@
+import string
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import DEFAULT_LOCALE
+
+PlansKey = Tuple[Tuple[str, str, float, int], ...]
+
+
+class Template:
+    """Template de mensagem validado uma única vez
+
+    O texto usa a sintaxe de ``str.format`` com campos simples
+    (``{amount:.2f}``, ``{expiration:%d/%m/%Y}``). Os campos são lidos
+    uma vez na criação (só nomes simples: nada de ``{x.attr}`` ou
+    ``{x[0]}``) e a renderização é um ``str.format_map``; o template é
+    sempre dado, nunca código executável.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.fields = []
+        for _, field, _, _ in string.Formatter().parse(text):
+            if field is None:
+                continue
+            if not field.isidentifier():
+                raise ValueError(f"Campo inválido no template: {field!r}")
+            if field not in self.fields:
+                self.fields.append(field)
+
+    def render(self, **values: Any) -> str:
+        return self.text.format_map(values)
+
+
+# Textos por idioma; chaves ausentes num idioma caem no DEFAULT_LOCALE
+MESSAGES: Dict[str, Dict[str, str]] = {
+    "pt": {
+        "welcome": (
+            "🚀 Bem-vindo ao Grupo Privado!\n\n"
+            "Para acessar nosso conteúdo exclusivo, escolha um dos planos abaixo:\n\n"
+            "💎 Acesso a conteúdo premium\n"
+            "📱 Suporte exclusivo\n"
+            "🎯 Estratégias avançadas\n"
+            "📊 Análises detalhadas\n\n"
+            "Escolha seu plano:"
+        ),
+        "choose_plan": (
+            "🚀 Escolha seu plano:\n\n"
+            "💎 Acesso a conteúdo premium\n"
+            "📱 Suporte exclusivo\n"
+            "🎯 Estratégias avançadas\n"
+            "📊 Análises detalhadas\n\n"
+            "Escolha seu plano:"
+        ),
+        "already_active": (
+            "🎉 Olá! Você já possui uma assinatura ativa!\n\n"
+            "📅 Plano: {plan}\n"
+            "⏰ Dias restantes: {days_left}\n"
+            "📅 Expira em: {expiration:%d/%m/%Y}\n\n"
+            "🔗 Link do grupo: {link}\n\n"
+            "Use /status para ver mais detalhes da sua assinatura."
+        ),
+        "plan_button": "{name} - R$ {price:.2f}",
+        "plan_summary": (
+            "📋 Resumo do Plano Selecionado:\n\n"
+            "📦 Plano: {name}\n"
+            "💰 Valor: R$ {price:.2f}\n"
+            "⏰ Duração: {days} dias\n\n"
+            "Para continuar, clique em 'Gerar PIX' para receber o código de pagamento."
+        ),
+        "button_generate_pix": "💳 Gerar PIX",
+        "button_back": "🔙 Voltar",
+        "button_confirm_payment": "✅ Pagamento Confirmado",
+        "button_cancel": "❌ Cancelar",
+        "button_check_again": "🔄 Verificar novamente",
+        "button_show_qr": "📷 Ver QR Code",
+        "pix_error": (
+            "❌ Erro ao gerar pagamento: {error}\n\n"
+            "Tente novamente ou entre em contato com o suporte."
+        ),
+        "pix_generated": (
+            "💳 Pagamento PIX Gerado!\n\n"
+            "📦 Plano: {plan_name}\n"
+            "💰 Valor: R$ {amount:.2f}\n"
+            "🆔 ID do Pagamento: {payment_id}\n\n"
+            "📋 Código PIX (Copie e Cole):\n"
+            "`{pix_code}`\n\n"
+            "⚠️ IMPORTANTE:\n"
+            "• Copie o código acima\n"
+            "• Abra seu app bancário\n"
+            "• Cole o código no PIX\n"
+            "• Confirme o pagamento\n\n"
+            "Após o pagamento, clique em 'Confirmar Pagamento' abaixo."
+        ),
+        "pix_code": "📋 Código PIX (Copie e Cole):\n`{pix_code}`",
+        "payment_confirmed": (
+            "🎉 Pagamento Confirmado!\n\n"
+            "✅ Sua assinatura foi ativada com sucesso!\n"
+            "📅 Expira em: {expiration:%d/%m/%Y}\n\n"
+            "🔗 Link do Grupo Privado:\n{link}\n\n"
+            "Bem-vindo ao grupo! Use /status para ver detalhes da sua assinatura."
+        ),
+        "activation_error": "❌ Erro ao ativar assinatura. Entre em contato com o suporte.",
+        "payment_not_confirmed": (
+            "❌ Pagamento não confirmado!\n\n"
+            "O pagamento ainda não foi processado. Aguarde alguns minutos e tente novamente, "
+            "ou entre em contato com o suporte se já realizou o pagamento."
+        ),
+        "payment_cancelled": (
+            "❌ Pagamento cancelado!\n\n"
+            "Use /start para escolher um plano novamente."
+        ),
+        "no_subscription": (
+            "❌ Você não possui uma assinatura ativa.\n\n"
+            "Use /start para escolher um plano."
+        ),
+        "subscription_expired": (
+            "⚠️ Sua assinatura expirou!\n\n"
+            "Use /start para renovar sua assinatura."
+        ),
+        "status": (
+            "📊 Status da Sua Assinatura:\n\n"
+            "✅ Status: Ativa\n"
+            "📦 Plano: {plan}\n"
+            "📅 Data de início: {start:%d/%m/%Y}\n"
+            "📅 Data de expiração: {expiration:%d/%m/%Y}\n"
+            "⏰ Dias restantes: {days_left}\n\n"
+            "🔗 Link do grupo: {link}"
+        )
+    },
+    "en": {
+        "welcome": (
+            "🚀 Welcome to the Private Group!\n\n"
+            "To access our exclusive content, choose one of the plans below:\n\n"
+            "💎 Premium content\n"
+            "📱 Exclusive support\n"
+            "🎯 Advanced strategies\n"
+            "📊 Detailed analyses\n\n"
+            "Choose your plan:"
+        ),
+        "choose_plan": (
+            "🚀 Choose your plan:\n\n"
+            "💎 Premium content\n"
+            "📱 Exclusive support\n"
+            "🎯 Advanced strategies\n"
+            "📊 Detailed analyses\n\n"
+            "Choose your plan:"
+        ),
+        "already_active": (
+            "🎉 Hi! You already have an active subscription!\n\n"
+            "📅 Plan: {plan}\n"
+            "⏰ Days left: {days_left}\n"
+            "📅 Expires on: {expiration:%Y-%m-%d}\n\n"
+            "🔗 Group link: {link}\n\n"
+            "Use /status to see your subscription details."
+        ),
+        "plan_button": "{name} - R$ {price:.2f}",
+        "plan_summary": (
+            "📋 Selected Plan:\n\n"
+            "📦 Plan: {name}\n"
+            "💰 Price: R$ {price:.2f}\n"
+            "⏰ Duration: {days} days\n\n"
+            "To continue, tap 'Generate PIX' to receive the payment code."
+        ),
+        "button_generate_pix": "💳 Generate PIX",
+        "button_back": "🔙 Back",
+        "button_confirm_payment": "✅ I have paid",
+        "button_cancel": "❌ Cancel",
+        "button_check_again": "🔄 Check again",
+        "button_show_qr": "📷 Show QR Code",
+        "pix_error": (
+            "❌ Could not create the payment: {error}\n\n"
+            "Please try again or contact support."
+        ),
+        "pix_generated": (
+            "💳 PIX Payment Created!\n\n"
+            "📦 Plan: {plan_name}\n"
+            "💰 Amount: R$ {amount:.2f}\n"
+            "🆔 Payment ID: {payment_id}\n\n"
+            "📋 PIX code (copy and paste):\n"
+            "`{pix_code}`\n\n"
+            "⚠️ IMPORTANT:\n"
+            "• Copy the code above\n"
+            "• Open your banking app\n"
+            "• Paste the code in PIX\n"
+            "• Confirm the payment\n\n"
+            "After paying, tap 'I have paid' below."
+        ),
+        "pix_code": "📋 PIX code (copy and paste):\n`{pix_code}`",
+        "payment_confirmed": (
+            "🎉 Payment Confirmed!\n\n"
+            "✅ Your subscription is active!\n"
+            "📅 Expires on: {expiration:%Y-%m-%d}\n\n"
+            "🔗 Private Group link:\n{link}\n\n"
+            "Welcome! Use /status to see your subscription details."
+        ),
+        "activation_error": "❌ Could not activate your subscription. Please contact support.",
+        "payment_not_confirmed": (
+            "❌ Payment not confirmed!\n\n"
+            "The payment has not been processed yet. Wait a few minutes and try again, "
+            "or contact support if you have already paid."
+        ),
+        "payment_cancelled": (
+            "❌ Payment cancelled!\n\n"
+            "Use /start to choose a plan again."
+        ),
+        "no_subscription": (
+            "❌ You don't have an active subscription.\n\n"
+            "Use /start to choose a plan."
+        ),
+        "subscription_expired": (
+            "⚠️ Your subscription has expired!\n\n"
+            "Use /start to renew it."
+        ),
+        "status": (
+            "📊 Your Subscription:\n\n"
+            "✅ Status: Active\n"
+            "📦 Plan: {plan}\n"
+            "📅 Started on: {start:%Y-%m-%d}\n"
+            "📅 Expires on: {expiration:%Y-%m-%d}\n"
+            "⏰ Days left: {days_left}\n\n"
+            "🔗 Group link: {link}"
+        )
+    }
+}
+
+# Compilados na importação: erros de template aparecem na inicialização
+TEMPLATES: Dict[str, Dict[str, Template]] = {
+    locale: {key: Template(text) for key, text in messages.items()}
+    for locale, messages in MESSAGES.items()
+}
+
+
+def get_locale(language_code: Optional[str]) -> str:
+    """Idioma suportado mais próximo de ``language_code`` do Telegram ("pt-br" -> "pt")"""
+    if language_code:
+        base = language_code.split("-")[0].lower()
+        if base in TEMPLATES:
+            return base
+    return DEFAULT_LOCALE
+
+
+def render(key: str, locale: str = DEFAULT_LOCALE, **values: Any) -> str:
+    """Renderiza a mensagem ``key`` no idioma pedido"""
+    template = TEMPLATES.get(locale, {}).get(key) or TEMPLATES[DEFAULT_LOCALE][key]
+    return template.render(**values)
+
+
+def _plans_key(plans: Dict[str, Dict[str, Any]]) -> PlansKey:
+    return tuple((plan_id, info["name"], info["price"], info["days"])
+                 for plan_id, info in plans.items())
+
+
+@lru_cache(maxsize=32)
+def _build_plans_keyboard(locale: str, plans: PlansKey) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=render("plan_button", locale, name=name, price=price),
+                              callback_data=f"plan_{plan_id}")]
+        for plan_id, name, price, _ in plans
+    ])
+
+
+def plans_keyboard(plans: Dict[str, Dict[str, Any]],
+                   locale: str = DEFAULT_LOCALE) -> InlineKeyboardMarkup:
+    """Teclado de planos, montado uma vez por idioma e configuração de planos"""
+    return _build_plans_keyboard(locale, _plans_key(plans))
+
+
+@lru_cache(maxsize=None)
+def plan_summary_keyboard(locale: str = DEFAULT_LOCALE) -> InlineKeyboardMarkup:
+    """Teclado fixo do resumo do plano (Gerar PIX / Voltar)"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=render("button_generate_pix", locale), callback_data="generate_pix")],
+        [InlineKeyboardButton(text=render("button_back", locale), callback_data="back_to_plans")]
+    ])
+
+
+def payment_keyboard(payment_id: str, locale: str = DEFAULT_LOCALE) -> InlineKeyboardMarkup:
+    """Teclado de um pagamento (o callback depende do pagamento; não é cacheado)"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=render("button_confirm_payment", locale),
+                              callback_data=f"confirm_payment_{payment_id}")],
+        [InlineKeyboardButton(text=render("button_cancel", locale), callback_data="cancel_payment")]
+    ])
+
+
+def payment_retry_keyboard(payment_id: str, locale: str = DEFAULT_LOCALE) -> InlineKeyboardMarkup:
+    """Teclado do pagamento ainda não confirmado"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=render("button_check_again", locale),
+                              callback_data=f"confirm_payment_{payment_id}")],
+        [InlineKeyboardButton(text=render("button_show_qr", locale),
+                              callback_data=f"show_qr_{payment_id}")]
+    ])
@@ -0,0 +1,167 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Deque, Dict, List, Set, Tuple
+
+from config import (
+    RENEWAL_WARNING_DAYS, RENEWAL_MAX_PER_MINUTE, RENEWAL_JITTER_SECONDS,
+    RENEWAL_REFRESH_SECONDS
+)
+from metrics import metrics
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("renewal_queue_size", "Avisos de renovação agendados e ainda não enviados")
+metrics.describe("renewal_warnings_sent_total", "Avisos de renovação enviados, por antecedência")
+
+# (horário previsto, user_id, dias de antecedência, expiração)
+Warning = Tuple[float, int, int, str]
+
+
+def _to_datetime(value) -> datetime:
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+class RenewalScheduler:
+    """Agenda cada aviso de renovação para o seu próprio horário
+
+    O horário de cada aviso é ``expiration_date - dias`` mais um jitter.
+    Os avisos ficam numa fila dividida em baldes de ``bucket_seconds``; o
+    despacho respeita um teto de envios por minuto, então rajadas viram um
+    fluxo constante. O banco é lido uma vez a cada ``RENEWAL_REFRESH_SECONDS``
+    com uma única consulta, independente da quantidade de faixas de aviso.
+    """
+
+    def __init__(self, db, send: Callable[[int, int], Awaitable[bool]],
+                 bucket_seconds: int = 60):
+        self.db = db
+        self.send = send
+        self.bucket_seconds = bucket_seconds
+        self.buckets: Dict[int, Deque[Warning]] = {}
+        self.bucket_heap: List[int] = []
+        self.scheduled: Set[Tuple[int, int, str]] = set()
+        self.limiter = TokenBucket(RENEWAL_MAX_PER_MINUTE / 60.0, RENEWAL_MAX_PER_MINUTE / 6.0)
+        self.tiers = sorted(RENEWAL_WARNING_DAYS)
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def _push(self, warning: Warning):
+        index = int(warning[0] // self.bucket_seconds)
+        bucket = self.buckets.get(index)
+        if bucket is None:
+            bucket = self.buckets[index] = deque()
+            heapq.heappush(self.bucket_heap, index)
+        bucket.append(warning)
+
+    def schedule(self, user_id: int, expiration_date) -> int:
+        """Agenda os avisos pendentes de uma assinatura; retorna quantos"""
+        expiration = _to_datetime(expiration_date)
+        now = datetime.now()
+        remaining = expiration - now
+        added = 0
+
+        for position, days in enumerate(self.tiers):
+            # Pula faixas já superadas por uma faixa menor (ex.: 7d com 2d restantes)
+            smaller = self.tiers[position - 1] if position else 0
+            if remaining <= timedelta(days=smaller):
+                continue
+            if remaining > timedelta(days=days) + timedelta(seconds=RENEWAL_REFRESH_SECONDS * 2):
+                continue
+
+            key = (user_id, days, expiration.isoformat())
+            if key in self.scheduled:
+                continue
+
+            due = max(expiration - timedelta(days=days), now).timestamp()
+            due += random.uniform(0, RENEWAL_JITTER_SECONDS)
+            self._push((due, user_id, days, key[2]))
+            self.scheduled.add(key)
+            added += 1
+
+        return added
+
+    async def refresh(self):
+        """Lê do banco as assinaturas que terão aviso em breve"""
+        horizon_days = max(self.tiers) + 1
+
+        # Esquece chaves de assinaturas já vencidas
+        now_iso = datetime.now().isoformat()
+        self.scheduled = {key for key in self.scheduled if key[2] > now_iso}
+
+        # Lidas em páginas: só a página atual fica em memória
+        added = 0
+        async for subscription in self.db.iter_subscriptions_expiring_soon(horizon_days):
+            added += self.schedule(subscription["user_id"], subscription["expiration_date"])
+        metrics.set_gauge("renewal_queue_size", len(self))
+        logger.info(f"{added} avisos de renovação agendados")
+
+    def pop_due(self, now: float) -> List[Warning]:
+        """Retira os avisos vencidos, limitado pelo teto de envios"""
+        due = []
+        while self.bucket_heap and self.bucket_heap[0] * self.bucket_seconds <= now:
+            index = self.bucket_heap[0]
+            bucket = self.buckets[index]
+
+            # Dentro do balde os avisos não estão ordenados; os futuros voltam
+            postponed = deque()
+            while bucket:
+                warning = bucket.popleft()
+                if warning[0] > now:
+                    postponed.append(warning)
+                elif self.limiter.consume():
+                    due.append(warning)
+                else:
+                    postponed.append(warning)
+                    postponed.extend(bucket)
+                    bucket.clear()
+                    self.buckets[index] = postponed
+                    return due
+
+            if postponed:
+                self.buckets[index] = postponed
+                break
+            heapq.heappop(self.bucket_heap)
+            del self.buckets[index]
+        return due
+
+    async def dispatch(self, warning: Warning):
+        """Envia um aviso, se ainda não foi enviado"""
+        _, user_id, days, expiration = warning
+        notification_type = f"renewal_warning_{days}d"
+
+        # Assinatura renovada ou encerrada depois do agendamento: aviso obsoleto
+        subscription = await self.db.get_subscription(user_id)
+        if (not subscription
+                or _to_datetime(subscription["expiration_date"]).isoformat() != expiration):
+            return
+
+        if await self.db.has_recent_notification(user_id, notification_type, hours=days * 24 + 24):
+            return
+
+        if await self.send(user_id, days):
+            await self.db.add_notification(user_id, notification_type)
+            metrics.inc("renewal_warnings_sent_total", days=days)
+
+    async def run(self):
+        """Laço principal: atualiza a fila periodicamente e despacha os avisos"""
+        next_refresh = 0.0
+        while True:
+            try:
+                now = time.time()
+                if now >= next_refresh:
+                    await self.refresh()
+                    next_refresh = now + RENEWAL_REFRESH_SECONDS
+
+                for warning in self.pop_due(now):
+                    await self.dispatch(warning)
+                metrics.set_gauge("renewal_queue_size", len(self))
+            except Exception as e:
+                logger.error(f"Erro no envio de avisos de renovação: {e}")
+
+            await asyncio.sleep(1)
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Reproduz webhooks capturados (WEBHOOK_RECORD_FILE) contra o app FastAPI,
+com o Mercado Pago substituído por um stub, e verifica o estado final.
+
+Uso:
+  python replay_webhooks.py captura.jsonl [--speed 10] [--mp-latency-ms 150]
+  python replay_webhooks.py --synthetic 5000 --payments 500 --speed 1
+
+O banco usado é um SQLite temporário; o banco de produção não é tocado.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import secrets
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+
+class StubPaymentApi:
+    def __init__(self, stub: "StubMercadoPago"):
+        self.stub = stub
+
+    def get(self, payment_id, request_options=None) -> Dict[str, Any]:
+        return self.stub.get_payment(str(payment_id))
+
+
+class StubMercadoPago:
+    """Imita ``mercadopago.SDK`` para ``payment().get`` (com latência e erros)"""
+
+    def __init__(self, payments: Dict[str, Dict[str, Any]], latency: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.payments = payments
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def payment(self) -> StubPaymentApi:
+        return StubPaymentApi(self)
+
+    def get_payment(self, payment_id: str) -> Dict[str, Any]:
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            return {"status": 500, "response": {"message": "stub error"}}
+        payment = self.payments.get(payment_id)
+        if payment is None:
+            return {"status": 404, "response": {"message": "not_found"}}
+        return {"status": 200, "response": payment}
+
+
+def load_capture(path: str) -> List[Dict[str, Any]]:
+    """Lê uma captura JSONL, ordenada pelo instante de chegada"""
+    with open(path, encoding="utf-8") as capture:
+        events = [json.loads(line) for line in capture if line.strip()]
+    return sorted(events, key=lambda event: event["t"])
+
+
+def synthetic_capture(count: int, payments: int, duration: float, sources: int,
+                      seed: int) -> List[Dict[str, Any]]:
+    """Gera uma tempestade: notificações repetidas para poucos pagamentos"""
+    rng = random.Random(seed)
+    events = []
+    for _ in range(count):
+        data_id = str(rng.randrange(payments) + 1)
+        events.append({
+            "t": rng.uniform(0, duration),
+            "source": f"src-{rng.randrange(sources)}",
+            "query": {"data.id": data_id, "type": "payment"},
+            "headers": {"content-type": "application/json"},
+            "body": {"type": "payment", "action": "payment.updated", "data": {"id": data_id}}
+        })
+    return sorted(events, key=lambda event: event["t"])
+
+
+def event_data_id(event: Dict[str, Any]) -> Optional[str]:
+    data_id = event.get("query", {}).get("data.id")
+    if data_id is None and isinstance(event.get("body"), dict):
+        data_id = (event["body"].get("data") or {}).get("id")
+    return str(data_id) if data_id is not None else None
+
+
+def sign(secret: bytes, data_id: Optional[str], request_id: str) -> str:
+    """Gera um x-signature válido (mesmo manifesto de webhook_security)"""
+    ts = str(int(time.time() * 1000))
+    manifest = ""
+    if data_id:
+        manifest += f"id:{data_id.lower()};"
+    manifest += f"request-id:{request_id};ts:{ts};"
+    return f"ts={ts},v1={hmac.new(secret, manifest.encode(), hashlib.sha256).hexdigest()}"
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+
+async def seed_payments(db, data_ids: List[str], approved_ratio: float,
+                        seed: int) -> Dict[str, Dict[str, Any]]:
+    """Cria os pagamentos locais e a visão do stub para cada data.id"""
+    rng = random.Random(seed)
+    mp_payments = {}
+    for index, data_id in enumerate(sorted(data_ids)):
+        external_reference = f"replay-{data_id}"
+        status = "approved" if rng.random() < approved_ratio else "pending"
+        await db.add_payment(1_000_000 + index, external_reference, "monthly", 29.90, "pix")
+        mp_payments[data_id] = {
+            "id": data_id,
+            "status": status,
+            "status_detail": "accredited" if status == "approved" else "pending_waiting_transfer",
+            "external_reference": external_reference,
+            "transaction_amount": 29.90
+        }
+    return mp_payments
+
+
+async def replay(events: List[Dict[str, Any]], app, secret: bytes, speed: float,
+                 concurrency: int) -> Dict[str, Any]:
+    """Dispara os eventos respeitando os intervalos originais divididos por ``speed``"""
+    import httpx
+
+    clients: Dict[str, httpx.AsyncClient] = {}
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    delivered = set()
+    limit = asyncio.Semaphore(concurrency)
+
+    def client_for(source: str) -> httpx.AsyncClient:
+        # Um transport por origem: o limite por IP do webhook vê a mesma distribuição
+        if source not in clients:
+            transport = httpx.ASGITransport(app=app, client=(source, 0))
+            clients[source] = httpx.AsyncClient(transport=transport, base_url="http://replay")
+        return clients[source]
+
+    async def fire(event: Dict[str, Any]):
+        data_id = event_data_id(event)
+        request_id = event.get("headers", {}).get("x-request-id") or uuid.uuid4().hex
+        headers = {
+            "content-type": "application/json",
+            "x-request-id": request_id,
+            "x-signature": sign(secret, data_id, request_id)
+        }
+        body = json.dumps(event.get("body") or {}).encode()
+        async with limit:
+            started = time.perf_counter()
+            try:
+                response = await client_for(event.get("source", "replay")).post(
+                    "/webhook", params=event.get("query", {}), content=body, headers=headers
+                )
+                statuses[response.status_code] += 1
+                if response.status_code == 200 and data_id:
+                    delivered.add(data_id)
+            except Exception:
+                statuses["exception"] += 1
+            latencies.append(time.perf_counter() - started)
+
+    t0 = events[0]["t"] if events else 0.0
+    started = time.monotonic()
+    tasks = []
+    for event in events:
+        delay = (event["t"] - t0) / speed - (time.monotonic() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(fire(event)))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+
+    for client in clients.values():
+        await client.aclose()
+
+    return {"latencies": latencies, "statuses": statuses, "delivered": delivered,
+            "elapsed": elapsed}
+
+
+def check_consistency(db_path: str, mp_payments: Dict[str, Dict[str, Any]],
+                      delivered: set) -> Dict[str, List[str]]:
+    """Compara ``payments``/``subscription_ledger`` com o que o stub informou
+
+    ``subscriptions`` tem uma linha por usuário (o ``payment_id`` é o da
+    última renovação); o histórico tem uma linha por pagamento aplicado.
+    """
+    conn = sqlite3.connect(db_path)
+    payment_status = dict(conn.execute("SELECT payment_id, status FROM payments"))
+    subscriptions = Counter(dict(conn.execute(
+        "SELECT payment_id, COUNT(*) FROM subscription_ledger GROUP BY payment_id"
+    )))
+    conn.close()
+
+    problems: Dict[str, List[str]] = {
+        "wrong_payment_status": [],
+        "missing_subscription": [],
+        "duplicate_subscription": [],
+        "unexpected_subscription": [],
+        "never_delivered": []
+    }
+    for data_id, mp_payment in mp_payments.items():
+        reference = mp_payment["external_reference"]
+        if data_id not in delivered:
+            problems["never_delivered"].append(reference)
+            continue
+        if payment_status.get(reference) != mp_payment["status"]:
+            problems["wrong_payment_status"].append(reference)
+        count = subscriptions.get(reference, 0)
+        if mp_payment["status"] == "approved":
+            if count == 0:
+                problems["missing_subscription"].append(reference)
+            elif count > 1:
+                problems["duplicate_subscription"].append(reference)
+        elif count:
+            problems["unexpected_subscription"].append(reference)
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", nargs="?", help="Arquivo JSONL gravado com WEBHOOK_RECORD_FILE")
+    parser.add_argument("--speed", type=float, default=10.0, help="Aceleração em relação ao tempo real")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--mp-latency-ms", type=float, default=100.0)
+    parser.add_argument("--mp-error-rate", type=float, default=0.0)
+    parser.add_argument("--approved-ratio", type=float, default=0.8)
+    parser.add_argument("--synthetic", type=int, default=0, help="Gera N webhooks em vez de ler captura")
+    parser.add_argument("--payments", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=60.0, help="Duração da captura sintética (s)")
+    parser.add_argument("--sources", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep-db", action="store_true", help="Mantém o banco temporário")
+    args = parser.parse_args()
+
+    if not args.capture and not args.synthetic:
+        parser.error("informe uma captura ou --synthetic N")
+
+    workdir = tempfile.mkdtemp(prefix="replay_")
+    db_path = os.path.join(workdir, "replay.db")
+    secret = secrets.token_hex(16)
+
+    # Configuração isolada, definida antes de importar o app
+    os.environ.update({
+        "DATABASE_BACKEND": "sqlite",
+        "DATABASE_PATH": db_path,
+        "MP_WEBHOOK_SECRET": secret,
+        "WEBHOOK_RECORD_FILE": "",
+        "LOG_FILE": ""
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    from payments import get_payment_manager
+    from webhook import app, get_db
+
+    if args.synthetic:
+        events = synthetic_capture(args.synthetic, args.payments, args.duration,
+                                   args.sources, args.seed)
+    else:
+        events = load_capture(args.capture)
+    if not events:
+        print("Captura vazia")
+        return 1
+
+    async def run() -> int:
+        db = get_db()
+        data_ids = {data_id for data_id in map(event_data_id, events) if data_id}
+        mp_payments = await seed_payments(db, list(data_ids), args.approved_ratio, args.seed)
+
+        stub = StubMercadoPago(mp_payments, latency=args.mp_latency_ms / 1000,
+                               error_rate=args.mp_error_rate, seed=args.seed)
+        get_payment_manager().mp = stub
+
+        result = await replay(events, app, secret.encode(), args.speed, args.concurrency)
+        await db.close()
+
+        latencies = sorted(result["latencies"])
+        statuses = result["statuses"]
+        total = sum(statuses.values())
+        errors = sum(count for status, count in statuses.items()
+                     if status == "exception" or status >= 500)
+
+        print(f"Eventos: {total} em {result['elapsed']:.2f}s "
+              f"({total / max(result['elapsed'], 1e-6):.0f} req/s, {args.speed:g}x)")
+        print(f"Chamadas ao stub do MP: {stub.calls}")
+        print("Latência (ms): " + "  ".join(
+            f"p{q}={percentile(latencies, q) * 1000:.1f}" for q in (50, 90, 99)
+        ) + f"  max={latencies[-1] * 1000:.1f}")
+        print("Status: " + ", ".join(f"{status}={count}"
+                                      for status, count in sorted(statuses.items(), key=str)))
+        print(f"Taxa de erro (5xx/exceções): {errors / total:.2%}")
+
+        # Pagamentos sem nenhuma resposta 200 seriam reenviados pelo MP; não contam como erro
+        problems = check_consistency(db_path, mp_payments, result["delivered"])
+        consistent = not any(refs for key, refs in problems.items() if key != "never_delivered")
+        print("Consistência: " + ("OK" if consistent else "FALHOU"))
+        for key, refs in problems.items():
+            if refs:
+                print(f"  {key}: {len(refs)} (ex.: {', '.join(refs[:3])})")
+
+        if args.keep_db:
+            print(f"Banco mantido em {db_path}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return 0 if consistent else 1
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
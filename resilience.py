@@ -0,0 +1,176 @@
+import random
+import threading
+import time
+from typing import Callable, Any, Optional
+
+from metrics import metrics
+
+metrics.describe("mp_circuit_state", "Estado do circuit breaker (0=fechado, 1=meio-aberto, 2=aberto)")
+metrics.describe("mp_calls_total", "Chamadas ao Mercado Pago por endpoint e resultado")
+metrics.describe("mp_retries_total", "Retentativas feitas ao Mercado Pago")
+metrics.describe("mp_retry_budget_exhausted_total", "Retentativas negadas pelo orçamento")
+
+
+class CircuitOpenError(Exception):
+    """Levantada quando o circuit breaker está aberto e a chamada é recusada"""
+
+
+class RetryableError(Exception):
+    """Falha transitória (timeout, 5xx, 429) que pode ser retentada"""
+
+
+class CircuitBreaker:
+    """Circuit breaker clássico: fechado -> aberto -> meio-aberto -> fechado"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._export()
+
+    def _export(self):
+        metrics.set_gauge("mp_circuit_state", self._STATE_VALUES[self._state],
+                          endpoint=self.name)
+
+    def _set_state(self, state: str):
+        self._state = state
+        self._export()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if (self._state == self.OPEN
+                and time.monotonic() - self._opened_at >= self.reset_timeout):
+            self._set_state(self.HALF_OPEN)
+            self._half_open_calls = 0
+
+    def allow_request(self) -> bool:
+        """Verifica se uma chamada pode seguir"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return True
+            return False
+
+    def record_success(self):
+        """Registra uma chamada bem-sucedida"""
+        with self._lock:
+            self._failures = 0
+            if self._state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        """Registra uma falha transitória"""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._set_state(self.OPEN)
+                self._opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """Limita as retentativas a uma fração das requisições
+
+    Cada requisição deposita ``ratio`` fichas e cada retentativa consome uma.
+    Um piso de ``min_per_second`` garante algumas retentativas com pouco tráfego.
+    Evita que retentativas multipliquem a carga quando o serviço está fora.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 0.5,
+                 max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens,
+                           self._tokens + (now - self._last) * self.min_per_second)
+        self._last = now
+
+    def record_request(self):
+        """Registra uma requisição original"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Tenta consumir uma ficha para retentar"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Backoff exponencial com full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def call_with_resilience(func: Callable[[], Any], breaker: CircuitBreaker,
+                         budget: RetryBudget, max_attempts: int = 3,
+                         base_delay: float = 0.2, max_delay: float = 2.0,
+                         sleep: Optional[Callable[[float], None]] = None) -> Any:
+    """Executa ``func`` com circuit breaker, retentativas com jitter e orçamento
+
+    ``func`` deve levantar ``RetryableError`` para falhas transitórias;
+    qualquer outra exceção é propagada sem retentativa, mas também conta
+    como falha no breaker (senão uma chamada em meio-aberto ocuparia a
+    vaga de teste para sempre).
+    """
+    sleep = sleep or time.sleep
+    budget.record_request()
+    attempt = 0
+
+    while True:
+        if not breaker.allow_request():
+            metrics.inc("mp_calls_total", endpoint=breaker.name, result="circuit_open")
+            raise CircuitOpenError(f"Circuito aberto para {breaker.name}")
+
+        try:
+            result = func()
+        except RetryableError:
+            breaker.record_failure()
+            metrics.inc("mp_calls_total", endpoint=breaker.name, result="failure")
+            attempt += 1
+            if attempt >= max_attempts:
+                raise
+            if not budget.try_spend():
+                metrics.inc("mp_retry_budget_exhausted_total", endpoint=breaker.name)
+                raise
+            metrics.inc("mp_retries_total", endpoint=breaker.name)
+            sleep(backoff_delay(attempt, base_delay, max_delay))
+            continue
+        except Exception:
+            breaker.record_failure()
+            metrics.inc("mp_calls_total", endpoint=breaker.name, result="error")
+            raise
+
+        breaker.record_success()
+        metrics.inc("mp_calls_total", endpoint=breaker.name, result="success")
+        return result
@@ -7,32 +7,28 @@ import os
 import sys
 import asyncio
 import logging
+import importlib.util
 from pathlib import Path
 
-# Configuração de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from logging_setup import setup_logging
+
+# Configuração de logging (fila + thread de escrita, JSON com rotação em bot.log)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 def check_dependencies():
-    """Verifica se as dependências estão instaladas"""
-    try:
-        import aiogram
-        import fastapi
-        import mercadopago
-        import uvicorn
-        logger.info("Todas as dependências estão instaladas")
-        return True
-    except ImportError as e:
-        logger.error(f"Dependência não encontrada: {e}")
+    """Verifica se as dependências estão instaladas (sem importá-las)"""
+    missing = [
+        name for name in ("aiogram", "fastapi", "mercadopago", "uvicorn")
+        if importlib.util.find_spec(name) is None
+    ]
+    if missing:
+        logger.error(f"Dependência não encontrada: {', '.join(missing)}")
         logger.error("Execute: pip install -r requirements.txt")
         return False
+    
+    logger.info("Todas as dependências estão instaladas")
+    return True
 
 async def main():
     """Função principal"""
@@ -53,7 +49,7 @@ async def main():
         
         # Inicia o servidor webhook em uma thread separada
         def run_webhook():
-            uvicorn.run(webhook_app, host="0.0.0.0", port=8000, log_level="info")
+            uvicorn.run(webhook_app, host="0.0.0.0", port=8000, log_config=None)
         
         webhook_thread = threading.Thread(target=run_webhook, daemon=True)
         webhook_thread.start()
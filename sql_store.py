@@ -0,0 +1,241 @@
+import asyncio
+import queue
+import re
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from group_commit import GroupCommitWriter
+
+# Colunas DATETIME voltam como datetime (mesmo tipo dos outros backends)
+sqlite3.register_converter("DATETIME", lambda value: datetime.fromisoformat(value.decode()))
+
+
+class SqlStore(ABC):
+    """Acesso SQL às tabelas auxiliares, no mesmo banco do backend configurado
+
+    Usado pelo pool de convites, broadcasts, roster do grupo e outbox de
+    eventos. As consultas usam ``?`` como marcador (convertido para ``$n``
+    no PostgreSQL) e SQL comum aos dois bancos; o DDL usa ``{id}``,
+    ``{bigint}`` e ``{datetime}`` para os tipos que diferem. Linhas voltam
+    como dicionários, com datas em ``datetime``.
+    """
+
+    types: Dict[str, str] = {}
+
+    async def close(self):
+        """Libera recursos próprios do store (os do backend são fechados por ele)"""
+
+    @abstractmethod
+    async def create_tables(self, statements: List[str]):
+        """Executa o DDL (``CREATE ... IF NOT EXISTS``) com os tipos do banco"""
+
+    @abstractmethod
+    async def execute(self, query: str, *args) -> int:
+        """Executa um comando e retorna o número de linhas afetadas"""
+
+    @abstractmethod
+    async def insert(self, query: str, *args) -> int:
+        """Executa um INSERT e retorna o ``id`` da linha criada"""
+
+    @abstractmethod
+    async def fetch(self, query: str, *args) -> List[Dict[str, Any]]:
+        """Executa uma consulta e retorna todas as linhas"""
+
+    @abstractmethod
+    def transaction(self, lock: str) -> "AsyncIterator[SqlStore]":
+        """Transação de escrita, serializada com as outras do mesmo ``lock``
+
+        Uso: ``async with store.transaction("nome") as tx``; as consultas
+        feitas em ``tx`` são confirmadas juntas ao sair do bloco e desfeitas
+        se ele levantar exceção.
+        """
+
+    async def fetchrow(self, query: str, *args) -> Optional[Dict[str, Any]]:
+        """Primeira linha da consulta (ou None)"""
+        rows = await self.fetch(query, *args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, query: str, *args) -> Any:
+        """Primeira coluna da primeira linha (ou None)"""
+        row = await self.fetchrow(query, *args)
+        return next(iter(row.values())) if row else None
+
+
+class SqliteSqlStore(SqlStore):
+    """Tabelas auxiliares num arquivo SQLite
+
+    Leituras abrem uma conexão por operação; escritas e transações passam
+    pelo ``GroupCommitWriter`` do banco (o mesmo das assinaturas, quando
+    passado), então não disputam o lock de escrita do arquivo com ele.
+    """
+
+    types = {
+        "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+        "bigint": "INTEGER",
+        "datetime": "DATETIME"
+    }
+
+    def __init__(self, db_path: str, writer: Optional[GroupCommitWriter] = None):
+        self.db_path = db_path
+        self.owns_writer = writer is None
+        self.writer = writer or GroupCommitWriter(self._connect)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit: as transações de escrita são abertas pelo writer
+        conn = sqlite3.connect(self.db_path, detect_types=sqlite3.PARSE_DECLTYPES,
+                               isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _read(self, query: str, args: tuple) -> List[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            return _fetch(query, args)(conn)
+        finally:
+            conn.close()
+
+    async def close(self):
+        if self.owns_writer:
+            await asyncio.to_thread(self.writer.stop)
+
+    async def create_tables(self, statements: List[str]):
+        def create(conn: sqlite3.Connection):
+            for statement in statements:
+                conn.execute(statement.format(**self.types))
+        await self.writer.submit(create)
+
+    async def execute(self, query: str, *args) -> int:
+        return await self.writer.submit(_execute(query, args))
+
+    async def insert(self, query: str, *args) -> int:
+        return await self.writer.submit(_insert(query, args))
+
+    async def fetch(self, query: str, *args) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._read, query, args)
+
+    @asynccontextmanager
+    async def transaction(self, lock: str) -> AsyncIterator["SqlStore"]:
+        # O writer já serializa todas as escritas do arquivo: a transação é
+        # uma escrita do lote (num SAVEPOINT), sem BEGIN IMMEDIATE próprio
+        tx = _WriterTransaction(asyncio.get_running_loop())
+        committed = asyncio.ensure_future(self.writer.submit(tx.run))
+        tx.committed = committed
+        try:
+            yield tx
+        except BaseException:
+            tx.finish(commit=False)
+            committed.add_done_callback(lambda f: f.cancelled() or f.exception())
+            raise
+        tx.finish(commit=True)
+        await committed
+
+
+class _Rollback(Exception):
+    pass
+
+
+class _WriterTransaction(SqlStore):
+    """Consultas de uma transação, executadas na thread do writer
+
+    ``run`` ocupa a thread do writer até ``finish``; no bloco da transação
+    não se deve esperar por outras escritas do mesmo banco.
+    """
+
+    types = SqliteSqlStore.types
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.committed: Optional[asyncio.Future] = None
+        self._requests: "queue.Queue" = queue.Queue()
+
+    def run(self, conn: sqlite3.Connection):
+        while True:
+            try:
+                item = self._requests.get(timeout=TRANSACTION_TIMEOUT)
+            except queue.Empty:
+                raise _Rollback("transação abandonada")
+            if item is _COMMIT:
+                return
+            if item is _ROLLBACK:
+                raise _Rollback()
+            func, future = item
+            try:
+                outcome = (True, func(conn))
+            except Exception as e:
+                outcome = (False, e)
+            self.loop.call_soon_threadsafe(_resolve, future, outcome)
+
+    def finish(self, commit: bool):
+        self._requests.put(_COMMIT if commit else _ROLLBACK)
+
+    async def _call(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        future = self.loop.create_future()
+        self._requests.put((func, future))
+        # Se o lote do writer falhar antes de chegar aqui, o erro vem de committed
+        await asyncio.wait({future, self.committed}, return_when=asyncio.FIRST_COMPLETED)
+        if future.done():
+            return future.result()
+        future.cancel()
+        self.committed.result()
+        raise RuntimeError("Transação encerrada antes da consulta")
+
+    async def create_tables(self, statements: List[str]):
+        await self._call(lambda conn: [conn.execute(statement.format(**self.types))
+                                       for statement in statements])
+
+    async def execute(self, query: str, *args) -> int:
+        return await self._call(_execute(query, args))
+
+    async def insert(self, query: str, *args) -> int:
+        return await self._call(_insert(query, args))
+
+    async def fetch(self, query: str, *args) -> List[Dict[str, Any]]:
+        return await self._call(_fetch(query, args))
+
+    def transaction(self, lock: str):
+        raise NotImplementedError("Transações aninhadas não são suportadas")
+
+
+_COMMIT = object()
+_ROLLBACK = object()
+# Tempo máximo que uma transação segura a thread do writer sem nova consulta
+TRANSACTION_TIMEOUT = 30.0
+
+
+def _execute(query: str, args: tuple) -> Callable[[sqlite3.Connection], int]:
+    return lambda conn: conn.execute(query, args).rowcount
+
+
+def _insert(query: str, args: tuple) -> Callable[[sqlite3.Connection], int]:
+    return lambda conn: conn.execute(query, args).lastrowid
+
+
+def _fetch(query: str, args: tuple) -> Callable[[sqlite3.Connection], List[Dict[str, Any]]]:
+    def fetch(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        # A conexão do writer não usa sqlite3.Row: o cursor converte
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        return [dict(row) for row in cursor.execute(query, args)]
+    return fetch
+
+
+def _resolve(future: asyncio.Future, outcome: tuple):
+    if future.done():
+        return
+    ok, value = outcome
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
+
+
+_PLACEHOLDER = re.compile(r"\?")
+
+
+def numbered_placeholders(query: str) -> str:
+    """Converte os marcadores ``?`` em ``$1, $2, ...`` (asyncpg)"""
+    counter = iter(range(1, query.count("?") + 1))
+    return _PLACEHOLDER.sub(lambda _: f"${next(counter)}", query)
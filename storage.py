@@ -0,0 +1,373 @@
+import itertools
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, AsyncIterator
+
+from access import active_members
+from sql_store import SqlStore, SqliteSqlStore
+
+
+class PaymentOwnerMismatch(Exception):
+    """O pagamento já renovou a assinatura de outro usuário"""
+
+    def __init__(self, payment_id: str, owner_id: int, user_id: int):
+        super().__init__(f"Pagamento {payment_id} pertence a {owner_id}, não a {user_id}")
+        self.payment_id = payment_id
+        self.owner_id = owner_id
+        self.user_id = user_id
+
+
+class StorageBackend(ABC):
+    """Interface de persistência usada pelo bot e pelo webhook
+
+    Implementações: ``Database`` (SQLite, padrão), ``MemoryDatabase``
+    (testes e benchmarks) e ``PostgresDatabase`` (asyncpg com pool).
+    Datas são sempre devolvidas como ``datetime``. ``sql`` dá acesso às
+    tabelas auxiliares (convites, broadcasts, roster, outbox) no mesmo
+    banco, para que elas sigam ``DATABASE_BACKEND`` junto com o resto.
+    """
+
+    sql: SqlStore
+
+    async def connect(self):
+        """Prepara conexões e esquema (opcional para backends síncronos)"""
+
+    async def close(self):
+        """Libera conexões"""
+
+    @abstractmethod
+    async def renew_subscription(self, user_id: int, username: Optional[str],
+                                 first_name: Optional[str], last_name: Optional[str],
+                                 plan_type: str, days: int, payment_id: str) -> Optional[datetime]:
+        """Cria ou estende a assinatura do usuário (uma linha por usuário)
+
+        Uma renovação antecipada soma ``days`` ao tempo restante; uma
+        assinatura vencida recomeça a contar de agora. Cada pagamento entra
+        uma única vez no histórico (``subscription_ledger``): repetir o
+        mesmo ``payment_id`` não estende de novo. Retorna a expiração
+        resultante, ou None em caso de erro. Levanta ``PaymentOwnerMismatch``
+        se o pagamento já foi aplicado a outro usuário.
+        """
+
+    @abstractmethod
+    async def get_subscription(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Obtém a assinatura ativa de um usuário"""
+
+    @abstractmethod
+    async def update_subscription_status(self, user_id: int, status: str) -> bool:
+        """Atualiza o status de uma assinatura"""
+
+    @abstractmethod
+    async def get_active_members(self) -> List[tuple]:
+        """Obtém (user_id, expiration_date) das assinaturas vigentes
+
+        Um erro de leitura levanta exceção: a auditoria remove membros com
+        base nesta lista, e uma lista vazia por falha removeria todos.
+        """
+
+    @abstractmethod
+    async def get_active_user_ids_page(self, after_user_id: int, limit: int) -> List[int]:
+        """Obtém uma página de user_ids ativos, em ordem, após ``after_user_id``
+
+        Página vazia significa fim da lista; erro de leitura levanta exceção
+        (não pode ser confundido com o fim).
+        """
+
+    @abstractmethod
+    async def get_expired_subscriptions(self) -> List[Dict[str, Any]]:
+        """Obtém todas as assinaturas expiradas"""
+
+    @abstractmethod
+    async def get_subscriptions_expiring_soon(self, days: int) -> List[Dict[str, Any]]:
+        """Obtém assinaturas que expiram em X dias"""
+
+    @abstractmethod
+    def iter_expired_subscriptions(self, page_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Percorre as assinaturas expiradas, lidas em páginas de ``page_size``
+
+        As páginas seguem (expiration_date, user_id) a partir da última
+        linha lida (keyset), então mudar o status das linhas já entregues
+        não desloca as seguintes. Uma página que não pode ser lida (após
+        ``DB_PAGE_READ_ATTEMPTS`` leituras) levanta exceção.
+        """
+
+    @abstractmethod
+    def iter_subscriptions_expiring_soon(self, days: int,
+                                         page_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Percorre as assinaturas que expiram em X dias, em páginas (keyset)"""
+
+    @abstractmethod
+    async def add_payment(self, user_id: int, payment_id: str, plan_type: str,
+                          amount: float, pix_code: str, qr_code_base64: Optional[str] = None,
+                          locale: Optional[str] = None) -> bool:
+        """Adiciona um novo pagamento (com a imagem do QR, se o Mercado Pago enviou)
+
+        ``locale`` é o idioma do usuário, usado nas mensagens enviadas
+        quando o webhook aprova o pagamento.
+        """
+
+    @abstractmethod
+    async def update_payment_status(self, payment_id: str, status: str) -> bool:
+        """Atualiza o status de um pagamento"""
+
+    @abstractmethod
+    async def get_payment_by_id(self, payment_id: str) -> Optional[Dict[str, Any]]:
+        """Obtém um pagamento pelo ID"""
+
+    @abstractmethod
+    async def set_payment_message(self, payment_id: str, chat_id: int, message_id: int) -> bool:
+        """Grava a mensagem do Telegram que mostra o pagamento (editada na aprovação)"""
+
+    @abstractmethod
+    async def set_payment_qr_file_id(self, payment_id: str, file_id: str) -> bool:
+        """Grava o ``file_id`` da foto do QR já enviada ao Telegram (reenvio sem upload)"""
+
+    @abstractmethod
+    async def get_sales_summary(self) -> Dict[str, Any]:
+        """Obtém resumo de vendas para o admin"""
+
+    @abstractmethod
+    async def add_notification(self, user_id: int, notification_type: str) -> bool:
+        """Registra uma notificação enviada"""
+
+    @abstractmethod
+    async def has_recent_notification(self, user_id: int, notification_type: str,
+                                      hours: int = 24) -> bool:
+        """Verifica se uma notificação foi enviada recentemente"""
+
+
+def _keyset(subscription: Dict[str, Any]) -> tuple:
+    """Ordem das varreduras paginadas: (expiration_date, user_id)"""
+    return subscription['expiration_date'], subscription['user_id']
+
+
+class MemoryDatabase(StorageBackend):
+    """Backend em memória para testes e benchmarks
+
+    As tabelas auxiliares (``sql``) ficam num SQLite temporário, apagado
+    em ``close()``. Bot e webhook dividem a instância a partir de threads
+    diferentes, então a renovação (ler e gravar) é feita sob um lock.
+    """
+
+    def __init__(self):
+        self.subscriptions: Dict[int, Dict[str, Any]] = {}
+        self.ledger: Dict[str, Dict[str, Any]] = {}
+        self.payments: Dict[str, Dict[str, Any]] = {}
+        self.notifications: List[Dict[str, Any]] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        fd, self.sql_path = tempfile.mkstemp(prefix="memory-", suffix=".db")
+        os.close(fd)
+        self.sql = SqliteSqlStore(self.sql_path)
+
+    async def close(self):
+        await self.sql.close()
+        if os.path.exists(self.sql_path):
+            os.remove(self.sql_path)
+
+    async def renew_subscription(self, user_id: int, username: Optional[str],
+                                 first_name: Optional[str], last_name: Optional[str],
+                                 plan_type: str, days: int, payment_id: str) -> Optional[datetime]:
+        with self._lock:
+            return self._renew(user_id, username, first_name, last_name, plan_type, days,
+                               payment_id)
+
+    def _renew(self, user_id: int, username: Optional[str], first_name: Optional[str],
+               last_name: Optional[str], plan_type: str, days: int,
+               payment_id: str) -> datetime:
+        applied = self.ledger.get(payment_id)
+        if applied:
+            if applied['user_id'] != user_id:
+                raise PaymentOwnerMismatch(payment_id, applied['user_id'], user_id)
+            return applied['expiration_date']
+
+        now = datetime.now()
+        current = self.subscriptions.get(user_id)
+        extending = (current is not None and current['status'] == 'active'
+                     and current['expiration_date'] > now)
+        previous = current['expiration_date'] if current else None
+        expiration_date = (previous if extending else now) + timedelta(days=days)
+
+        if current is None:
+            current = self.subscriptions[user_id] = {'user_id': user_id, 'created_at': now}
+        for key, value in (('username', username), ('first_name', first_name),
+                           ('last_name', last_name)):
+            if value is not None or key not in current:
+                current[key] = value
+        current.update({
+            'plan_type': plan_type,
+            'payment_date': current['payment_date'] if extending else now,
+            'expiration_date': expiration_date,
+            'payment_id': payment_id,
+            'status': 'active',
+            'updated_at': now
+        })
+        self.ledger[payment_id] = {
+            'id': next(self._ids),
+            'user_id': user_id,
+            'payment_id': payment_id,
+            'plan_type': plan_type,
+            'days': days,
+            'previous_expiration': previous,
+            'expiration_date': expiration_date,
+            'created_at': now
+        }
+        active_members.add(user_id, expiration_date)
+        return expiration_date
+
+    async def get_subscription(self, user_id: int) -> Optional[Dict[str, Any]]:
+        subscription = self.subscriptions.get(user_id)
+        if subscription is None or subscription['status'] != 'active':
+            return None
+        return dict(subscription)
+
+    async def update_subscription_status(self, user_id: int, status: str) -> bool:
+        subscription = self.subscriptions.get(user_id)
+        if subscription is not None and subscription['status'] == 'active':
+            subscription['status'] = status
+            subscription['updated_at'] = datetime.now()
+        if status != 'active':
+            active_members.discard(user_id)
+        return True
+
+    async def get_active_members(self) -> List[tuple]:
+        now = datetime.now()
+        return [(s['user_id'], s['expiration_date']) for s in self.subscriptions.values()
+                if s['status'] == 'active' and s['expiration_date'] > now]
+
+    async def get_active_user_ids_page(self, after_user_id: int, limit: int) -> List[int]:
+        now = datetime.now()
+        user_ids = sorted(s['user_id'] for s in self.subscriptions.values()
+                          if s['status'] == 'active' and s['expiration_date'] > now
+                          and s['user_id'] > after_user_id)
+        return user_ids[:limit]
+
+    async def get_expired_subscriptions(self) -> List[Dict[str, Any]]:
+        now = datetime.now()
+        return [dict(s) for s in self.subscriptions.values()
+                if s['expiration_date'] < now and s['status'] == 'active']
+
+    async def get_subscriptions_expiring_soon(self, days: int) -> List[Dict[str, Any]]:
+        now = datetime.now()
+        target_date = now + timedelta(days=days)
+        return [dict(s) for s in self.subscriptions.values()
+                if now <= s['expiration_date'] <= target_date and s['status'] == 'active']
+
+    async def iter_expired_subscriptions(self, page_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        for subscription in sorted(await self.get_expired_subscriptions(), key=_keyset):
+            yield subscription
+
+    async def iter_subscriptions_expiring_soon(self, days: int,
+                                               page_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        for subscription in sorted(await self.get_subscriptions_expiring_soon(days), key=_keyset):
+            yield subscription
+
+    async def add_payment(self, user_id: int, payment_id: str, plan_type: str,
+                          amount: float, pix_code: str, qr_code_base64: Optional[str] = None,
+                          locale: Optional[str] = None) -> bool:
+        now = datetime.now()
+        self.payments[payment_id] = {
+            'id': next(self._ids),
+            'user_id': user_id,
+            'payment_id': payment_id,
+            'plan_type': plan_type,
+            'amount': amount,
+            'status': 'pending',
+            'pix_code': pix_code,
+            'qr_code_base64': qr_code_base64,
+            'locale': locale,
+            'qr_file_id': None,
+            'chat_id': None,
+            'message_id': None,
+            'created_at': now,
+            'updated_at': now
+        }
+        return True
+
+    async def update_payment_status(self, payment_id: str, status: str) -> bool:
+        payment = self.payments.get(payment_id)
+        if payment:
+            payment['status'] = status
+            payment['updated_at'] = datetime.now()
+        return True
+
+    async def get_payment_by_id(self, payment_id: str) -> Optional[Dict[str, Any]]:
+        payment = self.payments.get(payment_id)
+        return dict(payment) if payment else None
+
+    async def set_payment_message(self, payment_id: str, chat_id: int, message_id: int) -> bool:
+        payment = self.payments.get(payment_id)
+        if payment:
+            payment['chat_id'] = chat_id
+            payment['message_id'] = message_id
+        return True
+
+    async def set_payment_qr_file_id(self, payment_id: str, file_id: str) -> bool:
+        payment = self.payments.get(payment_id)
+        if payment:
+            payment['qr_file_id'] = file_id
+        return True
+
+    async def get_sales_summary(self) -> Dict[str, Any]:
+        approved = [p for p in self.payments.values() if p['status'] == 'approved']
+        by_plan: Dict[str, List[float]] = {}
+        for payment in approved:
+            by_plan.setdefault(payment['plan_type'], []).append(payment['amount'])
+
+        return {
+            'active_subscriptions': sum(1 for s in self.subscriptions.values() if s['status'] == 'active'),
+            'expired_subscriptions': sum(1 for s in self.subscriptions.values() if s['status'] == 'expired'),
+            'total_sales': len(approved),
+            'total_revenue': sum(p['amount'] for p in approved),
+            'sales_by_plan': [(plan, len(amounts), sum(amounts))
+                              for plan, amounts in sorted(by_plan.items())]
+        }
+
+    async def add_notification(self, user_id: int, notification_type: str) -> bool:
+        self.notifications.append({
+            'id': next(self._ids),
+            'user_id': user_id,
+            'notification_type': notification_type,
+            'sent_at': datetime.now()
+        })
+        return True
+
+    async def has_recent_notification(self, user_id: int, notification_type: str,
+                                      hours: int = 24) -> bool:
+        since = datetime.now() - timedelta(hours=hours)
+        return any(n['user_id'] == user_id and n['notification_type'] == notification_type
+                   and n['sent_at'] > since for n in self.notifications)
+
+
+def create_database(backend: Optional[str] = None) -> StorageBackend:
+    """Cria um backend (o de ``DATABASE_BACKEND`` por padrão)
+
+    Serviços do bot e do webhook usam ``get_database()``; crie instâncias
+    próprias só em ferramentas e testes.
+    """
+    from config import DATABASE_BACKEND, DATABASE_PATH, DATABASE_URL
+
+    backend = backend or DATABASE_BACKEND
+    if backend == "sqlite":
+        from database import Database
+        return Database(DATABASE_PATH)
+    if backend == "memory":
+        return MemoryDatabase()
+    if backend == "postgres":
+        from database_postgres import PostgresDatabase
+        return PostgresDatabase(DATABASE_URL)
+    raise ValueError(f"Backend de banco inválido: {backend}")
+
+
+@lru_cache(maxsize=None)
+def get_database() -> StorageBackend:
+    """Backend compartilhado por bot, webhook e serviços do mesmo processo
+
+    Com ``DATABASE_BACKEND=memory`` instâncias separadas seriam bancos
+    separados: o pagamento gravado pelo bot não existiria para o webhook.
+    """
+    return create_database()
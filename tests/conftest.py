@@ -0,0 +1,52 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from storage import MemoryDatabase
+
+# PostgreSQL só roda com TEST_DATABASE_URL apontando para um banco descartável:
+# o esquema public é recriado a cada teste
+BACKENDS = ["sqlite", "memory", "postgres"]
+
+
+async def create_backend(name: str, tmp_path):
+    if name == "sqlite":
+        return Database(str(tmp_path / "test.db"))
+    if name == "memory":
+        return MemoryDatabase()
+
+    import asyncpg
+    from database_postgres import PostgresDatabase
+
+    url = os.environ["TEST_DATABASE_URL"]
+    conn = await asyncpg.connect(url)
+    try:
+        await conn.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public")
+    finally:
+        await conn.close()
+    return PostgresDatabase(url)
+
+
+@pytest.fixture(params=BACKENDS)
+def run(request, tmp_path):
+    """Executa ``test(db)`` num event loop novo, com um banco vazio do backend"""
+    if request.param == "postgres":
+        pytest.importorskip("asyncpg")
+        if not os.getenv("TEST_DATABASE_URL"):
+            pytest.skip("TEST_DATABASE_URL não definido")
+
+    def runner(test):
+        async def main():
+            db = await create_backend(request.param, tmp_path)
+            try:
+                return await test(db)
+            finally:
+                await db.close()
+        return asyncio.run(main())
+
+    return runner
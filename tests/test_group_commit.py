@@ -0,0 +1,79 @@
+"""Group commit: nenhuma escrita fica esperando quando a conexão falha"""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+from group_commit import GroupCommitWriter
+
+
+def test_connect_failure_reaches_every_caller_and_recovers(tmp_path):
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError("unable to open database file")
+        return sqlite3.connect(str(tmp_path / "test.db"), check_same_thread=False)
+
+    async def main():
+        writer = GroupCommitWriter(connect)
+        try:
+            results = await asyncio.wait_for(asyncio.gather(
+                *(writer.submit(lambda conn: 1) for _ in range(5)), return_exceptions=True
+            ), timeout=5)
+            assert all(isinstance(result, sqlite3.OperationalError) for result in results)
+
+            # O próximo submit abre uma thread (e uma conexão) nova
+            assert await asyncio.wait_for(writer.submit(lambda conn: 2), timeout=5) == 2
+        finally:
+            writer.stop()
+
+    asyncio.run(main())
+
+
+class _FailingRollback:
+    """Conexão cujo COMMIT e ROLLBACK falham na primeira vez"""
+
+    def __init__(self, conn: sqlite3.Connection, fail: list):
+        self.conn = conn
+        self.fail = fail
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __setattr__(self, name, value):
+        if name in ("conn", "fail"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.conn, name, value)
+
+    def execute(self, sql, *args):
+        if sql in ("COMMIT", "ROLLBACK") and self.fail:
+            if sql == "ROLLBACK":
+                self.fail.clear()
+            raise sqlite3.OperationalError(f"{sql} falhou")
+        return self.conn.execute(sql, *args)
+
+
+def test_failed_rollback_reopens_the_connection(tmp_path):
+    fail = [True]
+    connections = []
+
+    def connect():
+        connections.append(1)
+        conn = sqlite3.connect(str(tmp_path / "test.db"), check_same_thread=False)
+        return _FailingRollback(conn, fail) if len(connections) == 1 else conn
+
+    async def main():
+        writer = GroupCommitWriter(connect)
+        try:
+            with pytest.raises(sqlite3.OperationalError):
+                await asyncio.wait_for(writer.submit(lambda conn: 1), timeout=5)
+            assert await asyncio.wait_for(writer.submit(lambda conn: 2), timeout=5) == 2
+            assert len(connections) == 2
+        finally:
+            writer.stop()
+
+    asyncio.run(main())
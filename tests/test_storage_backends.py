@@ -0,0 +1,234 @@
+"""Conformidade dos backends: o mesmo comportamento em SQLite, memória e PostgreSQL"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from broadcast import BroadcastStore
+from events import EventBus
+from invite_pool import InviteLinkPool
+from membership_audit import GroupRoster
+from storage import PaymentOwnerMismatch
+
+
+def close_to(value: datetime, expected: datetime, seconds: float = 5) -> bool:
+    return abs((value - expected).total_seconds()) < seconds
+
+
+async def renew(db, user_id, payment_id, days=30, **names):
+    return await db.renew_subscription(
+        user_id=user_id, username=names.get("username"), first_name=names.get("first_name"),
+        last_name=names.get("last_name"), plan_type="monthly", days=days, payment_id=payment_id
+    )
+
+
+def test_renew_creates_subscription_once_per_payment(run):
+    async def test(db):
+        expiration = await renew(db, 1, "p1")
+        assert close_to(expiration, datetime.now() + timedelta(days=30))
+        assert await renew(db, 1, "p1") == expiration
+
+        subscription = await db.get_subscription(1)
+        assert subscription["expiration_date"] == expiration
+        assert subscription["payment_id"] == "p1"
+        assert isinstance(subscription["payment_date"], datetime)
+    run(test)
+
+
+def test_payment_renews_only_its_own_user(run):
+    async def test(db):
+        await renew(db, 1, "p1")
+        with pytest.raises(PaymentOwnerMismatch):
+            await renew(db, 2, "p1")
+        assert await db.get_subscription(2) is None
+    run(test)
+
+
+def test_early_renewal_adds_to_remaining_time(run):
+    async def test(db):
+        first = await renew(db, 1, "p1")
+        started = (await db.get_subscription(1))["payment_date"]
+
+        assert await renew(db, 1, "p2") == first + timedelta(days=30)
+        assert (await db.get_subscription(1))["payment_date"] == started
+    run(test)
+
+
+def test_renewal_after_expiry_restarts_now(run):
+    async def test(db):
+        await renew(db, 1, "p1", days=-1)
+        expiration = await renew(db, 1, "p2")
+        assert close_to(expiration, datetime.now() + timedelta(days=30))
+    run(test)
+
+
+def test_renewal_without_names_keeps_stored_names(run):
+    async def test(db):
+        await renew(db, 1, "p1", username="ana", first_name="Ana")
+        await renew(db, 1, "p2")
+        subscription = await db.get_subscription(1)
+        assert (subscription["username"], subscription["first_name"]) == ("ana", "Ana")
+    run(test)
+
+
+def test_status_change_hides_subscription(run):
+    async def test(db):
+        await renew(db, 1, "p1")
+        assert await db.update_subscription_status(1, "expired")
+        assert await db.get_subscription(1) is None
+        assert await db.get_active_members() == []
+        assert (await db.get_sales_summary())["expired_subscriptions"] == 1
+    run(test)
+
+
+def test_active_members_and_id_pages(run):
+    async def test(db):
+        for user_id in (5, 3, 9, 1):
+            await renew(db, user_id, f"p{user_id}")
+        await renew(db, 7, "p7", days=-1)
+
+        assert sorted(user_id for user_id, _ in await db.get_active_members()) == [1, 3, 5, 9]
+        assert await db.get_active_user_ids_page(0, 2) == [1, 3]
+        assert await db.get_active_user_ids_page(3, 2) == [5, 9]
+        assert await db.get_active_user_ids_page(9, 2) == []
+    run(test)
+
+
+def test_expired_scan_follows_keyset_while_rows_change(run):
+    async def test(db):
+        for user_id in range(1, 6):
+            await renew(db, user_id, f"p{user_id}", days=-user_id)
+        await renew(db, 10, "p10")
+
+        seen = []
+        async for subscription in db.iter_expired_subscriptions(page_size=2):
+            seen.append(subscription["user_id"])
+            # Mudar o status do que já foi entregue não desloca as páginas seguintes
+            await db.update_subscription_status(subscription["user_id"], "expired")
+        assert seen == [5, 4, 3, 2, 1]
+        assert [s["user_id"] for s in await db.get_expired_subscriptions()] == []
+    run(test)
+
+
+def test_expiring_soon_scan(run):
+    async def test(db):
+        await renew(db, 1, "p1", days=2)
+        await renew(db, 2, "p2", days=1)
+        await renew(db, 3, "p3", days=30)
+
+        seen = [s["user_id"] async for s in db.iter_subscriptions_expiring_soon(3, page_size=1)]
+        assert seen == [2, 1]
+        assert sorted(s["user_id"] for s in await db.get_subscriptions_expiring_soon(3)) == [1, 2]
+    run(test)
+
+
+def test_payment_roundtrip(run):
+    async def test(db):
+        assert await db.add_payment(1, "p1", "monthly", 29.9, "pix", qr_code_base64="aW1n",
+                                    locale="en")
+        assert await db.update_payment_status("p1", "approved")
+        assert await db.set_payment_message("p1", 100, 200)
+        assert await db.set_payment_qr_file_id("p1", "file-1")
+
+        payment = await db.get_payment_by_id("p1")
+        assert (payment["user_id"], payment["status"], payment["pix_code"]) == (1, "approved", "pix")
+        assert (payment["chat_id"], payment["message_id"]) == (100, 200)
+        assert (payment["qr_code_base64"], payment["qr_file_id"]) == ("aW1n", "file-1")
+        assert payment["locale"] == "en"
+        assert await db.get_payment_by_id("desconhecido") is None
+    run(test)
+
+
+def test_sales_summary(run):
+    async def test(db):
+        await db.add_payment(1, "p1", "monthly", 29.9, "pix")
+        await db.add_payment(2, "p2", "yearly", 299.9, "pix")
+        await db.add_payment(3, "p3", "monthly", 29.9, "pix")
+        for payment_id in ("p1", "p2", "p3"):
+            await db.update_payment_status(payment_id, "approved")
+        await renew(db, 1, "p1")
+
+        summary = await db.get_sales_summary()
+        assert summary["active_subscriptions"] == 1
+        assert summary["total_sales"] == 3
+        assert summary["total_revenue"] == pytest.approx(359.7)
+        assert [(plan, count) for plan, count, _ in summary["sales_by_plan"]] == [
+            ("monthly", 2), ("yearly", 1)
+        ]
+    run(test)
+
+
+def test_recent_notifications(run):
+    async def test(db):
+        assert await db.add_notification(1, "renewal_3d")
+        assert await db.has_recent_notification(1, "renewal_3d")
+        assert not await db.has_recent_notification(1, "renewal_1d")
+        assert not await db.has_recent_notification(2, "renewal_3d")
+    run(test)
+
+
+def test_invite_pool_reserves_one_link_per_payment(run):
+    async def test(db):
+        pool = InviteLinkPool(db.sql)
+        expires_at = datetime.now() + timedelta(hours=48)
+        await pool.add("https://t.me/+a", expires_at)
+        await pool.add("https://t.me/+b", expires_at + timedelta(minutes=1))
+        await pool.add("https://t.me/+curto", datetime.now() + timedelta(hours=1))
+        assert await pool.count_available() == 2
+
+        assert await pool.take(1, "p1") == "https://t.me/+a"
+        assert await pool.take(1, "p1") == "https://t.me/+a"
+        assert await pool.take(2, "p2") == "https://t.me/+b"
+        assert await pool.take(3, "p3") is None
+
+        assignment = await pool.get_assignment("https://t.me/+b")
+        assert (assignment["user_id"], assignment["payment_id"]) == (2, "p2")
+        assert isinstance(assignment["assigned_at"], datetime)
+    run(test)
+
+
+def test_broadcast_checkpoints(run):
+    async def test(db):
+        store = BroadcastStore(db.sql)
+        first = await store.create("oi", 10, 20)
+        second = await store.create("tchau", 10, 21)
+        assert first != second
+
+        await store.checkpoint(first, 500, 40, 2)
+        await store.checkpoint(second, 900, 90, 0, status="done")
+
+        broadcast = await store.get(first)
+        assert (broadcast["text"], broadcast["last_user_id"], broadcast["sent"]) == ("oi", 500, 40)
+        assert [b["id"] for b in await store.get_running()] == [first]
+    run(test)
+
+
+def test_group_roster(run):
+    async def test(db):
+        roster = GroupRoster(db.sql)
+        await roster.update(1, "member")
+        await roster.update(2, "restricted")
+        await roster.update(3, "member", is_bot=True)
+        await roster.update(4, "member")
+        await roster.update(4, "left")
+        assert await roster.get_member_ids() == {1, 2}
+    run(test)
+
+
+def test_event_outbox_dedupes_and_delivers(run):
+    async def test(db):
+        bus = EventBus(db.sql)
+        delivered = []
+
+        async def handler(payload):
+            delivered.append(payload["payment_id"])
+        bus.subscribe("payment_approved", handler)
+
+        assert await bus.publish("payment_approved", {"payment_id": "p1"}, dedupe_key="p1")
+        assert not await bus.publish("payment_approved", {"payment_id": "p1"}, dedupe_key="p1")
+        assert await bus.publish("payment_approved", {"payment_id": "p2"}, dedupe_key="p2")
+
+        assert await bus.dispatch() == 2
+        assert delivered == ["p1", "p2"]
+        assert await bus.dispatch() == 0
+    run(test)
@@ -0,0 +1,89 @@
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from config import THROTTLE_RULES
+from metrics import metrics
+from ratelimit import KeyedRateLimiter
+
+metrics.describe("throttle_passed_total", "Updates liberados pelo throttling, por ação")
+metrics.describe("throttle_dropped_total", "Updates descartados por excesso de taxa, por ação")
+metrics.describe("throttle_coalesced_total", "Updates repetidos enquanto a mesma ação estava em andamento")
+
+# Ações genéricas (sem regra própria): agrupam updates diferentes, então não são coalescidas
+FALLBACK_ACTIONS = {"callback", "message"}
+
+
+def get_action(event: TelegramObject) -> str:
+    """Identifica a ação de um update para escolher o limite aplicado"""
+    if isinstance(event, CallbackQuery):
+        data = event.data or ""
+        for action in THROTTLE_RULES:
+            if data == action or data.startswith(action + "_"):
+                return action
+        return "callback"
+    if isinstance(event, Message) and event.text and event.text.startswith("/"):
+        command = event.text.split()[0][1:].split("@")[0]
+        if command in THROTTLE_RULES:
+            return command
+    return "message"
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Limita updates por usuário e por ação com token buckets em memória
+
+    Updates acima do limite são descartados; cliques repetidos enquanto a
+    mesma ação do mesmo usuário ainda está em andamento são agrupados
+    (coalesced) no processamento em curso. Callbacks descartados recebem
+    apenas um ``answer`` curto, sem tocar no banco ou no Mercado Pago.
+    Updates sem regra própria (``FALLBACK_ACTIONS``) só passam pelo limite
+    de taxa: um clique em "Cancelar" nunca é descartado porque outro
+    callback sem regra ainda está em andamento.
+    """
+
+    def __init__(self, rules: Dict[str, Tuple[float, float]] = THROTTLE_RULES,
+                 max_users: int = 10000, idle_ttl: float = 600.0):
+        self.limiters = {
+            action: KeyedRateLimiter(rate, burst, max_keys=max_users, idle_ttl=idle_ttl)
+            for action, (rate, burst) in rules.items()
+        }
+        self.in_flight = set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        action = get_action(event)
+        limiter = self.limiters.get(action)
+        if limiter is None:
+            limiter = self.limiters["default"]
+        key = (user.id, action)
+        coalesce = action not in FALLBACK_ACTIONS
+
+        if coalesce and key in self.in_flight:
+            metrics.inc("throttle_coalesced_total", action=action)
+            if isinstance(event, CallbackQuery):
+                await event.answer("⏳ Processando, aguarde...")
+            return None
+
+        if not limiter.allow(user.id):
+            metrics.inc("throttle_dropped_total", action=action)
+            if isinstance(event, CallbackQuery):
+                await event.answer("⚠️ Muitas tentativas. Aguarde alguns segundos.")
+            return None
+
+        metrics.inc("throttle_passed_total", action=action)
+        if not coalesce:
+            return await handler(event, data)
+        self.in_flight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight.discard(key)
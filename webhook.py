@@ -1,29 +1,156 @@
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import json
-from typing import Dict, Any
-from payments import PaymentManager
-from database import Database
-from config import DATABASE_PATH, GROUP_INVITE_LINK
+from typing import Dict, Any, Optional
+from functools import lru_cache
+from payments import get_payment_manager
+from storage import get_database
+from config import (
+    GROUP_INVITE_LINK, WEBHOOK_RATE_LIMIT, WEBHOOK_RATE_BURST,
+    WEBHOOK_MAX_BODY_BYTES, WEBHOOK_RECORD_FILE
+)
 from datetime import datetime
+import logging
+import time
+import uuid
+from metrics import metrics
+from logging_setup import bind, setup_logging
+from ratelimit import KeyedRateLimiter
+from webhook_security import (
+    is_relevant_event, verify_signature, body_data_id, get_webhook_secret, client_source
+)
+from invite_pool import InviteLinkPool
+from events import PAYMENT_APPROVED, get_event_bus
+from webhook_recorder import WebhookRecorder
+from loop_monitor import monitors, start_loop_monitor
 import asyncio
 
 app = FastAPI()
-payment_manager = PaymentManager()
-db = Database(DATABASE_PATH)
+logger = logging.getLogger(__name__)
+
+# Instâncias criadas no primeiro uso, não na importação do módulo
+def get_db():
+    """Backend compartilhado com o bot (mesma instância no processo)"""
+    return get_database()
+
+@lru_cache(maxsize=None)
+def get_invite_pool() -> InviteLinkPool:
+    return InviteLinkPool(get_db().sql)
+
+@lru_cache(maxsize=None)
+def get_recorder() -> Optional[WebhookRecorder]:
+    """Recorder de webhooks para replay (só com WEBHOOK_RECORD_FILE definido)"""
+    if not WEBHOOK_RECORD_FILE:
+        return None
+    return WebhookRecorder(WEBHOOK_RECORD_FILE)
+
+# Limite de requisições por origem (IP real, atrás de WEBHOOK_TRUSTED_PROXIES)
+source_limiter = KeyedRateLimiter(WEBHOOK_RATE_LIMIT, WEBHOOK_RATE_BURST)
+
+metrics.describe("webhook_rejected_total", "Webhooks descartados antes do processamento, por motivo")
+metrics.describe("webhook_accepted_total", "Webhooks que passaram pelos filtros")
+
+@app.on_event("startup")
+async def on_startup():
+    """Inicia o monitor do event loop do servidor webhook"""
+    start_loop_monitor("webhook")
+    if get_webhook_secret() is None:
+        logger.warning("MP_WEBHOOK_SECRET não definido: assinaturas dos webhooks NÃO são "
+                       "verificadas e qualquer requisição é aceita")
+
+def reject(reason: str, status_code: int) -> JSONResponse:
+    """Descarta uma requisição de webhook de forma barata"""
+    metrics.inc("webhook_rejected_total", reason=reason)
+    return JSONResponse(status_code=status_code, content={"status": reason})
 
 @app.post("/webhook")
 async def mercadopago_webhook(request: Request):
     """Endpoint para receber webhooks do Mercado Pago"""
+    recorder = get_recorder()
+    if recorder is None:
+        return await handle_webhook(request)
+    
+    started = time.perf_counter()
+    response = await handle_webhook(request)
+    duration = time.perf_counter() - started
+    
+    # Corpo acima do limite não é lido (nem para a captura)
+    body = await request.body() if content_length(request) is not None else b""
+    recorder.record(
+        source=request_source(request),
+        query=request.query_params,
+        headers=request.headers,
+        body=body,
+        status_code=response.status_code,
+        duration=duration
+    )
+    return response
+
+def request_source(request: Request) -> str:
+    """Origem da requisição (IP do cliente, mesmo atrás do proxy reverso)"""
+    return client_source(request.client.host if request.client else None, request.headers)
+
+def content_length(request: Request) -> Optional[int]:
+    """Content-Length declarado, se existir e couber em WEBHOOK_MAX_BODY_BYTES"""
     try:
-        # Lê o corpo da requisição
+        length = int(request.headers.get("content-length", ""))
+    except ValueError:
+        return None
+    return length if 0 <= length <= WEBHOOK_MAX_BODY_BYTES else None
+
+async def handle_webhook(request: Request) -> JSONResponse:
+    """Filtra, valida e processa um webhook do Mercado Pago"""
+    try:
+        bind(
+            request_id=request.headers.get("x-request-id") or uuid.uuid4().hex,
+            payment_id=request.query_params.get("data.id")
+        )
+        if not source_limiter.allow(request_source(request)):
+            return reject("rate_limited", 429)
+        
+        # Tamanho conferido pelo header, antes de ler o corpo
+        if "content-length" not in request.headers:
+            return reject("length_required", 411)
+        if content_length(request) is None:
+            return reject("too_large", 413)
         body = await request.body()
+        if len(body) > WEBHOOK_MAX_BODY_BYTES:
+            return reject("too_large", 413)
+        
+        # Eventos irrelevantes recebem 200 para o MP não reenviar
+        if not is_relevant_event(body, request.query_params):
+            return reject("ignored_event", 200)
+        
+        if not verify_signature(
+            request.headers.get("x-signature"),
+            request.headers.get("x-request-id"),
+            request.query_params.get("data.id")
+        ):
+            return reject("bad_signature", 401)
+        
         webhook_data = json.loads(body)
         
-        print(f"Webhook recebido: {webhook_data}")
+        # A assinatura cobre o data.id da query; o processado é o do corpo
+        signed_id = request.query_params.get("data.id")
+        processed_id = body_data_id(webhook_data)
+        if processed_id is not None and processed_id != signed_id:
+            # Sem chave configurada nada é assinado; aí só a divergência explícita é recusada
+            if signed_id is not None or get_webhook_secret() is not None:
+                return reject("id_mismatch", 400)
+        
+        metrics.inc("webhook_accepted_total")
+        
+        logger.info("Webhook recebido", extra={"sample": "webhook_received", "event": webhook_data})
         
-        # Processa o webhook
-        result = payment_manager.process_webhook(webhook_data)
+        # Processa o webhook (fora do event loop: a chamada ao MP é síncrona)
+        result = await asyncio.to_thread(get_payment_manager().process_webhook, webhook_data)
+        
+        if result.get("retry_later"):
+            # MP indisponível: 503 faz o Mercado Pago reenviar a notificação depois
+            return JSONResponse(
+                status_code=503,
+                content={"error": result["error"]}
+            )
         
         if not result["success"]:
             return JSONResponse(
@@ -36,7 +163,7 @@ async def mercadopago_webhook(request: Request):
             await process_approved_payment(result)
         
         # Atualiza o status do pagamento no banco
-        await db.update_payment_status(
+        await get_db().update_payment_status(
             result["external_reference"], 
             result["status"]
         )
@@ -47,71 +174,96 @@ async def mercadopago_webhook(request: Request):
         )
         
     except Exception as e:
-        print(f"Erro ao processar webhook: {e}")
+        logger.exception(f"Erro ao processar webhook: {e}")
         return JSONResponse(
             status_code=500,
             content={"error": "Erro interno do servidor"}
         )
 
 async def process_approved_payment(payment_result: Dict[str, Any]):
-    """Processa um pagamento aprovado"""
-    try:
-        # Obtém o pagamento do banco
-        payment = await db.get_payment_by_id(payment_result["external_reference"])
-        
-        if not payment:
-            print(f"Pagamento não encontrado: {payment_result['external_reference']}")
-            return
-        
-        user_id = payment["user_id"]
-        plan_type = payment["plan_type"]
-        
-        # Calcula a data de expiração
-        plan_info = payment_manager.get_plan_info(plan_type)
-        if not plan_info:
-            print(f"Plano não encontrado: {plan_type}")
-            return
-        
-        payment_date = datetime.now()
-        expiration_date = payment_date.replace(
-            day=payment_date.day + plan_info["days"]
-        )
-        
-        # Obtém informações do usuário (você precisará implementar isso)
-        # Por enquanto, vamos usar dados básicos
-        user_info = {
-            "username": f"user_{user_id}",
-            "first_name": "Usuário",
-            "last_name": "Telegram"
-        }
-        
-        # Adiciona a assinatura ao banco
-        success = await db.add_subscription(
-            user_id=user_id,
-            username=user_info["username"],
-            first_name=user_info["first_name"],
-            last_name=user_info["last_name"],
-            plan_type=plan_type,
-            payment_date=payment_date,
-            expiration_date=expiration_date,
-            payment_id=payment_result["external_reference"]
-        )
-        
-        if success:
-            print(f"Assinatura criada para usuário {user_id}")
-            # Aqui você pode adicionar lógica para enviar o link do grupo
-            # via bot do Telegram (implementar no bot.py)
-        else:
-            print(f"Erro ao criar assinatura para usuário {user_id}")
-            
-    except Exception as e:
-        print(f"Erro ao processar pagamento aprovado: {e}")
+    """Processa um pagamento aprovado
+    
+    Falhas ao renovar ou ao gravar o evento levantam exceção, e o webhook
+    responde 500 para o Mercado Pago reenviar. O reenvio é seguro: a
+    renovação é idempotente por payment_id e o evento tem ``dedupe_key``,
+    então uma ativação nunca se perde entre a renovação e o outbox.
+    """
+    # Obtém o pagamento do banco
+    payment = await get_db().get_payment_by_id(payment_result["external_reference"])
+    
+    if not payment:
+        logger.warning(f"Pagamento não encontrado: {payment_result['external_reference']}")
+        return
+    
+    user_id = payment["user_id"]
+    plan_type = payment["plan_type"]
+    
+    # Duração do plano pago
+    plan_info = get_payment_manager().get_plan_info(plan_type)
+    if not plan_info:
+        logger.error(f"Plano não encontrado: {plan_type}")
+        return
+    
+    # Cria ou estende a assinatura; repetições do mesmo pagamento não estendem de novo.
+    # Nome e username ficam como estão (o bot os preenche ao confirmar o pagamento)
+    expiration_date = await get_db().renew_subscription(
+        user_id=user_id,
+        username=None,
+        first_name=None,
+        last_name=None,
+        plan_type=plan_type,
+        days=plan_info["days"],
+        payment_id=payment_result["external_reference"]
+    )
+    if not expiration_date:
+        raise RuntimeError(f"Assinatura do usuário {user_id} não renovada")
+    
+    logger.info(f"Assinatura de {user_id} válida até {expiration_date:%d/%m/%Y}")
+    # Reserva um link de uso único para este pagamento
+    await get_invite_pool().take(user_id, payment_result["external_reference"])
+    # O bot edita a mensagem do pagamento e entrega o link (uma vez por pagamento)
+    await get_event_bus().publish(
+        PAYMENT_APPROVED,
+        {
+            "user_id": user_id,
+            "payment_id": payment_result["external_reference"],
+            "plan_type": plan_type,
+            "expiration_date": expiration_date.isoformat(),
+            "locale": payment.get("locale")
+        },
+        dedupe_key=f"{PAYMENT_APPROVED}:{payment_result['external_reference']}"
+    )
 
 @app.get("/health")
 async def health_check():
-    """Endpoint de verificação de saúde"""
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    """Endpoint de verificação de saúde
+    
+    Só os event loops decidem o status: circuitos abertos indicam falha do
+    Mercado Pago, não deste processo, e reiniciá-lo não ajudaria.
+    """
+    loops = {name: monitor.health() for name, monitor in monitors.items()}
+    circuits = {
+        name: breaker.state for name, breaker in get_payment_manager().breakers.items()
+    }
+    
+    healthy = all(loop["healthy"] for loop in loops.values())
+    
+    return JSONResponse(
+        status_code=200 if healthy else 503,
+        content={
+            "status": "healthy" if healthy else "degraded",
+            "timestamp": datetime.now().isoformat(),
+            "event_loops": loops,
+            "mercadopago_circuits": circuits
+        }
+    )
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Endpoint de métricas no formato Prometheus"""
+    return PlainTextResponse(metrics.render_prometheus())
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    setup_logging()
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None) 
\ No newline at end of file
@@ -0,0 +1,97 @@
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import secrets
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("webhook_recorded_total", "Webhooks gravados pelo recorder, por resultado")
+
+# Campos do corpo mantidos na captura; o resto (ex.: user_id da conta) é descartado
+BODY_FIELDS = {"id", "type", "action", "api_version", "live_mode", "date_created", "data"}
+DATA_FIELDS = {"id"}
+# Headers mantidos; x-signature é derivado da chave secreta e nunca é gravado
+HEADER_FIELDS = {"x-request-id", "content-type"}
+QUERY_FIELDS = {"data.id", "type", "topic", "id"}
+
+
+def sanitize_body(body: bytes) -> Any:
+    """Mantém só os campos de roteamento de um corpo de webhook"""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    clean = {key: value for key, value in data.items() if key in BODY_FIELDS}
+    if isinstance(clean.get("data"), dict):
+        clean["data"] = {key: value for key, value in clean["data"].items() if key in DATA_FIELDS}
+    return clean
+
+
+def pseudonymize(source: str, key: bytes) -> str:
+    """Troca o IP de origem por um apelido estável na captura (preserva o agrupamento)
+
+    HMAC com ``key``: sem a chave, o apelido não é revertido testando
+    todos os IPv4.
+    """
+    return "src-" + hmac.new(key, source.encode(), hashlib.sha256).hexdigest()[:12]
+
+
+class WebhookRecorder:
+    """Grava webhooks recebidos em JSONL para replay (opt-in)
+
+    Cada linha tem o instante relativo ao início da captura, a origem
+    pseudonimizada, query, headers e corpo sanitizados, o status devolvido
+    e a duração do processamento. A escrita em arquivo fica numa thread
+    própria; com a fila cheia o registro é descartado, nunca bloqueia.
+    """
+
+    def __init__(self, path: str, max_queue: int = 10000):
+        self.path = path
+        self.started = time.monotonic()
+        # Chave aleatória por captura, nunca gravada: apelidos não se cruzam entre capturas
+        self._source_key = secrets.token_bytes(32)
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="webhook-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, source: str, query: Mapping[str, str], headers: Mapping[str, str],
+               body: bytes, status_code: int, duration: float):
+        """Enfileira um webhook processado"""
+        entry: Dict[str, Any] = {
+            "t": round(time.monotonic() - self.started, 6),
+            "source": pseudonymize(source, self._source_key),
+            "query": {key: value for key, value in query.items() if key in QUERY_FIELDS},
+            "headers": {key: value for key, value in headers.items() if key in HEADER_FIELDS},
+            "body": sanitize_body(body),
+            "status": status_code,
+            "duration_ms": round(duration * 1000, 3)
+        }
+        try:
+            self._queue.put_nowait(json.dumps(entry, ensure_ascii=False))
+            metrics.inc("webhook_recorded_total", result="queued")
+        except queue.Full:
+            metrics.inc("webhook_recorded_total", result="dropped")
+
+    def close(self, timeout: float = 5.0):
+        """Grava o que estiver na fila e encerra a thread"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as output:
+            while True:
+                line = self._queue.get()
+                if line is None:
+                    return
+                output.write(line + "\n")
+                if self._queue.empty():
+                    output.flush()
@@ -0,0 +1,136 @@
+import hashlib
+import hmac
+import ipaddress
+import re
+import time
+from functools import lru_cache
+from typing import Any, List, Optional, Mapping
+
+from config import MP_WEBHOOK_SECRET, WEBHOOK_SIGNATURE_MAX_AGE, WEBHOOK_TRUSTED_PROXIES
+
+# Eventos que o bot processa; o resto é descartado antes do parse do JSON
+_RELEVANT_BODY = re.compile(rb'"type"\s*:\s*"payment"')
+RELEVANT_TOPICS = {"payment"}
+
+
+@lru_cache(maxsize=1)
+def get_webhook_secret() -> Optional[bytes]:
+    """Obtém a chave secreta do webhook já codificada (uma vez por processo)"""
+    if not MP_WEBHOOK_SECRET:
+        return None
+    return MP_WEBHOOK_SECRET.encode()
+
+
+@lru_cache(maxsize=1)
+def get_trusted_proxies() -> List[Any]:
+    """Redes de WEBHOOK_TRUSTED_PROXIES (uma vez por processo)"""
+    return [ipaddress.ip_network(item.strip(), strict=False)
+            for item in WEBHOOK_TRUSTED_PROXIES.split(",") if item.strip()]
+
+
+def _is_trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in get_trusted_proxies())
+
+
+def client_source(peer: Optional[str], headers: Mapping[str, str]) -> str:
+    """Origem real da requisição, usada como chave do limite por origem
+
+    Só quando a conexão vem de um proxy confiável o ``X-Forwarded-For`` é
+    lido, da direita para a esquerda, pulando os proxies confiáveis: o
+    primeiro endereço restante foi adicionado por um proxy nosso e não
+    pode ser forjado pelo cliente.
+    """
+    if not peer:
+        return "unknown"
+    if not _is_trusted(peer):
+        return peer
+    forwarded = [item.strip() for item in headers.get("x-forwarded-for", "").split(",")
+                 if item.strip()]
+    for address in reversed(forwarded):
+        if not _is_trusted(address):
+            return address
+    return forwarded[0] if forwarded else peer
+
+
+def is_relevant_event(body: bytes, query: Mapping[str, str]) -> bool:
+    """Pré-filtro barato em bytes: só eventos de pagamento seguem adiante"""
+    topic = query.get("type") or query.get("topic")
+    if topic is not None:
+        return topic in RELEVANT_TOPICS
+    return _RELEVANT_BODY.search(body) is not None
+
+
+def parse_signature_header(header: str) -> Optional[tuple]:
+    """Extrai (ts, v1) do header x-signature ("ts=...,v1=...")"""
+    ts = v1 = None
+    for part in header.split(","):
+        key, _, value = part.strip().partition("=")
+        if key == "ts":
+            ts = value
+        elif key == "v1":
+            v1 = value
+    if not ts or not v1:
+        return None
+    return ts, v1
+
+
+def is_fresh(ts: str, now: Optional[float] = None) -> bool:
+    """Verifica se o ``ts`` assinado está dentro de ``WEBHOOK_SIGNATURE_MAX_AGE``
+
+    Aceita segundos ou milissegundos; sem isso uma requisição capturada
+    poderia ser reenviada indefinidamente.
+    """
+    try:
+        value = float(ts)
+    except ValueError:
+        return False
+    if value > 1e11:  # Milissegundos
+        value /= 1000
+    now = time.time() if now is None else now
+    return abs(now - value) <= WEBHOOK_SIGNATURE_MAX_AGE
+
+
+def body_data_id(webhook_data: Any) -> Optional[str]:
+    """``data.id`` do corpo, o ID que de fato é processado"""
+    if not isinstance(webhook_data, dict) or not isinstance(webhook_data.get("data"), dict):
+        return None
+    data_id = webhook_data["data"].get("id")
+    return str(data_id) if data_id is not None else None
+
+
+def verify_signature(x_signature: Optional[str], x_request_id: Optional[str],
+                     data_id: Optional[str]) -> bool:
+    """Valida a assinatura HMAC-SHA256 enviada pelo Mercado Pago
+
+    O manifesto assinado é ``id:<data.id>;request-id:<x-request-id>;ts:<ts>;``
+    (partes ausentes são omitidas, como na documentação do Mercado Pago).
+    O ``data.id`` assinado é o da query string; quem chama deve conferir que
+    ele é o mesmo do corpo (``body_data_id``). ``ts`` fora da janela é recusado.
+    """
+    secret = get_webhook_secret()
+    if secret is None:
+        return True
+    if not x_signature:
+        return False
+
+    parsed = parse_signature_header(x_signature)
+    if parsed is None:
+        return False
+    ts, v1 = parsed
+    if not is_fresh(ts):
+        return False
+
+    manifest = ""
+    if data_id:
+        # IDs alfanuméricos são assinados em minúsculas
+        manifest += f"id:{data_id.lower()};"
+    if x_request_id:
+        manifest += f"request-id:{x_request_id};"
+    manifest += f"ts:{ts};"
+
+    expected = hmac.new(secret, manifest.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, v1)